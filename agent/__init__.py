@@ -1 +1,10 @@
 # CareFlow Agent Package
+
+# .env is loaded once here instead of in every module that reads os.getenv;
+# python-dotenv is optional (production sets real environment variables).
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    pass
+else:
+    load_dotenv()
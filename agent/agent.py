@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 from typing import Any, Dict
 
-from . import firebase_client
+from . import firebase_async
 from . import whatsapp
 from . import alerts
 
 import json
 from .ai_client import ask_ai
+from .log import get_logger
+
+log = get_logger(__name__)
 
 
 class CareFlowAgent:
@@ -59,21 +63,20 @@ class CareFlowAgent:
         if not patient_id:
             raise ValueError("patient_id is required for patient_checkin")
 
-        db = firebase_client.get_firestore()
-        patient = firebase_client.get_patient_by_id(db, patient_id)
+        patient = await firebase_async.get_patient_by_id(patient_id)
 
         if not patient:
             return {"handled": False, "message": "Patient not found", "patient_id": patient_id}
 
         phone = patient.get("phone")
         if phone:
-            whatsapp.send_whatsapp_message(
+            await asyncio.to_thread(
+                whatsapp.send_whatsapp_message,
                 phone=phone,
                 text="👋 Thanks for checking in at CareFlow. We'll keep you updated on your care journey.",
             )
 
-        firebase_client.update_patient(
-            db,
+        await firebase_async.update_patient(
             patient_id,
             {"last_checkin_source": payload.get("source", "portal")},
         )
@@ -88,11 +91,10 @@ class CareFlowAgent:
         if not patient_id:
             raise ValueError("patient_id is required for patient_help_request")
 
-        db = firebase_client.get_firestore()
-        patient = firebase_client.get_patient_by_id(db, patient_id)
+        patient = await firebase_async.get_patient_by_id(patient_id)
 
         alert_message = payload.get("message") or "Patient requested assistance."
-        alerts.notify_doctor_for_patient_help(db=db, patient=patient, message=alert_message)
+        await asyncio.to_thread(alerts.notify_doctor_for_patient_help, patient=patient, message=alert_message)
 
         return {"handled": True, "action": "doctor_alerted", "patient_id": patient_id}
 
@@ -104,20 +106,20 @@ class CareFlowAgent:
         if not patient_id:
             raise ValueError("patient_id is required for lab_result_updated")
 
-        db = firebase_client.get_firestore()
-        patient = firebase_client.get_patient_by_id(db, patient_id)
+        patient = await firebase_async.get_patient_by_id(patient_id)
 
         if not patient:
             return {"handled": False, "message": "Patient not found", "patient_id": patient_id}
 
         phone = patient.get("phone")
         if phone:
-            whatsapp.send_whatsapp_message(
+            await asyncio.to_thread(
+                whatsapp.send_whatsapp_message,
                 phone=phone,
                 text="🧪 Your lab results have been updated in the CareFlow portal.",
             )
 
-        alerts.notify_doctor_for_lab_result(db=db, patient=patient, payload=payload)
+        await asyncio.to_thread(alerts.notify_doctor_for_lab_result, patient=patient, payload=payload)
 
         return {"handled": True, "action": "lab_result_notified", "patient_id": patient_id}
 
@@ -133,7 +135,7 @@ class CareFlowAgent:
         from .scheduler import get_scheduler
         from .question_generator import generate_standard_q1
         from datetime import datetime, timedelta
-        from firebase_admin import firestore
+        from .storage import SERVER_TIMESTAMP
 
         patient_name = payload.get("patient_name") or "Patient"
         patient_email = payload.get("patient_email")
@@ -142,12 +144,10 @@ class CareFlowAgent:
         custom_parameters = payload.get("parameters")
         
         # Get emergency contact from patients collection
-        db = firebase_client.get_firestore()
-        patient_ref = db.collection("patients").document(patient_id)
-        p_snap = patient_ref.get()
+        main_patient = await firebase_async.get_patient_by_id(patient_id)
         emergency_phone = ""
-        if p_snap.exists:
-            emergency_phone = p_snap.to_dict().get("emergencyPhone", "")
+        if main_patient:
+            emergency_phone = main_patient.get("emergencyPhone", "")
 
         try:
             followup_days = int(''.join(filter(str.isdigit, duration_str)))
@@ -174,19 +174,19 @@ class CareFlowAgent:
             "lastRatings": {},
             "lastSubjective": "",
             "parameters": parameters,
-            "enrolledAt": firestore.SERVER_TIMESTAMP
+            "enrolledAt": SERVER_TIMESTAMP
         }
         
-        db.collection("followup_patients").document(patient_id).set(enrollment_data)
+        await firebase_async.set_followup(patient_id, enrollment_data)
 
         # 1. Send Immediate Confirmation
         success_notifs = []
         if phone:
-            whatsapp.send_followup_whatsapp(phone, patient_name, duration_str)
+            await asyncio.to_thread(whatsapp.send_followup_whatsapp, phone, patient_name, duration_str)
             success_notifs.append("whatsapp")
 
         if patient_email:
-            alerts.send_followup_email(patient_email, patient_name, duration_str)
+            await asyncio.to_thread(alerts.send_followup_email, patient_email, patient_name, duration_str)
             success_notifs.append("email")
 
         # 2. Start Delayed Follow-up Flow (v2.1)
@@ -215,11 +215,11 @@ class CareFlowAgent:
         success_notifs = []
 
         if phone:
-            whatsapp.send_intake_whatsapp(phone, patient_name, patient_code)
+            await asyncio.to_thread(whatsapp.send_intake_whatsapp, phone, patient_name, patient_code)
             success_notifs.append("whatsapp")
 
         if patient_email:
-            alerts.send_intake_email(patient_email, patient_name, patient_code)
+            await asyncio.to_thread(alerts.send_intake_email, patient_email, patient_name, patient_code)
             success_notifs.append("email")
 
         return {
@@ -245,11 +245,11 @@ class CareFlowAgent:
         success_notifs = []
 
         if doctor_phone:
-            whatsapp.send_doctor_registration_whatsapp(doctor_phone, doctor_name)
+            await asyncio.to_thread(whatsapp.send_doctor_registration_whatsapp, doctor_phone, doctor_name)
             success_notifs.append("whatsapp")
 
         if doctor_email:
-            alerts.send_doctor_registration_email(doctor_email, doctor_name)
+            await asyncio.to_thread(alerts.send_doctor_registration_email, doctor_email, doctor_name)
             success_notifs.append("email")
 
         return {
@@ -297,7 +297,7 @@ def analyze_patient_response(
         text = raw.strip().replace("```json", "").replace("```", "")
         return json.loads(text)
     except Exception as e:
-        print(f"❌ AI Analysis Error: {e}")
+        log.error("AI Analysis Error: %s", e)
         return {
             "pain_level": 0,
             "has_fever": False,
@@ -1,8 +1,13 @@
 # agent/ai_client.py — updated with your available models
 
 import os
-from dotenv import load_dotenv
-load_dotenv()
+import threading
+import time
+from .log import get_logger
+from .metrics import LLM_CALL_SECONDS
+from .tracing import span
+
+log = get_logger(__name__)
 
 API_KEY  = os.getenv("GROQ_API_KEY")
 
@@ -11,31 +16,60 @@ PRIMARY_MODEL  = "meta-llama/llama-4-scout-17b-16e-instruct"
 FALLBACK_MODEL = "qwen/qwen3-32b"
 LAST_MODEL     = "llama-3.3-70b-versatile" # Added versatile suffix since that is usually the groq tag, but fallbacks ensure safety 
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """One Groq client per process, so its HTTP connection pool is reused."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import Groq
+                _client = Groq(api_key=API_KEY)
+    return _client
+
+
+def check_connection() -> int:
+    """Opens the pooled connection to Groq; returns the number of models listed."""
+    return len(get_client().models.list().data)
+
 def ask_ai(prompt: str) -> str:
     if not API_KEY:
-        print("[WARN] GROQ_API_KEY is not defined in .env")
+        log.warning("GROQ_API_KEY is not defined in .env")
         return None
         
     for model in [PRIMARY_MODEL, FALLBACK_MODEL, LAST_MODEL]:
         result = _call(prompt, model)
         if result:
             return result
-    print("[FAILED] All Groq models failed")
+    log.error("All Groq models failed")
     return None
 
 def _call(prompt: str, model: str) -> str:
+    with span("llm.call", model=model) as sp:
+        text = _timed_call(prompt, model)
+        if sp is not None:
+            sp.set(ok=text is not None)
+        return text
+
+def _timed_call(prompt: str, model: str) -> str:
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        from groq import Groq
-        client = Groq(api_key=API_KEY)
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.4,
             max_tokens=1024
         )
         text = response.choices[0].message.content.strip()
-        print(f"[SUCCESS] {model} responded ({len(text)} chars)")
+        log.debug("%s responded (%d chars)", model, len(text))
+        outcome = "ok"
         return text
     except Exception as e:
-        print(f"[WARN] {model} failed: {e}")
+        log.warning("%s failed: %s", model, e)
         return None
+    finally:
+        LLM_CALL_SECONDS.observe(time.perf_counter() - started, model=model, outcome=outcome)
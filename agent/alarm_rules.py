@@ -0,0 +1,338 @@
+# agent/alarm_rules.py
+# Compiled alarm rules for a follow-up protocol (a patient's `parameters`).
+#
+# compile_rules() turns the parameter definitions into a RuleSet once:
+# thresholds are parsed to floats, yes/no answers lower-cased, value ranges
+# validated and the critical-keyword match resolved per parameter name.
+# Evaluating a reply is then a loop over prepared tuples with no float()
+# on thresholds and no keyword scan. RuleSets are cached by the protocol's
+# signature, so every patient on the same protocol shares one, and
+# re-evaluating a cohort after a threshold change only compiles each
+# distinct protocol once.
+#
+# Semantics match the original interpretive check_alarms /
+# compute_condition_category / compute_status_per_parameter, including
+# their treatment of unparsable thresholds (the rule never fires).
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+CRITICAL_KEYWORDS = (
+    "chest", "heart", "cardiac", "pulse", "bp",
+    "blood pressure", "breathing", "oxygen",
+)
+
+# Only these fields affect evaluation; descriptions and scale labels do not
+RULE_FIELDS = ("name", "questionType", "alarmingRate", "alarmingAnswer", "alarmingValueMin", "alarmingValueMax")
+
+Signature = Tuple[Any, ...]
+
+
+def is_critical_name(name: str) -> bool:
+    lowered = name.lower()
+    return any(kw in lowered for kw in CRITICAL_KEYWORDS)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float))
+
+
+def _leading_float(value: Any) -> float:
+    # "120/80" -> 120.0 (systolic for blood pressure)
+    if value.__class__ is float or value.__class__ is int:
+        return value
+    return float(str(value).split("/")[0])
+
+
+def _as_float(value: Any) -> float:
+    if value.__class__ is float or value.__class__ is int:
+        return value
+    return float(value)
+
+
+# Rule kinds; rules are flat tuples so evaluation is one loop with no calls
+# back into per-rule closures.
+RATE, YESNO, VALUE = 0, 1, 2
+# Trend kinds (value trends toward the centre of the safe range, or raw)
+TREND_RATE, TREND_YESNO, TREND_VALUE, TREND_VALUE_TARGET, TREND_STABLE = 0, 1, 2, 3, 4
+
+
+def _alarm_rule(param: Dict[str, Any]) -> Optional[Tuple[int, Any, Any]]:
+    """(kind, a, b), or None when the rule can never fire (unknown type or unusable threshold)."""
+    qtype = param.get("questionType")
+    if qtype == "rate":
+        try:
+            return RATE, float(param.get("alarmingRate", 5)), None
+        except (TypeError, ValueError):
+            return None
+    if qtype == "yesno":
+        return YESNO, str(param.get("alarmingAnswer", "yes")).lower(), None
+    if qtype == "value":
+        lo, hi = param.get("alarmingValueMin"), param.get("alarmingValueMax")
+        # A non-numeric bound made the original comparison raise: a bad
+        # min disables the rule, a bad max leaves only the min check.
+        if lo is not None and not _is_number(lo):
+            return None
+        if hi is not None and not _is_number(hi):
+            if lo is None:
+                return None
+            hi = None
+        if lo is None and hi is None:
+            return None
+        return VALUE, lo, hi
+    return None
+
+
+def _trend_rule(param: Dict[str, Any]) -> Optional[Tuple[int, Any]]:
+    """(kind, arg), or None for question types that get no trend."""
+    qtype = param.get("questionType")
+    if qtype == "rate":
+        return TREND_RATE, None
+    if qtype == "yesno":
+        return TREND_YESNO, str(param.get("alarmingAnswer", "yes")).lower()
+    if qtype == "value":
+        lo, hi = param.get("alarmingValueMin"), param.get("alarmingValueMax")
+        if lo is None or hi is None:
+            return TREND_VALUE, None
+        if _is_number(lo) and _is_number(hi):
+            return TREND_VALUE_TARGET, (lo + hi) / 2
+        return TREND_STABLE, None
+    return None
+
+
+def _compare(today: float, yesterday: float) -> str:
+    if today < yesterday:
+        return "improving"
+    if today > yesterday:
+        return "deteriorating"
+    return "stable"
+
+
+class RuleSet:
+    """The compiled rules for one parameter list."""
+
+    __slots__ = ("signature", "_alarms", "_trends", "_critical", "_digest")
+
+    def __init__(self, signature: Signature, parameters: List[Dict[str, Any]]) -> None:
+        # Keeps no reference to `parameters`: a RuleSet is shared by every
+        # patient with the same signature, and check() returns the caller's
+        # own parameter dicts by position.
+        self.signature = signature
+        self._alarms: List[Tuple[str, int, Any, Any, int]] = []
+        self._trends: List[Tuple[str, Optional[int], Any]] = []
+        self._critical: Dict[str, bool] = {}
+        self._digest: Optional[str] = None
+        for index, param in enumerate(parameters):
+            name = param["name"]
+            rule = _alarm_rule(param)
+            if rule is not None:
+                self._alarms.append((name, rule[0], rule[1], rule[2], index))
+            trend = _trend_rule(param)
+            self._trends.append((name, *trend) if trend is not None else (name, None, None))
+            self._critical[name] = is_critical_name(name)
+
+    @property
+    def digest(self) -> str:
+        """Stable hex hash of the protocol (for logs and stored records)."""
+        if self._digest is None:
+            raw = json.dumps(self.signature, default=str, separators=(",", ":"))
+            self._digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+        return self._digest
+
+    def check(self, ratings: Dict[str, Any], parameters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        The entries of `parameters` (the list this RuleSet was compiled
+        for, or one with the same signature) whose threshold `ratings` crossed.
+        """
+        get = ratings.get
+        crossed = []
+        for name, kind, a, b, index in self._alarms:
+            val = get(name)
+            if val is None:
+                continue
+            if kind == YESNO:
+                hit = str(val).lower() == a
+            else:
+                try:
+                    if kind == RATE:
+                        hit = _as_float(val) >= a
+                    else:
+                        num = _leading_float(val)
+                        hit = (a is not None and num < a) or (b is not None and num > b)
+                except (TypeError, ValueError):
+                    continue
+            if hit:
+                crossed.append(parameters[index])
+        return crossed
+
+    def category(self, q1_answer: str, crossed: List[Dict[str, Any]]) -> str:
+        """'critical' | 'note' | 'normal' for the day."""
+        count = len(crossed)
+        if q1_answer == "critical" or count >= 2:
+            return "critical"
+        critical = self._critical
+        for param in crossed:
+            name = param["name"]
+            flag = critical.get(name)
+            if flag is None:
+                flag = is_critical_name(name)
+            if flag:
+                return "critical"
+        if q1_answer == "moderate" or count == 1:
+            return "note"
+        return "normal"
+
+    def status(self, today: Dict[str, Any], yesterday: Dict[str, Any]) -> Dict[str, str]:
+        """improving / stable / deteriorating per parameter versus yesterday."""
+        result: Dict[str, str] = {}
+        today_get, yesterday_get = today.get, yesterday.get
+        for name, kind, arg in self._trends:
+            t, y = today_get(name), yesterday_get(name)
+            if t is None or y is None:
+                result[name] = "stable"
+            elif kind is None:
+                continue
+            elif kind == TREND_YESNO:
+                t_alarming, y_alarming = str(t).lower() == arg, str(y).lower() == arg
+                result[name] = ("deteriorating" if t_alarming and not y_alarming
+                                else "improving" if y_alarming and not t_alarming
+                                else "stable")
+            elif kind == TREND_STABLE:
+                result[name] = "stable"
+            else:
+                try:
+                    if kind == TREND_RATE:
+                        result[name] = _compare(_as_float(t), _as_float(y))
+                    elif kind == TREND_VALUE:
+                        result[name] = _compare(_leading_float(t), _leading_float(y))
+                    else:
+                        result[name] = _compare(abs(_leading_float(t) - arg), abs(_leading_float(y) - arg))
+                except (TypeError, ValueError):
+                    result[name] = "stable"
+        return result
+
+    def scores(self, ratings: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Numeric severity per parameter (higher is worse), on the same scale
+        status() compares: the rate itself, 1/0 for an alarming yes/no answer,
+        the reading or its distance from the centre of the safe range.
+        Parameters without a trend, a rating or a parsable value are left out.
+        """
+        result: Dict[str, float] = {}
+        get = ratings.get
+        for name, kind, arg in self._trends:
+            val = get(name)
+            if val is None or kind is None or kind == TREND_STABLE:
+                continue
+            try:
+                if kind == TREND_YESNO:
+                    result[name] = 1.0 if str(val).lower() == arg else 0.0
+                elif kind == TREND_RATE:
+                    result[name] = float(_as_float(val))
+                elif kind == TREND_VALUE:
+                    result[name] = float(_leading_float(val))
+                else:
+                    result[name] = abs(_leading_float(val) - arg)
+            except (TypeError, ValueError):
+                continue
+        return result
+
+    def evaluate(
+        self,
+        parameters: List[Dict[str, Any]],
+        q1_answer: str,
+        today: Dict[str, Any],
+        yesterday: Dict[str, Any],
+    ) -> Tuple[List[Dict[str, Any]], str, Dict[str, str]]:
+        """(crossed parameters, condition category, status per parameter)."""
+        crossed = self.check(today, parameters)
+        return crossed, self.category(q1_answer, crossed), self.status(today, yesterday)
+
+
+def signature(parameters: Iterable[Dict[str, Any]]) -> Signature:
+    """Hashable key of the rule-relevant fields of a parameter list (see RULE_FIELDS)."""
+    # Spelled out rather than looping over RULE_FIELDS: this runs on every
+    # lookup and is most of its cost.
+    return tuple([
+        (p.get("name"), p.get("questionType"), p.get("alarmingRate"),
+         p.get("alarmingAnswer"), p.get("alarmingValueMin"), p.get("alarmingValueMax"))
+        for p in parameters
+    ])
+
+
+class RuleCache:
+    """Bounded LRU of compiled RuleSets keyed by parameter-list signature."""
+
+    def __init__(self, maxsize: int = 512) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Signature, RuleSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, parameters: List[Dict[str, Any]]) -> RuleSet:
+        key = signature(parameters)
+        try:
+            with self._lock:
+                rules = self._data.get(key)
+                if rules is not None:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return rules
+        except TypeError:
+            # unhashable threshold (e.g. a list) - compile without caching
+            return RuleSet(key, parameters)
+
+        rules = RuleSet(key, parameters)
+        with self._lock:
+            self.misses += 1
+            self._data[key] = rules
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return rules
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+rule_cache = RuleCache(maxsize=int(os.getenv("RULE_CACHE_SIZE", "512")))
+
+
+def compile_rules(parameters: List[Dict[str, Any]]) -> RuleSet:
+    """The (cached) RuleSet for a parameter list."""
+    return rule_cache.get(parameters)
+
+
+def evaluate_cohort(
+    patients: Iterable[Dict[str, Any]],
+    ratings_field: str = "lastRatings",
+    q1_field: str = "lastQ1Answer",
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Re-runs the alarm rules for every patient against their stored ratings,
+    e.g. after a doctor changes a protocol's thresholds. Patients are keyed
+    by `doc_id` (or `id`); each result has crossed parameter names and the
+    condition category.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for patient in patients:
+        parameters = patient.get("parameters", [])
+        rules = compile_rules(parameters)
+        crossed = rules.check(patient.get(ratings_field) or {}, parameters)
+        results[patient.get("doc_id") or patient.get("id")] = {
+            "crossed": [p["name"] for p in crossed],
+            "condition_category": rules.category(patient.get(q1_field) or "normal", crossed),
+            "rules": rules.digest,
+        }
+    return results
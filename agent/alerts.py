@@ -2,14 +2,23 @@ import os
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from dotenv import load_dotenv
+from .log import get_logger
+from .metrics import timed_send
+from .tracing import traced
 
-load_dotenv()
+log = get_logger(__name__)
 
 GMAIL_ADDRESS = os.getenv("GMAIL_ADDRESS")
 GMAIL_APP_PASSWORD = os.getenv("GMAIL_APP_PASSWORD")
 DOCTOR_EMAIL = os.getenv("DOCTOR_EMAIL") or "niasingh.shekhawat@gmail.com"
 
+def check_connection(timeout: float = 10) -> None:
+    """Connects and logs in to Gmail SMTP (resolves DNS, verifies credentials)."""
+    with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=timeout) as server:
+        server.login(GMAIL_ADDRESS, GMAIL_APP_PASSWORD)
+
+
+@traced("email.doctor_alert")
 def send_doctor_alert(patient_name, reason, severity):
     sender = GMAIL_ADDRESS
     receiver = DOCTOR_EMAIL
@@ -31,26 +40,26 @@ def send_doctor_alert(patient_name, reason, severity):
     
     # Using Port 465 for SMTP_SSL
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        with timed_send("email", "doctor_alert"), smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
             server.login(sender, GMAIL_APP_PASSWORD)
             server.sendmail(sender, receiver, msg.as_string())
-            print("✅ Alert email sent via Port 465!")
+            log.info("Alert email sent via Port 465")
             return True
     except Exception as e:
-        print(f"❌ Port 465 failed: {e}. Trying Port 587...")
+        log.warning("Port 465 failed: %s. Trying Port 587...", e)
         try:
-            with smtplib.SMTP("smtp.gmail.com", 587) as server:
+            with timed_send("email", "doctor_alert"), smtplib.SMTP("smtp.gmail.com", 587) as server:
                 server.ehlo()
                 server.starttls()
                 server.login(sender, GMAIL_APP_PASSWORD)
                 server.sendmail(sender, receiver, msg.as_string())
-                print("✅ Alert email sent via Port 587!")
+                log.info("Alert email sent via Port 587")
                 return True
         except Exception as e587:
-            print(f"❌ Port 587 failed: {e587}")
+            log.error("Port 587 failed: %s", e587)
             return False
 
-def notify_doctor_for_patient_help(db, patient, message):
+def notify_doctor_for_patient_help(patient, message):
     """
     Orchestrates alert for proactive patient help request
     """
@@ -61,7 +70,7 @@ def notify_doctor_for_patient_help(db, patient, message):
         severity="high"
     )
 
-def notify_doctor_for_lab_result(db, patient, payload):
+def notify_doctor_for_lab_result(patient, payload):
     """
     Orchestrates alert for updated lab results
     """
@@ -100,13 +109,13 @@ def send_followup_email(patient_email: str, patient_name: str, duration: str):
     msg.attach(MIMEText(body, "html"))
     
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        with timed_send("email", "followup"), smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
             server.login(sender, GMAIL_APP_PASSWORD)
             server.sendmail(sender, receiver, msg.as_string())
-            print(f"✅ Follow-up email sent to {patient_email}")
+            log.info("Follow-up email sent to %s", patient_email)
             return True
     except Exception as e:
-        print(f"❌ Failed to send follow-up email: {e}")
+        log.error("Failed to send follow-up email: %s", e)
         return False
 
 def send_intake_email(patient_email: str, patient_name: str, patient_code: str):
@@ -135,13 +144,13 @@ def send_intake_email(patient_email: str, patient_name: str, patient_code: str):
     msg.attach(MIMEText(body, "html"))
     
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        with timed_send("email", "intake"), smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
             server.login(sender, GMAIL_APP_PASSWORD)
             server.sendmail(sender, receiver, msg.as_string())
-            print(f"✅ Intake welcome email sent to {patient_email}")
+            log.info("Intake welcome email sent to %s", patient_email)
             return True
     except Exception as e:
-        print(f"❌ Failed to send intake email: {e}")
+        log.error("Failed to send intake email: %s", e)
         return False
 
 def send_doctor_registration_email(doctor_email: str, doctor_name: str):
@@ -167,11 +176,11 @@ def send_doctor_registration_email(doctor_email: str, doctor_name: str):
     msg.attach(MIMEText(body, "html"))
     
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        with timed_send("email", "doctor_registration"), smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
             server.login(sender, GMAIL_APP_PASSWORD)
             server.sendmail(sender, receiver, msg.as_string())
-            print(f"✅ Doctor registration email sent to {doctor_email}")
+            log.info("Doctor registration email sent to %s", doctor_email)
             return True
     except Exception as e:
-        print(f"❌ Failed to send doctor registration email: {e}")
+        log.error("Failed to send doctor registration email: %s", e)
         return False
@@ -0,0 +1,199 @@
+# agent/anomaly.py
+# Streaming anomaly detection on a patient's own readings.
+#
+# Static thresholds miss a reading that is unusual for this patient but
+# still inside the safe range, e.g. a temperature creeping up by 0.3°F a
+# day that never reaches alarmingValueMax. Each follow-up document keeps a
+# `ratingStats` map with running statistics per numeric parameter, updated
+# in O(1) time and space per check-in without reading older check-ins:
+#
+#   - Welford mean / variance over every reading: the patient's baseline
+#   - EWMA level / variance: the recent level
+#   - two-sided CUSUM of readings standardised against the baseline
+#
+# A reading far from the recent level (|z| >= ANOMALY_Z) is a "spike"; a
+# CUSUM over ANOMALY_CUSUM_H is a "drift" (many small steps in the same
+# direction) and resets the sum. Rates are only flagged upwards (higher is
+# worse); measurements both ways. Yes/no answers are left to the alarm rules.
+#
+#   ANOMALY_Z=3.0            spike threshold in standard deviations
+#   ANOMALY_ALPHA=0.3        EWMA weight of the newest reading
+#   ANOMALY_CUSUM_K=0.5      CUSUM slack per reading (standard deviations)
+#   ANOMALY_CUSUM_H=5.0      CUSUM decision threshold
+#   ANOMALY_MIN_POINTS=5     readings needed before anything is flagged
+#   ANOMALY_MIN_STD=0.5      floor on the standard deviation (in the parameter's unit)
+#   ANOMALY_ALERTS=true      email the doctor about anomalies no other alert covered
+
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+
+Z_THRESHOLD = float(os.getenv("ANOMALY_Z", "3.0"))
+ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.3"))
+CUSUM_K = float(os.getenv("ANOMALY_CUSUM_K", "0.5"))
+CUSUM_H = float(os.getenv("ANOMALY_CUSUM_H", "5.0"))
+MIN_POINTS = int(os.getenv("ANOMALY_MIN_POINTS", "5"))
+MIN_STD = float(os.getenv("ANOMALY_MIN_STD", "0.5"))
+ALERTS_ENABLED = os.getenv("ANOMALY_ALERTS", "true").lower() != "false"
+
+_PLACES = 6
+
+ANOMALIES = metrics.counter(
+    "careflow_anomalies_total", "Readings flagged as unusual for the patient.", ("kind",),
+)
+
+
+def reading(param: Dict[str, Any], value: Any) -> Optional[float]:
+    """
+    The numeric reading of a rate or measurement answer ("120/80" -> 120.0),
+    else None. "nan" / "inf" parse as floats but would poison every running
+    statistic and cohort curve they reach, so they are None too.
+    """
+    if value is None or param.get("questionType") not in ("rate", "value"):
+        return None
+    try:
+        x = float(value) if isinstance(value, (int, float)) else float(str(value).split("/")[0])
+    except ValueError:
+        return None
+    return x if math.isfinite(x) else None
+
+
+class RunningStats:
+    """Welford, EWMA and CUSUM state of one parameter."""
+
+    __slots__ = ("count", "mean", "m2", "level", "level_var", "cusum_up", "cusum_down", "last_day")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.level = 0.0
+        self.level_var = 0.0
+        self.cusum_up = 0.0
+        self.cusum_down = 0.0
+        self.last_day: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningStats":
+        stats = cls()
+        stats.count = int(data.get("n", 0))
+        stats.mean = float(data.get("m", 0.0))
+        stats.m2 = float(data.get("m2", 0.0))
+        stats.level = float(data.get("ew", stats.mean))
+        stats.level_var = float(data.get("ev", 0.0))
+        stats.cusum_up = float(data.get("cu", 0.0))
+        stats.cusum_down = float(data.get("cd", 0.0))
+        stats.last_day = int(data["d"]) if data.get("d") is not None else None
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "n": self.count, "m": round(self.mean, _PLACES), "m2": round(self.m2, _PLACES),
+            "ew": round(self.level, _PLACES), "ev": round(self.level_var, _PLACES),
+            "cu": round(self.cusum_up, _PLACES), "cd": round(self.cusum_down, _PLACES),
+            "d": self.last_day,
+        }
+
+    @property
+    def std(self) -> float:
+        """Baseline standard deviation, floored at MIN_STD."""
+        variance = self.m2 / (self.count - 1) if self.count > 1 else 0.0
+        return max(math.sqrt(variance), MIN_STD)
+
+    @property
+    def level_std(self) -> float:
+        return max(math.sqrt(self.level_var), MIN_STD)
+
+    def update(self, x: float, day: int, upward_only: bool) -> List[Dict[str, Any]]:
+        """
+        Scores `x` against the state so far, then folds it in. Returns the
+        anomalies it raised (empty until MIN_POINTS readings were seen).
+        """
+        found: List[Dict[str, Any]] = []
+        if self.count == 0:
+            self.count, self.mean, self.level = 1, x, x
+            self.last_day = day
+            return found
+
+        armed = self.count >= MIN_POINTS
+        z = (x - self.level) / self.level_std
+        if armed and (z >= Z_THRESHOLD or (not upward_only and z <= -Z_THRESHOLD)):
+            found.append(_anomaly("spike", x, self.level, z))
+
+        deviation = (x - self.mean) / self.std
+        self.cusum_up = max(0.0, self.cusum_up + deviation - CUSUM_K)
+        self.cusum_down = 0.0 if upward_only else max(0.0, self.cusum_down - deviation - CUSUM_K)
+        if armed and self.cusum_up >= CUSUM_H:
+            found.append(_anomaly("drift", x, self.mean, self.cusum_up))
+            self.cusum_up = 0.0
+        elif armed and self.cusum_down >= CUSUM_H:
+            found.append(_anomaly("drift", x, self.mean, -self.cusum_down))
+            self.cusum_down = 0.0
+
+        # Welford
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        # EWMA level and variance
+        diff = x - self.level
+        increment = ALPHA * diff
+        self.level += increment
+        self.level_var = (1 - ALPHA) * (self.level_var + diff * increment)
+        self.last_day = day
+        return found
+
+
+def _anomaly(kind: str, value: float, expected: float, score: float) -> Dict[str, Any]:
+    return {
+        "kind": kind,
+        "direction": "up" if score > 0 else "down",
+        "value": value,
+        "expected": round(expected, 2),
+        "score": round(score, 2),
+    }
+
+
+def detect(
+    stored: Optional[Dict[str, Any]],
+    parameters: List[Dict[str, Any]],
+    ratings: Dict[str, Any],
+    day: int,
+) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Feeds one check-in into a stored `ratingStats` map.
+
+    Returns the map to write back and the anomalies, each with the
+    parameter `name`. A day that is already recorded changes nothing.
+    """
+    stored = stored or {}
+    result = dict(stored)
+    anomalies: List[Dict[str, Any]] = []
+    for param in parameters:
+        name = param["name"]
+        x = reading(param, ratings.get(name))
+        if x is None:
+            continue
+        data = stored.get(name)
+        stats = RunningStats.from_dict(data) if data else RunningStats()
+        if stats.last_day is not None and day <= stats.last_day:
+            continue
+        for found in stats.update(x, day, upward_only=param.get("questionType") == "rate"):
+            anomalies.append({"name": name, **found})
+        result[name] = stats.to_dict()
+    return result, anomalies
+
+
+def describe(anomalies: List[Dict[str, Any]]) -> str:
+    """Readable list of anomalies for alert emails and the LLM prompt."""
+    parts = []
+    for a in anomalies:
+        what = "sudden change" if a["kind"] == "spike" else "steady drift"
+        parts.append(
+            f"{a['name']}: {a['value']:g} ({what} {a['direction']}, usual {a['expected']:g})"
+        )
+    return "; ".join(parts)
@@ -0,0 +1,250 @@
+# agent/archive.py
+# Hot/cold tiering: moves finished data out of the collections every
+# `status == "active"` query, listener and index works against.
+#
+#   followup_patients    completed more than the retention ago -> followup_archive
+#   checkin_responses    older than the retention              -> checkin_responses_archive
+#   critical_alerts      resolved and older than the retention -> critical_alerts_archive
+#
+# A completed follow-up leaves behind a compact summary document (same id)
+# in followup_archive: its working state (trendSeries, ratingStats,
+# conversation fields) is replaced by per-parameter trend summaries.
+# Check-ins and alerts are archived unchanged, to the archive collections
+# or, with --out, to date-partitioned Parquet / Arrow files (the typed
+# export columns plus the whole document as JSON) and deleted from
+# Firestore. Unresolved alerts always stay hot.
+#
+# Every step pages through documents matching a range filter and removes
+# each batch before reading the next, so memory is bounded by --batch and
+# an interrupted run simply continues next time. With --out a crash
+# between writing a file and deleting its batch archives those documents
+# twice; deduplicate on `id` when reading the files.
+#
+# Dashboard counters are unaffected: only active follow-ups and unresolved
+# alerts are counted. Recovery curves keep their counts, but rebuilding
+# them needs the archived check-ins: `recovery_curves --backfill` reads
+# the archive collections and the files under ARCHIVE_OUT (or
+# --archive-dir), and refuses to run if those files cannot be read.
+# Check-ins archived with --out elsewhere must be passed with
+# --archive-dir. Follow-ups completed before completedAt was recorded are
+# stamped with --stamp-legacy (enrolledAt + followupDays, else now) first.
+#
+#   ARCHIVE_RETENTION_DAYS=90    age at which data moves to the cold tier
+#   ARCHIVE_BATCH=200            documents read, written and deleted per batch
+#   ARCHIVE_NIGHTLY=false        run nightly at 03:00 IST from the scheduler
+#   ARCHIVE_OUT=                 directory for the nightly run's files (unset: archive collections)
+#
+# Run:  python -m agent.archive --dry-run              counts only
+#       python -m agent.archive                        archive to the archive collections
+#       python -m agent.archive --out archive          check-ins / alerts to Parquet files
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import metrics
+from .log import get_logger
+from .storage import SERVER_TIMESTAMP, Filter, StorageBackend, get_storage
+from .timeseries import ParamSeries
+
+log = get_logger(__name__)
+
+RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+BATCH = int(os.getenv("ARCHIVE_BATCH", "200"))
+
+ARCHIVES = {
+    "followup_patients": "followup_archive",
+    "checkin_responses": "checkin_responses_archive",
+    "critical_alerts": "critical_alerts_archive",
+}
+
+# Working state of a running follow-up, meaningless once it completed
+DROP_FIELDS = (
+    "trendSeries", "ratingStats", "previousRatings", "conversationState", "lastQ1Answer",
+    "lastSubjective", "notificationSent", "q1SentAt", "q1AnsweredAt", "lastNoResponseAlert",
+)
+
+ARCHIVED = metrics.counter(
+    "careflow_archived_documents_total", "Documents moved to the cold tier.", ("collection",),
+)
+
+
+def summarize_followup(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """The compact document a completed follow-up leaves in followup_archive."""
+    summary = {k: v for k, v in doc.items() if k not in DROP_FIELDS}
+    trends = {}
+    for name, data in (doc.get("trendSeries") or {}).items():
+        series = ParamSeries.from_dict(data)
+        trends[name] = {**series.summary(), "recorded": series.total}
+    summary["trendSummary"] = trends
+    summary["archivedAt"] = SERVER_TIMESTAMP
+    return summary
+
+
+def _followup_filters(cutoff: datetime.datetime) -> List[Filter]:
+    return [("status", "==", "completed"), ("completedAt", "<", cutoff)]
+
+
+def _log_filters(collection: str, cutoff: datetime.datetime) -> List[Filter]:
+    filters: List[Filter] = [("timestamp", "<", cutoff)]
+    if collection == "critical_alerts":
+        filters.insert(0, ("resolved", "==", True))
+    return filters
+
+
+def archive_followups(storage: StorageBackend, cutoff: datetime.datetime, batch: int = BATCH) -> int:
+    """Replaces follow-ups completed before `cutoff` with their summaries; returns how many."""
+    moved = 0
+    while True:
+        docs = storage.query("followup_patients", _followup_filters(cutoff), limit=batch)
+        if not docs:
+            return moved
+        storage.move_documents("followup_patients", [summarize_followup(d) for d in docs],
+                               ARCHIVES["followup_patients"])
+        moved += len(docs)
+        ARCHIVED.inc(len(docs), collection="followup_patients")
+        log.info("Archived %d completed follow-ups", moved)
+
+
+def archive_log(
+    storage: StorageBackend,
+    collection: str,
+    cutoff: datetime.datetime,
+    batch: int = BATCH,
+    writer: Any = None,
+) -> int:
+    """
+    Moves check-ins / resolved alerts older than `cutoff` to the archive
+    collection, or into `writer` (an export.PartitionWriter) and deletes them.
+    """
+    from .export import flatten
+
+    filters = _log_filters(collection, cutoff)
+    moved = 0
+    while True:
+        docs = storage.query(collection, filters, order_by="timestamp", limit=batch)
+        if not docs:
+            return moved
+        if writer is not None:
+            writer.write([
+                {**flatten(collection, d, include_text=True), "document": json.dumps(d, default=str)}
+                for d in docs
+            ])
+            storage.delete_documents(collection, [d["id"] for d in docs])
+        else:
+            storage.move_documents(collection, [{**d, "archivedAt": SERVER_TIMESTAMP} for d in docs],
+                                   ARCHIVES[collection])
+        moved += len(docs)
+        ARCHIVED.inc(len(docs), collection=collection)
+        log.info("Archived %d %s", moved, collection)
+
+
+def iter_archived_files(out_dir: str, collection: str) -> Iterator[Dict[str, Any]]:
+    """
+    The documents archive_log wrote to files under `out_dir`, timestamps as
+    text. A document can appear twice (see above); needs pyarrow.
+    """
+    from . import export
+
+    suffixes = tuple(export.FORMATS.values())
+    paths = sorted(
+        os.path.join(directory, name)
+        for directory, _, names in os.walk(os.path.join(out_dir, collection))
+        for name in names if name.endswith(suffixes)
+    )
+    if paths and export.pa is None:
+        raise RuntimeError(f"{len(paths)} archived {collection} files under {out_dir} need pyarrow: pip install pyarrow")
+    for path in paths:
+        if path.endswith(export.FORMATS["parquet"]):
+            table = export.pq.read_table(path, columns=["document"])
+        else:
+            table = export.feather.read_table(path, columns=["document"])
+        for raw in table.column("document").to_pylist():
+            yield json.loads(raw)
+
+
+def stamp_legacy(storage: StorageBackend, batch: int = BATCH) -> int:
+    """Sets completedAt on completed follow-ups that predate it; returns how many."""
+    stamped = 0
+    after = None
+    while True:
+        docs = storage.query("followup_patients", [("status", "==", "completed")], limit=batch,
+                             after=after, select=["completedAt", "enrolledAt", "followupDays"])
+        if not docs:
+            return stamped
+        after = docs[-1]["id"]
+        for doc in docs:
+            if doc.get("completedAt") is not None:
+                continue
+            completed: Any = SERVER_TIMESTAMP
+            enrolled = doc.get("enrolledAt")
+            if isinstance(enrolled, str):
+                enrolled = datetime.datetime.fromisoformat(enrolled)
+            if isinstance(enrolled, datetime.datetime):
+                completed = enrolled + datetime.timedelta(days=int(doc.get("followupDays") or 7) + 1)
+            storage.update_followup(doc["id"], {"completedAt": completed})
+            stamped += 1
+
+
+def run_archive(
+    retention_days: float = RETENTION_DAYS,
+    out_dir: Optional[str] = None,
+    fmt: str = "parquet",
+    batch: int = BATCH,
+    dry_run: bool = False,
+    storage: Optional[StorageBackend] = None,
+) -> Dict[str, Any]:
+    """Archives everything older than `retention_days`; returns counts per collection."""
+    from .export import PartitionWriter
+
+    storage = storage or get_storage()
+    out_dir = out_dir if out_dir is not None else os.getenv("ARCHIVE_OUT") or None
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    result: Dict[str, Any] = {"cutoff": cutoff.isoformat(), "dryRun": dry_run, "moved": {}}
+
+    if dry_run:
+        result["moved"]["followup_patients"] = storage.count("followup_patients", _followup_filters(cutoff))
+        for collection in ("checkin_responses", "critical_alerts"):
+            result["moved"][collection] = storage.count(collection, _log_filters(collection, cutoff))
+        return result
+
+    result["moved"]["followup_patients"] = archive_followups(storage, cutoff, batch)
+    for collection in ("checkin_responses", "critical_alerts"):
+        writer = PartitionWriter(out_dir, collection, fmt) if out_dir else None
+        result["moved"][collection] = archive_log(storage, collection, cutoff, batch, writer)
+        if writer is not None:
+            result.setdefault("files", []).extend(writer.files)
+    log.info("Archive run: %s", result["moved"])
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .export import FORMATS, pa
+
+    parser = argparse.ArgumentParser(description="CareFlow hot/cold archival")
+    parser.add_argument("--retention-days", type=float, default=RETENTION_DAYS)
+    parser.add_argument("--out", help="write check-ins / alerts to Parquet or Arrow files here")
+    parser.add_argument("--format", dest="fmt", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be archived")
+    parser.add_argument("--stamp-legacy", action="store_true",
+                        help="first set completedAt on completed follow-ups that lack it")
+    args = parser.parse_args(argv)
+
+    if args.out and pa is None:
+        parser.error("--out needs pyarrow: pip install pyarrow")
+    storage = get_storage()
+    if args.stamp_legacy:
+        print(json.dumps({"stamped": stamp_legacy(storage, args.batch)}))
+    result = run_archive(args.retention_days, args.out, args.fmt, args.batch, args.dry_run, storage)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+# agent/bench.py
+# Micro-benchmarks for the pure functions that run on every message.
+#
+# Each case is timed with timeit (median of --repeat runs, auto-ranged loop
+# count) over parameterized inputs: parameter counts, reply lengths and
+# cohort sizes built by agent.synthetic with a fixed seed. Cases with an
+# optional fast path are named by backend (cohort_whatif[...,backend=numpy]
+# and [...,backend=python]), so a machine without NumPy is never compared
+# with a NumPy timing.
+#
+# Results are compared with a stored baseline; a case slower than the
+# baseline by more than --threshold (default 25%) and by more than
+# --min-diff (default 5 µs, so scheduler noise on µs-scale cases does not
+# count) fails the run, so it can gate a deploy. A case over the line is
+# timed again up to --confirm times and keeps its fastest time, so only a
+# slowdown that reproduces fails the gate. Baselines are machine
+# specific, so a fixed calibration loop is timed between the cases and
+# comparisons are scaled by the ratio of the run's median calibration to
+# the baseline's, which one noisy reading cannot skew. The committed
+# agent/bench_baseline.json is re-recorded (with NumPy installed) using
+# --save-baseline whenever cases are added or a change is meant to move a
+# timing.
+#
+# With --ci (default when CI=true) a missing baseline, or a case the
+# baseline has no timing for, fails the run instead of passing unchecked.
+#
+# Run:  python -m agent.bench                      compare with the baseline
+#       python -m agent.bench --save-baseline      record a new baseline
+#       python -m agent.bench -k check_alarms      only matching cases
+#       python -m agent.bench --quick              fewer sizes / repeats
+#       python -m agent.bench --quick --ci         deploy gate
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import synthetic
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+PARAM_COUNTS = (4, 16, 64)
+REPLY_LENGTHS = (1, 40, 400)
+COHORT_SIZES = (100, 1000)
+
+# name -> (setup() returning a zero-arg callable)
+Case = Tuple[str, Callable[[], Callable[[], Any]]]
+
+
+def _patient(n_params: int, seed: int = 7) -> Dict[str, Any]:
+    _, patient = synthetic.make_patient(0, random.Random(seed), n_params=n_params)
+    return patient
+
+
+def _reply(length: int, rng: random.Random) -> str:
+    base = synthetic.q1_reply(rng)
+    if length <= len(base):
+        return base[:length]
+    words = ["thoda", "dard", "hai", "but", "overall", "better", "today", "sleep", "ok"]
+    text = base
+    while len(text) < length:
+        text += " " + rng.choice(words)
+    return text[:length]
+
+
+def build_cases(quick: bool = False) -> List[Case]:
+    from agent import cohort_whatif
+    from agent.phone import normalize_phone
+    from agent.question_generator import _template_questions, build_q1
+    from agent.response_analyzer import (
+        check_alarms,
+        compute_condition_category,
+        compute_status_per_parameter,
+        parse_q1_answer,
+    )
+
+    param_counts = PARAM_COUNTS[:2] if quick else PARAM_COUNTS
+    reply_lengths = REPLY_LENGTHS[:2] if quick else REPLY_LENGTHS
+    cohort_sizes = COHORT_SIZES[:1] if quick else COHORT_SIZES
+    whatif_backends = ["python"] if cohort_whatif.np is None else ["numpy", "python"]
+    cases: List[Case] = []
+
+    for length in reply_lengths:
+        def setup(length=length):
+            rng = random.Random(length)
+            replies = [_reply(length, rng) for _ in range(64)]
+            return lambda: [parse_q1_answer(r) for r in replies]
+        cases.append((f"parse_q1_answer[len={length},batch=64]", setup))
+
+    for n in param_counts:
+        def setup_alarms(n=n):
+            patient = _patient(n)
+            ratings = synthetic.random_ratings(patient["parameters"], random.Random(n))
+            return lambda: check_alarms(ratings, patient["parameters"])
+        cases.append((f"check_alarms[params={n}]", setup_alarms))
+
+        def setup_category(n=n):
+            patient = _patient(n)
+            ratings = synthetic.random_ratings(patient["parameters"], random.Random(n))
+            crossed = check_alarms(ratings, patient["parameters"])
+            return lambda: compute_condition_category("moderate", crossed, patient["parameters"])
+        cases.append((f"compute_condition_category[params={n}]", setup_category))
+
+        def setup_status(n=n):
+            patient = _patient(n)
+            rng = random.Random(n)
+            today = synthetic.random_ratings(patient["parameters"], rng)
+            return lambda: compute_status_per_parameter(patient["parameters"], today, patient["lastRatings"])
+        cases.append((f"compute_status_per_parameter[params={n}]", setup_status))
+
+        def setup_evaluate(n=n):
+            from agent.alarm_rules import compile_rules
+            patient = _patient(n)
+            params = patient["parameters"]
+            today = synthetic.random_ratings(params, random.Random(n))
+            return lambda: compile_rules(params).evaluate(params, "moderate", today, patient["lastRatings"])
+        cases.append((f"rules_evaluate[params={n}]", setup_evaluate))
+
+        def setup_series(n=n):
+            from agent.timeseries import update_series
+            patient = _patient(n)
+            params = patient["parameters"]
+            rng = random.Random(n)
+            stored = None
+            for day in range(1, 15):
+                stored, _ = update_series(stored, params, synthetic.random_ratings(params, rng), day)
+            today = synthetic.random_ratings(params, rng)
+            return lambda: update_series(stored, params, today, 15)
+        cases.append((f"update_series[params={n},days=14]", setup_series))
+
+        def setup_anomaly(n=n):
+            from agent.anomaly import detect
+            patient = _patient(n)
+            params = patient["parameters"]
+            rng = random.Random(n)
+            stored = None
+            for day in range(1, 15):
+                stored, _ = detect(stored, params, synthetic.random_ratings(params, rng), day)
+            today = synthetic.random_ratings(params, rng)
+            return lambda: detect(stored, params, today, 15)
+        cases.append((f"anomaly_detect[params={n},days=14]", setup_anomaly))
+
+        def setup_template(n=n):
+            patient = _patient(n)
+            return lambda: _template_questions(patient, patient["parameters"])
+        cases.append((f"_template_questions[params={n}]", setup_template))
+
+    for size in cohort_sizes:
+        def setup_cohort(size=size):
+            cohort = synthetic.make_cohort(size, n_params=8)
+            rng = random.Random(size)
+            rows = [(p["parameters"], synthetic.random_ratings(p["parameters"], rng), p["lastRatings"])
+                    for _, p in cohort]
+
+            def run():
+                for params, today, yesterday in rows:
+                    crossed = check_alarms(today, params)
+                    compute_condition_category("normal", crossed, params)
+                    compute_status_per_parameter(params, today, yesterday)
+            return run
+        cases.append((f"cohort_rules[patients={size},params=8]", setup_cohort))
+
+        def setup_reevaluate(size=size):
+            from agent.alarm_rules import evaluate_cohort
+            # a few shared protocols, as when patients follow per-surgery templates
+            protocols = [synthetic.make_parameters(8, random.Random(i)) for i in range(5)]
+            cohort = []
+            for i, (doc_id, p) in enumerate(synthetic.make_cohort(size, n_params=8)):
+                p["parameters"] = protocols[i % len(protocols)]
+                p["lastRatings"] = synthetic.random_ratings(p["parameters"], random.Random(i))
+                cohort.append({**p, "doc_id": doc_id})
+            return lambda: evaluate_cohort(cohort)
+        cases.append((f"evaluate_cohort[patients={size},protocols=5]", setup_reevaluate))
+
+        for backend in whatif_backends:
+            def setup_whatif(size=size, backend=backend):
+                from agent.cohort_whatif import CohortSnapshot
+                cohort = []
+                for doc_id, p in synthetic.make_cohort(size, n_params=8):
+                    p["previousRatings"] = synthetic.random_ratings(p["parameters"], random.Random(size))
+                    cohort.append({**p, "doc_id": doc_id})
+                snapshot = CohortSnapshot(cohort)
+                snapshot.vectorized = backend == "numpy"
+                overrides = {"Pain": {"alarmingRate": 3}, "Temperature": {"alarmingValueMax": 99.5}}
+                return lambda: snapshot.whatif(overrides)
+            cases.append((f"cohort_whatif[patients={size},params=8,backend={backend}]", setup_whatif))
+
+        def setup_curve(size=size):
+            from agent.recovery_curves import checkin_increments, day_summary
+            from agent.storage import add_increments
+            docs: Dict[str, Dict[str, Any]] = {}
+            for i, (_, p) in enumerate(synthetic.make_cohort(size, n_params=8)):
+                rng = random.Random(i)
+                for day in range(1, 15):
+                    by_param = checkin_increments(p["parameters"], day, synthetic.random_ratings(p["parameters"], rng))
+                    for name, (increments, _) in by_param.items():
+                        add_increments(docs.setdefault(name, {}), increments)
+            days = next(iter(docs.values()))["days"]
+            return lambda: [day_summary(d) for d in days.values()]
+        cases.append((f"recovery_curve[patients={size},days=14]", setup_curve))
+
+        def setup_q1(size=size):
+            patients = [p for _, p in synthetic.make_cohort(size, n_params=1)]
+            return lambda: [build_q1(p) for p in patients]
+        cases.append((f"build_q1[patients={size}]", setup_q1))
+
+    def setup_phone():
+        phones = ["+919876543210", "919876543210", "9876543210", "whatsapp:+91 98765-43210",
+                  "919876543210@c.us", " 98765 43210 "] * 16
+        return lambda: [normalize_phone(p) for p in phones]
+    cases.append(("normalize_phone[batch=96]", setup_phone))
+
+    return cases
+
+
+def _calibrate() -> float:
+    """Seconds for a fixed pure-Python workload (machine speed reference)."""
+    def work():
+        d: Dict[str, int] = {}
+        for i in range(2000):
+            d[str(i)] = i * 3
+        return sum(v for k, v in d.items() if k.endswith("7"))
+    return statistics.median(timeit.repeat(work, number=10, repeat=5)) / 10
+
+
+def run_case(fn: Callable[[], Any], repeat: int) -> float:
+    """Median per-call time in seconds."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return statistics.median(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _fmt_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CareFlow hot-path micro-benchmarks")
+    parser.add_argument("-k", dest="filter", default="", help="only cases containing this text")
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--min-diff", type=float, default=5e-6,
+                        help="slowdowns smaller than this many seconds per call never fail the run")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="re-time a case this many times before calling it a regression")
+    parser.add_argument("--json", dest="json_out", help="also write this run's results here")
+    parser.add_argument("--ci", action="store_true", default=os.getenv("CI", "").lower() in ("1", "true"),
+                        help="fail when the baseline or a case's baseline timing is missing")
+    args = parser.parse_args(argv)
+
+    repeat = 5 if args.quick else args.repeat
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    calibrations: List[float] = []
+    results: Dict[str, float] = {}
+    setups = {name: setup for name, setup in build_cases(args.quick) if args.filter in name}
+    for name, setup in setups.items():
+        fn = setup()
+        calibrations.append(_calibrate())
+        results[name] = run_case(fn, repeat)
+    calibration = statistics.median(calibrations) if calibrations else _calibrate()
+    scale = calibration / baseline["calibration_s"] if baseline else 1.0
+
+    def regressed(name: str) -> bool:
+        old = baseline["results"].get(name) if baseline else None
+        if not old:
+            return False
+        # expected time on this machine = baseline time × machine speed ratio
+        expected = old * scale
+        return results[name] / expected - 1 > args.threshold and results[name] - expected > args.min_diff
+
+    for _ in range(args.confirm):
+        for name in [name for name in results if regressed(name)]:
+            results[name] = min(results[name], run_case(setups[name](), repeat))
+
+    regressions: List[str] = []
+    unmatched: List[str] = []
+    print(f"{'case':<56}{'time':>12}" + (f"{'baseline':>12}{'change':>9}" if baseline else ""))
+    for name, seconds in results.items():
+        line = f"{name:<56}{_fmt_time(seconds):>12}"
+        old = baseline["results"].get(name) if baseline else None
+        if baseline and not old:
+            unmatched.append(name)
+        if old:
+            change = seconds / (old * scale) - 1
+            line += f"{_fmt_time(old):>12}{change * 100:+8.1f}%"
+            if regressed(name):
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "calibration_s": calibration,
+        "results": results,
+    }
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        print(f"\nbaseline saved: {args.baseline}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+
+    if baseline is None and not args.save_baseline:
+        print(f"\nno baseline at {args.baseline} - run with --save-baseline to record one")
+        if args.ci:
+            return 1
+    if unmatched:
+        print(f"\n{len(unmatched)} case(s) not in the baseline:")
+        for name in unmatched:
+            print(f"  {name}")
+        if args.ci:
+            return 1
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}"
+              f" and {_fmt_time(args.min_diff).strip()}:")
+        for name in regressions:
+            print(f"  {name}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
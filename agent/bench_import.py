@@ -0,0 +1,144 @@
+# agent/bench_import.py
+# Cold-start benchmark: how long a fresh interpreter takes to import each
+# agent module and to build the FastAPI app.
+#
+# Every measurement runs in a new subprocess (nothing cached in
+# sys.modules) and is repeated; the median is reported. `-X importtime` is
+# parsed for the slowest individual imports so a regression points at the
+# dependency that caused it.
+#
+# Baselines and the regression threshold work like agent.bench (times are
+# scaled by the same calibration loop).
+#
+# Run:  python -m agent.bench_import                   compare with the baseline
+#       python -m agent.bench_import --save-baseline   record a new baseline
+#       python -m agent.bench_import --top 15          more slow imports
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent.bench import _calibrate, load_baseline
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_import_baseline.json")
+
+# name -> statement run in a fresh interpreter
+TARGETS: List[Tuple[str, str]] = [
+    ("import agent.response_analyzer", "import agent.response_analyzer"),
+    ("import agent.firebase_client", "import agent.firebase_client"),
+    ("import agent.whatsapp", "import agent.whatsapp"),
+    ("import agent.scheduler", "import agent.scheduler"),
+    ("import agent.main", "import agent.main"),
+    ("create_app[sqlite]", "from agent.main import create_app; create_app()"),
+]
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("CAREFLOW_STORAGE", "sqlite")
+    env.setdefault("CAREFLOW_SQLITE_PATH", os.path.join(ROOT, ".bench_import.db"))
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure(stmt: str) -> Tuple[float, str]:
+    """Wall seconds for a fresh interpreter to run `stmt`, and its importtime log."""
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", stmt],
+        cwd=ROOT, env=_env(), capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")
+    return elapsed, proc.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> List[Tuple[str, float]]:
+    """Top-level packages by cumulative import time (seconds)."""
+    totals: Dict[str, float] = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        # lines are "self | cumulative | <2 spaces per nesting level>name";
+        # only the outermost imports are counted
+        name = parts[2][1:]
+        if name.startswith(" "):
+            continue
+        totals[name] = totals.get(name, 0.0) + int(parts[1]) / 1e6
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CareFlow cold-start import benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slow imports listed per target")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    calibration = _calibrate()
+    scale = calibration / baseline["calibration_s"] if baseline else 1.0
+
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+    for name, stmt in TARGETS:
+        try:
+            runs = [measure(stmt) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<32}  skipped ({e})")
+            continue
+        seconds = statistics.median(t for t, _ in runs)
+        results[name] = seconds
+        line = f"{name:<32}{seconds * 1000:10.1f} ms"
+        old = baseline["results"].get(name) if baseline else None
+        if old:
+            change = seconds / (old * scale) - 1
+            line += f"   baseline {old * 1000:8.1f} ms {change * 100:+7.1f}%"
+            if change > args.threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+        for module, mod_seconds in slowest_imports(runs[-1][1], args.top):
+            print(f"    {module:<40}{mod_seconds * 1000:8.1f} ms")
+
+    if args.save_baseline:
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "calibration_s": calibration,
+            "results": results,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        print(f"\nbaseline saved: {args.baseline}")
+    elif baseline is None:
+        print("\nno baseline yet - run with --save-baseline to record one")
+
+    if regressions:
+        print(f"\n{len(regressions)} target(s) slower than baseline by more than {args.threshold:.0%}:")
+        for name in regressions:
+            print(f"  {name}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+# agent/cohort_whatif.py
+# Cohort-wide "what if" for alarm thresholds.
+#
+# A snapshot loads every active follow-up patient's latest ratings once and
+# groups them by parameter name into flat arrays (one row per patient that
+# has the parameter). A what-if applies threshold overrides such as
+#   {"Pain Level": {"alarmingRate": 3}}
+# to the rows of a group, re-runs the alarm and trend rules over whole
+# arrays and reports the patients whose condition category would change
+# and the parameters whose trend would flip.
+#
+# NumPy is optional. Without it the same what-if runs patient by patient
+# through alarm_rules (same results, much slower on large cohorts).
+#
+# Rules match alarm_rules / response_analyzer exactly, including the
+# treatment of missing ratings and unusable thresholds.
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .alarm_rules import RuleSet, is_critical_name, signature
+from .log import get_logger
+
+log = get_logger(__name__)
+
+SNAPSHOT_FIELDS = ("patientName", "doctorId", "parameters", "lastRatings", "previousRatings", "lastQ1Answer")
+THRESHOLD_FIELDS = ("alarmingRate", "alarmingAnswer", "alarmingValueMin", "alarmingValueMax")
+
+CATEGORIES = ("normal", "note", "critical")
+TRENDS = ("stable", "improving", "deteriorating")
+Q1_CODES = {"normal": 0, "moderate": 1, "critical": 2}
+
+KIND_RATE, KIND_YESNO, KIND_VALUE, KIND_OTHER = 0, 1, 2, 3
+_KINDS = {"rate": KIND_RATE, "yesno": KIND_YESNO, "value": KIND_VALUE}
+
+Overrides = Dict[str, Dict[str, Any]]
+
+
+def _float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _leading_float(value: Any) -> float:
+    try:
+        return float(str(value).split("/")[0])
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _number_or_nan(value: Any) -> Tuple[float, bool, bool]:
+    """(value as float or NaN, is None, is a non-numeric bound)."""
+    if value is None:
+        return float("nan"), True, False
+    if isinstance(value, (int, float)):
+        return float(value), False, False
+    return float("nan"), False, True
+
+
+class _Group:
+    """All rows (patient × definition) of one parameter name."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.critical = is_critical_name(name)
+        self.rows: List[int] = []
+        self.params: List[Dict[str, Any]] = []
+        self.today: List[Any] = []
+        self.yesterday: List[Any] = []
+
+    def freeze(self, doctor_codes: "np.ndarray") -> None:
+        """Converts the collected rows to arrays (NumPy path)."""
+        self.row = np.asarray(self.rows, dtype=np.int64)
+        self.doctor = doctor_codes[self.row]
+        self.kind = np.asarray([_KINDS.get(p.get("questionType"), KIND_OTHER) for p in self.params], dtype=np.int8)
+        self.has_today = np.asarray([v is not None for v in self.today], dtype=bool)
+        self.has_yesterday = np.asarray([v is not None for v in self.yesterday], dtype=bool)
+        # rate ratings parse with float(); value ratings use the leading number ("120/80")
+        is_value = self.kind == KIND_VALUE
+        self.today_num = np.asarray([
+            _leading_float(v) if value else _float(v) for v, value in zip(self.today, is_value)
+        ], dtype=np.float64)
+        self.yesterday_num = np.asarray([
+            _leading_float(v) if value else _float(v) for v, value in zip(self.yesterday, is_value)
+        ], dtype=np.float64)
+        self.today_str = np.asarray([str(v).lower() for v in self.today], dtype=object)
+        self.yesterday_str = np.asarray([str(v).lower() for v in self.yesterday], dtype=object)
+
+        thresholds = [_thresholds(p) for p in self.params]
+        self.rate = np.asarray([t[0] for t in thresholds], dtype=np.float64)
+        self.answer = np.asarray([t[1] for t in thresholds], dtype=object)
+        self.lo = np.asarray([t[2] for t in thresholds], dtype=np.float64)
+        self.lo_none = np.asarray([t[3] for t in thresholds], dtype=bool)
+        self.lo_bad = np.asarray([t[4] for t in thresholds], dtype=bool)
+        self.hi = np.asarray([t[5] for t in thresholds], dtype=np.float64)
+        self.hi_none = np.asarray([t[6] for t in thresholds], dtype=bool)
+        self.hi_bad = np.asarray([t[7] for t in thresholds], dtype=bool)
+
+
+def _thresholds(param: Dict[str, Any]) -> Tuple[float, str, float, bool, bool, float, bool, bool]:
+    lo, lo_none, lo_bad = _number_or_nan(param.get("alarmingValueMin"))
+    hi, hi_none, hi_bad = _number_or_nan(param.get("alarmingValueMax"))
+    return (
+        _float(param.get("alarmingRate", 5)),
+        str(param.get("alarmingAnswer", "yes")).lower(),
+        lo, lo_none, lo_bad, hi, hi_none, hi_bad,
+    )
+
+
+class CohortSnapshot:
+    """Latest and previous ratings of a cohort, grouped by parameter name."""
+
+    def __init__(self, patients: Iterable[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        self.doc_ids: List[str] = []
+        self.names: List[str] = []
+        self.doctors: List[str] = []
+        self.q1: List[int] = []
+        self.parameters: List[List[Dict[str, Any]]] = []
+        self.today: List[Dict[str, Any]] = []
+        self.yesterday: List[Dict[str, Any]] = []
+        self.groups: Dict[str, _Group] = {}
+
+        for index, patient in enumerate(patients):
+            params = patient.get("parameters") or []
+            today = patient.get("lastRatings") or {}
+            yesterday = patient.get("previousRatings") or {}
+            self.doc_ids.append(patient.get("doc_id") or patient.get("id"))
+            self.names.append(patient.get("patientName", ""))
+            self.doctors.append(str(patient.get("doctorId") or ""))
+            self.q1.append(Q1_CODES.get(patient.get("lastQ1Answer") or "normal", 0))
+            self.parameters.append(params)
+            self.today.append(today)
+            self.yesterday.append(yesterday)
+            for param in params:
+                name = param["name"]
+                group = self.groups.get(name)
+                if group is None:
+                    group = self.groups[name] = _Group(name)
+                group.rows.append(index)
+                group.params.append(param)
+                group.today.append(today.get(name))
+                group.yesterday.append(yesterday.get(name))
+
+        self.vectorized = np is not None
+        if self.vectorized:
+            doctor_ids = sorted(set(self.doctors))
+            self._doctor_codes = {d: i for i, d in enumerate(doctor_ids)}
+            doctor_codes = np.asarray([self._doctor_codes[d] for d in self.doctors], dtype=np.int64)
+            self.q1_codes = np.asarray(self.q1, dtype=np.int8)
+            for group in self.groups.values():
+                group.freeze(doctor_codes)
+        self.loaded_at = time.time()
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def whatif(self, overrides: Overrides, doctor_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Applies `overrides` ({parameter name: {threshold field: value}}),
+        to every patient with that parameter, or only `doctor_id`'s
+        patients, and returns the category and trend changes.
+        """
+        unknown = {f for fields in overrides.values() for f in fields} - set(THRESHOLD_FIELDS)
+        if unknown:
+            raise ValueError(f"only threshold fields can be overridden, got {sorted(unknown)}")
+        started = time.perf_counter()
+        if self.vectorized:
+            changes, trend_flips = self._whatif_numpy(overrides, doctor_id)
+        else:
+            changes, trend_flips = self._whatif_python(overrides, doctor_id)
+        return {
+            "patients": len(self),
+            "vectorized": self.vectorized,
+            "category_changes": changes,
+            "trend_changes": trend_flips,
+            "summary": _summary(changes),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    # ── NumPy ───────────────────────────────────────────
+    def _whatif_numpy(
+        self, overrides: Overrides, doctor_id: Optional[str],
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        n = len(self)
+        doctor_code = self._doctor_codes.get(doctor_id, -1) if doctor_id is not None else None
+        counts = {False: np.zeros(n, dtype=np.int64), True: np.zeros(n, dtype=np.int64)}
+        critical = {False: np.zeros(n, dtype=bool), True: np.zeros(n, dtype=bool)}
+        hits: Dict[str, Tuple["np.ndarray", "np.ndarray"]] = {}
+        trend_flips: List[Dict[str, Any]] = []
+
+        for name, group in self.groups.items():
+            if not len(group.rows):
+                continue
+            before = _thresholds_of(group)
+            after = before
+            if name in overrides:
+                mask = np.ones(len(group.rows), dtype=bool) if doctor_code is None else group.doctor == doctor_code
+                after = _apply_overrides(before, overrides[name], mask)
+
+            hit_before = _alarm_hits(group, before)
+            hit_after = hit_before if after is before else _alarm_hits(group, after)
+            hits[name] = (hit_before, hit_after)
+            for changed, hit in ((False, hit_before), (True, hit_after)):
+                counts[changed] += np.bincount(group.row[hit], minlength=n)
+                if group.critical:
+                    critical[changed][group.row[hit]] = True
+
+            if after is not before:
+                trend_before = _trends(group, before)
+                trend_after = _trends(group, after)
+                for i in np.nonzero(trend_before != trend_after)[0]:
+                    row = int(group.row[i])
+                    trend_flips.append({
+                        "doc_id": self.doc_ids[row],
+                        "patientName": self.names[row],
+                        "parameter": name,
+                        "before": TRENDS[trend_before[i]],
+                        "after": TRENDS[trend_after[i]],
+                    })
+
+        category_before = _categories(self.q1_codes, counts[False], critical[False])
+        category_after = _categories(self.q1_codes, counts[True], critical[True])
+        flipped = np.nonzero(category_before != category_after)[0]
+
+        # crossed parameter names, only for the patients that flipped
+        crossed: Dict[int, Tuple[List[str], List[str]]] = {int(i): ([], []) for i in flipped}
+        if crossed:
+            for name, (hit_before, hit_after) in hits.items():
+                group = self.groups[name]
+                for i in np.nonzero(hit_before | hit_after)[0]:
+                    row = int(group.row[i])
+                    if row in crossed:
+                        if hit_before[i]:
+                            crossed[row][0].append(name)
+                        if hit_after[i]:
+                            crossed[row][1].append(name)
+
+        changes = [
+            self._change(row, CATEGORIES[category_before[row]], CATEGORIES[category_after[row]], *names)
+            for row, names in crossed.items()
+        ]
+        return changes, trend_flips
+
+    # ── Pure Python fallback ────────────────────────────
+    def _whatif_python(
+        self, overrides: Overrides, doctor_id: Optional[str],
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        compiled: Dict[Any, RuleSet] = {}
+
+        def rules_for(params: List[Dict[str, Any]]) -> RuleSet:
+            key = signature(params)
+            try:
+                rules = compiled.get(key)
+            except TypeError:
+                return RuleSet(key, params)
+            if rules is None:
+                rules = compiled[key] = RuleSet(key, params)
+            return rules
+
+        changes: List[Dict[str, Any]] = []
+        trend_flips: List[Dict[str, Any]] = []
+        q1_names = {code: name for name, code in Q1_CODES.items()}
+        for row, params in enumerate(self.parameters):
+            if doctor_id is not None and self.doctors[row] != doctor_id:
+                new_params = params
+            else:
+                new_params = [
+                    {**p, **overrides[p["name"]]} if p["name"] in overrides else p for p in params
+                ]
+            if new_params is params or new_params == params:
+                continue
+            today, yesterday, q1 = self.today[row], self.yesterday[row], q1_names[self.q1[row]]
+            before_rules, after_rules = rules_for(params), rules_for(new_params)
+            before_crossed = before_rules.check(today, params)
+            after_crossed = after_rules.check(today, new_params)
+            before = before_rules.category(q1, before_crossed)
+            after = after_rules.category(q1, after_crossed)
+            if before != after:
+                changes.append(self._change(
+                    row, before, after,
+                    [p["name"] for p in before_crossed], [p["name"] for p in after_crossed],
+                ))
+            status_before = before_rules.status(today, yesterday)
+            status_after = after_rules.status(today, yesterday)
+            for name, value in status_after.items():
+                if status_before.get(name) != value:
+                    trend_flips.append({
+                        "doc_id": self.doc_ids[row],
+                        "patientName": self.names[row],
+                        "parameter": name,
+                        "before": status_before.get(name),
+                        "after": value,
+                    })
+        return changes, trend_flips
+
+    def _change(self, row: int, before: str, after: str, crossed_before: List[str],
+                crossed_after: List[str]) -> Dict[str, Any]:
+        return {
+            "doc_id": self.doc_ids[row],
+            "patientName": self.names[row],
+            "doctorId": self.doctors[row],
+            "before": before,
+            "after": after,
+            "crossed_before": crossed_before,
+            "crossed_after": crossed_after,
+        }
+
+
+# ── Vectorized rules ────────────────────────────────────
+_Thresholds = Dict[str, "np.ndarray"]
+
+
+def _thresholds_of(group: _Group) -> _Thresholds:
+    return {
+        "rate": group.rate, "answer": group.answer,
+        "lo": group.lo, "lo_none": group.lo_none, "lo_bad": group.lo_bad,
+        "hi": group.hi, "hi_none": group.hi_none, "hi_bad": group.hi_bad,
+    }
+
+
+def _apply_overrides(base: _Thresholds, fields: Dict[str, Any], mask: "np.ndarray") -> _Thresholds:
+    out = dict(base)
+
+    def put(key: str, value: Any) -> None:
+        arr = out[key].copy()
+        arr[mask] = value
+        out[key] = arr
+
+    if "alarmingRate" in fields:
+        put("rate", _float(fields["alarmingRate"]))
+    if "alarmingAnswer" in fields:
+        put("answer", str(fields["alarmingAnswer"]).lower())
+    for field, prefix in (("alarmingValueMin", "lo"), ("alarmingValueMax", "hi")):
+        if field in fields:
+            value, is_none, is_bad = _number_or_nan(fields[field])
+            put(prefix, value)
+            put(f"{prefix}_none", is_none)
+            put(f"{prefix}_bad", is_bad)
+    return out
+
+
+def _alarm_hits(group: _Group, t: _Thresholds) -> "np.ndarray":
+    kind, present = group.kind, group.has_today
+    with np.errstate(invalid="ignore"):
+        # NaN (unparsable rating or threshold) never compares true
+        rate_hit = (kind == KIND_RATE) & (group.today_num >= t["rate"])
+        yesno_hit = (kind == KIND_YESNO) & (group.today_str == t["answer"])
+        # a non-numeric min disables the rule; a non-numeric max leaves the min check
+        value_enabled = ~t["lo_bad"] & ~(t["hi_bad"] & t["lo_none"]) & ~(t["lo_none"] & t["hi_none"])
+        hi = np.where(t["hi_bad"], np.nan, t["hi"])
+        value_hit = (kind == KIND_VALUE) & value_enabled & (
+            (group.today_num < t["lo"]) | (group.today_num > hi)
+        )
+    return present & (rate_hit | yesno_hit | value_hit)
+
+
+def _compare(today: "np.ndarray", yesterday: "np.ndarray") -> "np.ndarray":
+    """1 improving (lower), 2 deteriorating (higher), 0 stable or unparsable."""
+    with np.errstate(invalid="ignore"):
+        return np.where(today < yesterday, 1, np.where(today > yesterday, 2, 0)).astype(np.int8)
+
+
+def _trends(group: _Group, t: _Thresholds) -> "np.ndarray":
+    """Trend codes (TRENDS) of the threshold-dependent kinds; rate rows are 0."""
+    trend = np.zeros(len(group.rows), dtype=np.int8)
+    both = group.has_today & group.has_yesterday
+
+    yesno = both & (group.kind == KIND_YESNO)
+    today_alarming = group.today_str == t["answer"]
+    yesterday_alarming = group.yesterday_str == t["answer"]
+    trend[yesno & today_alarming & ~yesterday_alarming] = 2
+    trend[yesno & ~today_alarming & yesterday_alarming] = 1
+
+    value = both & (group.kind == KIND_VALUE)
+    ranged = ~t["lo_none"] & ~t["hi_none"]
+    # both bounds set: trend toward the centre of the range (always stable
+    # when a bound is non-numeric); otherwise compare raw readings
+    target = (t["lo"] + t["hi"]) / 2
+    towards = _compare(np.abs(group.today_num - target), np.abs(group.yesterday_num - target))
+    raw = _compare(group.today_num, group.yesterday_num)
+    bad_range = ranged & (t["lo_bad"] | t["hi_bad"])
+    value_trend = np.where(ranged, np.where(bad_range, 0, towards), raw)
+    trend[value] = value_trend[value]
+    return trend
+
+
+def _categories(q1: "np.ndarray", counts: "np.ndarray", critical: "np.ndarray") -> "np.ndarray":
+    """Category codes (CATEGORIES) per patient, as compute_condition_category."""
+    is_critical = (q1 == 2) | (counts >= 2) | critical
+    is_note = (q1 == 1) | (counts == 1)
+    return np.where(is_critical, 2, np.where(is_note, 1, 0)).astype(np.int8)
+
+
+def _summary(changes: List[Dict[str, Any]]) -> Dict[str, int]:
+    summary: Dict[str, int] = {}
+    for change in changes:
+        key = f"{change['before']}->{change['after']}"
+        summary[key] = summary.get(key, 0) + 1
+    return summary
+
+
+# ── Snapshot cache ──────────────────────────────────────
+_snapshot: Optional[CohortSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def load_snapshot(max_age: Optional[float] = None) -> CohortSnapshot:
+    """
+    The active cohort from storage, rebuilt when older than `max_age`
+    seconds (WHATIF_SNAPSHOT_TTL_SECONDS, default 300).
+    """
+    global _snapshot
+    if max_age is None:
+        max_age = float(os.getenv("WHATIF_SNAPSHOT_TTL_SECONDS", "300"))
+    with _snapshot_lock:
+        if _snapshot is None or time.time() - _snapshot.loaded_at > max_age:
+            from .storage import get_storage
+
+            patients = get_storage().iter_active_followups(page_size=500, select=SNAPSHOT_FIELDS)
+            _snapshot = CohortSnapshot(patients)
+            log.info("What-if snapshot: %d patients, %d parameters in %.0f ms",
+                     len(_snapshot), len(_snapshot.groups), _snapshot.build_ms)
+        return _snapshot
@@ -1,7 +1,7 @@
 import os
 import datetime
 from typing import Any, Dict, List
-from .firebase_client import db
+from .firebase_client import save_alert
 from .whatsapp import send_whatsapp_message, send_doctor_alert_whatsapp
 from .alerts import send_doctor_alert
 
@@ -14,8 +14,7 @@ def send_critical_alert(patient: Dict[str, Any], p_doc_id: str, day_number: int)
     p_email = patient.get("email")
     
     # 1. Save to critical_alerts
-    alert_ref = db.collection("critical_alerts").document()
-    alert_ref.set({
+    save_alert({
         "patientDocId": p_doc_id,
         "patientName": p_name,
         "patientPhone": p_phone,
@@ -52,8 +51,7 @@ def send_moderate_alert(patient: Dict[str, Any], p_doc_id: str, day_number: int)
     p_email = patient.get("email")
 
     # 1. Save to critical_alerts
-    alert_ref = db.collection("critical_alerts").document()
-    alert_ref.set({
+    save_alert({
         "patientDocId": p_doc_id,
         "patientName": p_name,
         "patientPhone": p_phone,
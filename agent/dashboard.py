@@ -0,0 +1,288 @@
+# agent/dashboard.py
+# Materialized dashboard counters, maintained on every state transition.
+#
+# The `dashboard_stats` collection holds one small document per doctor
+# (`doctor_<doctorId>`) and one for everyone (`global`):
+#
+#   {"active": 42,
+#    "lastStatus": {"normal": 30, "note": 9, "critical": 3},
+#    "conversationState": {"awaiting_q1": 5, "completed_today": 37},
+#    "unresolvedAlerts": 2,
+#    "daily": {"2026-10-19": {"sent": 40, "responded": 35}},
+#    "updatedAt": ...}
+#
+# Counts cover follow-ups with status "active". The deltas of a write
+# come from the document's previous values, read in the follow-up's (or
+# alert's) own transaction, and commit in that same transaction. On
+# Firestore they are Increment transforms merged blind (no read) into one
+# of DASHBOARD_SHARDS shard documents (`<scope>~<n>`, picked at random)
+# per stats document: the transaction contends only on the document it
+# read, never on `global`, and a read sums the shards. SQLite, a single
+# local writer, keeps one row per stats document updated in the write's
+# transaction. A dashboard reads one scope's shards instead of scanning
+# followup_patients.
+#
+# `daily` counts check-ins sent (an update setting awaiting_q1, written
+# right after each Q1 goes out) and answered (a move from awaiting_q1 or
+# no_response_emergency_sent into q1_answered) per calendar day in
+# DASHBOARD_TZ; today's response rate is their ratio.
+# rebuild() recomputes the patient and alert counts from a full scan, for
+# the first deploy or after writes made outside the agent. It overwrites
+# the shards, so Increments committed while it runs are lost: run it with
+# the agent (webhook, scheduler, UI writes) stopped.
+#
+#   DASHBOARD_TZ=Asia/Kolkata     day boundary for the daily counters
+#   DASHBOARD_DAILY_DAYS=30       daily entries kept by rebuild()
+#   DASHBOARD_SHARDS=10           Firestore shard documents per stats document (only ever raise it)
+
+from __future__ import annotations
+
+import datetime
+import os
+import random
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .log import get_logger
+
+log = get_logger(__name__)
+
+COLLECTION = "dashboard_stats"
+GLOBAL_SCOPE = "global"
+DAILY_DAYS = int(os.getenv("DASHBOARD_DAILY_DAYS", "30"))
+SHARDS = max(1, int(os.getenv("DASHBOARD_SHARDS", "10")))
+SHARD_SEPARATOR = "~"
+
+# A followup update only touches the counters if it sets one of these
+TRACKED_FIELDS = ("status", "doctorId", "lastStatus", "conversationState")
+COUNT_FIELDS = ("lastStatus", "conversationState")
+RESPONDED_FROM = ("awaiting_q1", "no_response_emergency_sent")
+
+# (field, key) or (field,) paths into a stats document -> change
+Deltas = Dict[Tuple[str, ...], int]
+
+def _zone() -> datetime.tzinfo:
+    name = os.getenv("DASHBOARD_TZ", "Asia/Kolkata")
+    try:
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo(name)
+    except Exception:
+        # no tz database: IST, where the daily check-ins are scheduled
+        return datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+
+def today() -> str:
+    return datetime.datetime.now(_zone()).date().isoformat()
+
+
+def scope_id(doctor_id: Optional[str]) -> str:
+    return f"doctor_{doctor_id}" if doctor_id else GLOBAL_SCOPE
+
+
+def shard_ids(scope: str) -> List[str]:
+    """Every shard document id of a stats document."""
+    return [f"{scope}{SHARD_SEPARATOR}{n}" for n in range(SHARDS)]
+
+
+def scope_of(doc_id: str) -> str:
+    """The stats document a shard (or an unsharded document) belongs to."""
+    return doc_id.split(SHARD_SEPARATOR, 1)[0]
+
+
+def merge_shards(docs: Iterable[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """Sums shard documents into one stats document; None if there are none."""
+    merged: Optional[Dict[str, Any]] = None
+
+    def add(target: Dict[str, Any], source: Dict[str, Any]) -> None:
+        for key, value in source.items():
+            if key == "updatedAt":
+                if value is not None and (target.get(key) is None or value > target[key]):
+                    target[key] = value
+            elif isinstance(value, dict):
+                add(target.setdefault(key, {}), value)
+            elif isinstance(value, (int, float)):
+                target[key] = target.get(key, 0) + value
+
+    for doc in docs:
+        if doc is None:
+            continue
+        merged = merged if merged is not None else {}
+        add(merged, doc)
+    return merged
+
+
+def _key(value: Any) -> str:
+    # Used as a map key / Firestore field path segment
+    return str(value).replace(".", "_").replace("`", "") if value not in (None, "") else "unknown"
+
+
+def touches(update: Dict[str, Any]) -> bool:
+    return any(field in update for field in TRACKED_FIELDS)
+
+
+def _contribution(doc: Optional[Dict[str, Any]]) -> Deltas:
+    if not doc or doc.get("status") != "active":
+        return {}
+    counts: Deltas = {("active",): 1}
+    for field in COUNT_FIELDS:
+        counts[(field, _key(doc.get(field)))] = 1
+    return counts
+
+
+def _scopes(doc: Optional[Dict[str, Any]]) -> List[str]:
+    scopes = [GLOBAL_SCOPE]
+    if doc and doc.get("doctorId"):
+        scopes.append(scope_id(doc["doctorId"]))
+    return scopes
+
+
+def _add(target: Dict[str, Deltas], scopes: Iterable[str], deltas: Deltas, sign: int) -> None:
+    for scope in scopes:
+        bucket = target.setdefault(scope, {})
+        for path, change in deltas.items():
+            bucket[path] = bucket.get(path, 0) + sign * change
+
+
+def followup_deltas(
+    before: Optional[Dict[str, Any]],
+    update: Dict[str, Any],
+    replace: bool = False,
+    day: Optional[str] = None,
+) -> Dict[str, Deltas]:
+    """
+    Counter changes per stats document for applying `update` to a follow-up
+    whose stored values are `before` (None when the document is new).
+    `replace` is a set() of the whole document rather than a field update.
+    """
+    after = dict(update) if replace else {**(before or {}), **update}
+    result: Dict[str, Deltas] = {}
+    _add(result, _scopes(before), _contribution(before), -1)
+    _add(result, _scopes(after), _contribution(after), +1)
+
+    if after.get("status") == "active" and "conversationState" in update:
+        old_state = (before or {}).get("conversationState")
+        new_state = update["conversationState"]
+        day = day or today()
+        if new_state == "awaiting_q1":
+            _add(result, _scopes(after), {("daily", day, "sent"): 1}, +1)
+        elif new_state == "q1_answered" and old_state in RESPONDED_FROM:
+            _add(result, _scopes(after), {("daily", day, "responded"): 1}, +1)
+
+    return {
+        scope: {path: change for path, change in deltas.items() if change}
+        for scope, deltas in result.items()
+        if any(deltas.values())
+    }
+
+
+def alert_deltas(alert: Dict[str, Any], sign: int = 1) -> Dict[str, Deltas]:
+    """Counter changes for storing (sign 1) or resolving (sign -1) an unresolved alert."""
+    if alert.get("resolved"):
+        return {}
+    result: Dict[str, Deltas] = {}
+    _add(result, _scopes(alert), {("unresolvedAlerts",): 1}, sign)
+    return result
+
+
+def apply_deltas(doc: Dict[str, Any], deltas: Deltas) -> Dict[str, Any]:
+    """Applies `deltas` to a plain stats dict in place (local backends)."""
+    for path, change in deltas.items():
+        node = doc
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = node.get(path[-1], 0) + change
+    return doc
+
+
+def firestore_writes(deltas: Dict[str, Deltas]) -> List[Tuple[str, Dict[str, Any]]]:
+    """(shard document id, data) pairs to `set(..., merge=True)` into COLLECTION, in one batch."""
+    from google.cloud.firestore_v1 import Increment
+    from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP as FIRESTORE_TS
+
+    writes = []
+    for scope, changes in deltas.items():
+        data: Dict[str, Any] = {"updatedAt": FIRESTORE_TS}
+        for path, change in changes.items():
+            node = data
+            for part in path[:-1]:
+                node = node.setdefault(part, {})
+            node[path[-1]] = Increment(change)
+        writes.append((random.choice(shard_ids(scope)), data))
+    return writes
+
+
+def stage_firestore_writes(client: Any, writer: Any, deltas: Dict[str, Deltas]) -> None:
+    """
+    Adds the Increments of `deltas` to `writer`, a transaction or batch of
+    `client`, as blind merges into random shards: nothing is read, so a
+    transaction carrying them still contends only on the document it read.
+    """
+    for shard, data in firestore_writes(deltas):
+        writer.set(client.collection(COLLECTION).document(shard), data, merge=True)
+
+
+def summary(doc: Optional[Dict[str, Any]], day: Optional[str] = None) -> Dict[str, Any]:
+    """The API view of a stats document, with today's response rate."""
+    doc = doc or {}
+    day = day or today()
+    daily = (doc.get("daily") or {}).get(day) or {}
+    sent, responded = int(daily.get("sent", 0)), int(daily.get("responded", 0))
+    return {
+        "active": int(doc.get("active", 0)),
+        "lastStatus": {k: v for k, v in (doc.get("lastStatus") or {}).items() if v},
+        "conversationState": {k: v for k, v in (doc.get("conversationState") or {}).items() if v},
+        "unresolvedAlerts": int(doc.get("unresolvedAlerts", 0)),
+        "today": {
+            "date": day,
+            "sent": sent,
+            "responded": responded,
+            "responseRate": round(responded / sent, 3) if sent else None,
+        },
+        "updatedAt": doc.get("updatedAt"),
+    }
+
+
+def get_dashboard(doctor_id: Optional[str] = None) -> Dict[str, Any]:
+    """The doctor's (or the global) stats document: one read of its shards."""
+    from .storage import get_storage
+
+    return summary(get_storage().get_dashboard_stats(scope_id(doctor_id)))
+
+
+def rebuild() -> Dict[str, Dict[str, Any]]:
+    """
+    Recomputes every stats document's patient and alert counts from a full
+    scan and stores them; daily counters are kept (trimmed to
+    DASHBOARD_DAILY_DAYS). Returns the new counts per document id.
+    Only with writes stopped: transitions during the scan or the rewrite
+    are lost.
+    """
+    from .storage import get_storage
+
+    storage = get_storage()
+    counts: Dict[str, Deltas] = {}
+    fields = ["status", "doctorId", *COUNT_FIELDS]
+    for doc in storage.iter_active_followups(page_size=500, select=fields):
+        _add(counts, _scopes(doc), _contribution(doc), +1)
+    for alert in storage.iter_unresolved_alerts(select=["doctorId", "resolved"]):
+        _add(counts, _scopes(alert), {("unresolvedAlerts",): 1}, +1)
+
+    cutoff = (datetime.datetime.now(_zone()).date() - datetime.timedelta(days=DAILY_DAYS)).isoformat()
+    rebuilt: Dict[str, Dict[str, Any]] = {}
+    for scope in set(counts) | set(storage.list_dashboard_stats()) | {GLOBAL_SCOPE}:
+        doc: Dict[str, Any] = {"active": 0, "lastStatus": {}, "conversationState": {}, "unresolvedAlerts": 0}
+        apply_deltas(doc, counts.get(scope, {}))
+        daily = (storage.get_dashboard_stats(scope) or {}).get("daily") or {}
+        doc["daily"] = {day: value for day, value in daily.items() if day >= cutoff}
+        storage.set_dashboard_stats(scope, doc)
+        rebuilt[scope] = doc
+    log.info("Rebuilt %d dashboard stats documents", len(rebuilt))
+    return rebuilt
+
+
+if __name__ == "__main__":
+    # python -m agent.dashboard   recompute all stats documents from a full scan
+    #                             (with the agent stopped; see rebuild())
+    import json
+
+    print(json.dumps(rebuild(), indent=2, sort_keys=True, default=str))
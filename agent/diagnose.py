@@ -1,59 +1,261 @@
 # agent/diagnose.py
-# Checks every possible reason emergency is firing wrongly
+# Ops view of the follow-up cohort: distributions from server-side count()
+# aggregations and short, ordered, filtered listings, never a full scan.
+#
+# `summary` runs a fixed set of count() queries (one per conversation
+# state / last status plus a few alert and check-in counts), so it costs
+# the same for 10 or 100,000 patients. The listings read one page
+# (--limit, newest first for check-ins and alerts) and print the id to
+# pass as --after for the next page.
+#
+# Run:  python -m agent.diagnose                                   summary of all doctors
+#       python -m agent.diagnose summary --doctor D1 --stale-since 6h
+#       python -m agent.diagnose patients --state awaiting_q1 --stale-since 6h
+#       python -m agent.diagnose patients --doctor D1 --day 3 --after <id>
+#       python -m agent.diagnose checkins --since 24h --day 3
+#       python -m agent.diagnose alerts --unresolved --doctor D1
+#       add --json for machine-readable output
+#
+# On Firestore, filters on two different fields (e.g. --state with
+# --stale-since, or --patient with the timestamp ordering) need a
+# composite index; the error message links to creating it.
 
-import os, sys
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from dotenv import load_dotenv
-load_dotenv()
+from __future__ import annotations
 
-from firebase_client import db
+import argparse
+import datetime
+import json
+import re
+import sys
+from typing import Any, Dict, List, Optional, Sequence
 
-print("="*55)
-print("CAREFLOW DIAGNOSTIC - CHECKING RESPONSE RECORDING")
-print("="*55)
+from .storage import Filter, StorageBackend, get_storage
 
-# Check all active patients
-patients = list(
-    db.collection("followup_patients")
-    .where("status", "==", "active")
-    .stream()
+CONVERSATION_STATES = (
+    "idle", "awaiting_q1", "q1_answered", "awaiting_parameters",
+    "parameters_answered", "completed_today", "no_response_emergency_sent",
 )
+LAST_STATUSES = ("normal", "note", "critical")
 
-print(f"\n[OK] Active patients: {len(patients)}")
-for p in patients:
-    d = p.to_dict()
-    print(f"\n  Patient: {d.get('patientName')}")
-    print(f"  Phone in DB:        '{d.get('patientPhone')}'")
-    print(f"  conversationState:  '{d.get('conversationState')}'")
-    print(f"  checkinsCompleted:  {d.get('checkinsCompleted', 0)}")
-    print(f"  lastRatings:        {d.get('lastRatings', {})}")
-    print(f"  lastStatus:         {d.get('lastStatus', 'none')}")
-
-# Check recent checkin responses
-print("\n" + "="*55)
-checkins = list(
-    db.collection("checkin_responses")
-    .limit(5)
-    .stream()
-)
-print(f"[OK] Recent checkin responses: {len(checkins)}")
-for c in checkins:
-    d = c.to_dict()
-    print(f"  -> {d.get('patientName')} "
-          f"Day {d.get('dayNumber')} "
-          f"| Status: {d.get('overallStatus')} "
-          f"| Ratings: {d.get('ratings')}")
-
-# Check recent alerts
-print("\n" + "="*55)
-alerts = list(
-    db.collection("critical_alerts")
-    .limit(5)
-    .stream()
-)
-print(f"[OK] Recent critical alerts: {len(alerts)}")
-for a in alerts:
-    d = a.to_dict()
-    print(f"  -> {d.get('patientName')} "
-          f"| Type: {d.get('alertType')} "
-          f"| Resolved: {d.get('resolved')}")
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)([mhd])$")
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_since(text: str) -> datetime.datetime:
+    """'30m' / '6h' / '2d' ago, or an ISO date / datetime (UTC if no zone)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    match = _DURATION.match(text.strip())
+    if match:
+        return now - datetime.timedelta(**{_UNITS[match.group(2)]: float(match.group(1))})
+    value = datetime.datetime.fromisoformat(text.strip())
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+
+def _followup_filters(args: argparse.Namespace) -> List[Filter]:
+    filters: List[Filter] = [("status", "==", args.status)]
+    if args.doctor:
+        filters.append(("doctorId", "==", args.doctor))
+    if getattr(args, "state", None):
+        filters.append(("conversationState", "==", args.state))
+    if getattr(args, "day", None) is not None:
+        filters.append(("currentDay", "==", args.day))
+    return filters
+
+
+def summary(storage: StorageBackend, args: argparse.Namespace) -> Dict[str, Any]:
+    base = _followup_filters(args)
+    total = storage.count("followup_patients", base)
+
+    def distribution(field: str, values: Sequence[str]) -> Dict[str, int]:
+        counts = {value: storage.count("followup_patients", [*base, (field, "==", value)]) for value in values}
+        counts = {value: n for value, n in counts.items() if n}
+        other = total - sum(counts.values())
+        if other:
+            counts["other"] = other
+        return counts
+
+    alert_filters: List[Filter] = [("doctorId", "==", args.doctor)] if args.doctor else []
+    since = parse_since(args.since)
+    result: Dict[str, Any] = {
+        "status": args.status,
+        "doctor": args.doctor,
+        "patients": total,
+        "conversationState": distribution("conversationState", CONVERSATION_STATES),
+        "lastStatus": distribution("lastStatus", LAST_STATUSES),
+        "unresolvedAlerts": storage.count("critical_alerts", [*alert_filters, ("resolved", "==", False)]),
+        "since": since.isoformat(),
+        "alertsSince": storage.count("critical_alerts", [*alert_filters, ("timestamp", ">=", since)]),
+        # check-ins carry no doctorId: this one is always across all doctors
+        "checkinsSince": storage.count("checkin_responses", [("timestamp", ">=", since)]),
+    }
+    if args.stale_since:
+        cutoff = parse_since(args.stale_since)
+        result["staleAwaitingQ1"] = storage.count("followup_patients", [
+            *base, ("conversationState", "==", "awaiting_q1"), ("q1SentAt", "<", cutoff),
+        ])
+    return result
+
+
+def list_patients(storage: StorageBackend, args: argparse.Namespace) -> Dict[str, Any]:
+    filters = _followup_filters(args)
+    order_by = None
+    if args.stale_since:
+        # Firestore orders by the range-filtered field first
+        filters.append(("q1SentAt", "<", parse_since(args.stale_since)))
+        order_by = "q1SentAt"
+    fields = ["patientName", "patientPhone", "doctorId", "conversationState", "lastStatus",
+              "currentDay", "followupDays", "checkinsCompleted", "q1SentAt"]
+    docs = storage.query("followup_patients", filters, order_by=order_by,
+                         limit=args.limit, after=args.after, select=fields)
+    return _page(docs, storage.count("followup_patients", filters), args.limit)
+
+
+def list_checkins(storage: StorageBackend, args: argparse.Namespace) -> Dict[str, Any]:
+    filters: List[Filter] = []
+    if args.patient:
+        filters.append(("patientDocId", "==", args.patient))
+    if args.day is not None:
+        filters.append(("dayNumber", "==", args.day))
+    if args.since:
+        filters.append(("timestamp", ">=", parse_since(args.since)))
+    fields = ["patientDocId", "patientName", "dayNumber", "overallStatus", "conditionCategory",
+              "ratings", "alertTriggered", "timestamp"]
+    docs = storage.query("checkin_responses", filters, order_by="timestamp", descending=True,
+                         limit=args.limit, after=args.after, select=fields)
+    return _page(docs, storage.count("checkin_responses", filters), args.limit)
+
+
+def list_alerts(storage: StorageBackend, args: argparse.Namespace) -> Dict[str, Any]:
+    filters: List[Filter] = []
+    if args.unresolved:
+        filters.append(("resolved", "==", False))
+    if args.doctor:
+        filters.append(("doctorId", "==", args.doctor))
+    if args.patient:
+        filters.append(("patientDocId", "==", args.patient))
+    if args.since:
+        filters.append(("timestamp", ">=", parse_since(args.since)))
+    fields = ["patientDocId", "patientName", "doctorId", "alertType", "resolved", "timestamp"]
+    docs = storage.query("critical_alerts", filters, order_by="timestamp", descending=True,
+                         limit=args.limit, after=args.after, select=fields)
+    return _page(docs, storage.count("critical_alerts", filters), args.limit)
+
+
+def _page(docs: List[Dict[str, Any]], total: int, limit: int) -> Dict[str, Any]:
+    return {
+        "total": total,
+        "items": docs,
+        "next": docs[-1]["id"] if len(docs) == limit else None,
+    }
+
+
+# ─────────────────────────────────────────────
+# TEXT OUTPUT
+# ─────────────────────────────────────────────
+def _ts(value: Any) -> str:
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    return str(value)[:16].replace("T", " ") if value else "-"
+
+
+def _print_distribution(title: str, counts: Dict[str, int], total: int) -> None:
+    print(f"\n{title}")
+    for value, n in sorted(counts.items(), key=lambda item: -item[1]):
+        share = f"{100 * n / total:5.1f}%" if total else "    -"
+        print(f"  {value:<28} {n:>7}  {share}")
+
+
+def print_summary(result: Dict[str, Any]) -> None:
+    who = f"doctor {result['doctor']}" if result["doctor"] else "all doctors"
+    print("=" * 55)
+    print(f"CAREFLOW OPS SUMMARY - {who}")
+    print("=" * 55)
+    print(f"Patients ({result['status']}): {result['patients']}")
+    _print_distribution("By conversation state", result["conversationState"], result["patients"])
+    _print_distribution("By last status", result["lastStatus"], result["patients"])
+    print(f"\nUnresolved alerts:          {result['unresolvedAlerts']}")
+    print(f"Alerts since {_ts(result['since'])}:   {result['alertsSince']}")
+    print(f"Check-ins since {_ts(result['since'])}: {result['checkinsSince']} (all doctors)")
+    if "staleAwaitingQ1" in result:
+        print(f"Awaiting Q1 reply, stale:   {result['staleAwaitingQ1']}")
+
+
+def print_page(kind: str, page: Dict[str, Any]) -> None:
+    print(f"{kind}: showing {len(page['items'])} of {page['total']}")
+    for d in page["items"]:
+        if kind == "patients":
+            print(f"  {d['id']}  {d.get('patientName', '-'):<20} '{d.get('patientPhone', '')}'  "
+                  f"day {d.get('currentDay', 0)}/{d.get('followupDays', '-')}  "
+                  f"{d.get('conversationState', '-'):<26} {d.get('lastStatus', '-'):<8} "
+                  f"checkins {d.get('checkinsCompleted', 0)}")
+        elif kind == "checkins":
+            print(f"  {_ts(d.get('timestamp'))}  {d.get('patientName', '-'):<20} day {d.get('dayNumber')}  "
+                  f"{d.get('overallStatus', '-'):<8} alert={d.get('alertTriggered', False)}  {d.get('ratings', {})}")
+        else:
+            print(f"  {_ts(d.get('timestamp'))}  {d.get('patientName', '-'):<20} "
+                  f"{d.get('alertType', '-'):<16} resolved={d.get('resolved')}  {d['id']}")
+    if page["next"]:
+        print(f"next page: --after {page['next']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="CareFlow ops diagnostics (count() aggregations, no full scans)")
+    sub = parser.add_subparsers(dest="command")
+
+    def common(p: argparse.ArgumentParser, listing: bool) -> None:
+        p.add_argument("--json", action="store_true", help="print JSON instead of text")
+        p.add_argument("--doctor", help="doctorId")
+        if listing:
+            p.add_argument("--limit", type=int, default=20, help="page size")
+            p.add_argument("--after", help="id of the last item of the previous page")
+
+    p = sub.add_parser("summary", help="counts by state and status (default)")
+    common(p, listing=False)
+    p.add_argument("--status", default="active", help="follow-up status counted")
+    p.add_argument("--since", default="24h", help="window for the alert / check-in counts (6h, 2d, ISO date)")
+    p.add_argument("--stale-since", help="also count awaiting_q1 patients whose Q1 went out before this")
+
+    p = sub.add_parser("patients", help="list follow-ups")
+    common(p, listing=True)
+    p.add_argument("--status", default="active")
+    p.add_argument("--state", choices=CONVERSATION_STATES)
+    p.add_argument("--day", type=int, help="currentDay")
+    p.add_argument("--stale-since", help="only patients whose last Q1 went out before this")
+
+    p = sub.add_parser("checkins", help="latest check-in responses")
+    common(p, listing=True)
+    p.add_argument("--patient", help="follow-up document id")
+    p.add_argument("--day", type=int, help="dayNumber")
+    p.add_argument("--since")
+
+    p = sub.add_parser("alerts", help="latest critical alerts")
+    common(p, listing=True)
+    p.add_argument("--patient", help="follow-up document id")
+    p.add_argument("--unresolved", action="store_true")
+    p.add_argument("--since")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["summary"])
+
+    storage = get_storage()
+    if args.command == "summary":
+        result = summary(storage, args)
+    else:
+        listing = {"patients": list_patients, "checkins": list_checkins, "alerts": list_alerts}
+        result = listing[args.command](storage, args)
+
+    if args.json:
+        print(json.dumps(result, indent=2, default=str))
+    elif args.command == "summary":
+        print_summary(result)
+    else:
+        print_page(args.command, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
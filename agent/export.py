@@ -0,0 +1,382 @@
+# agent/export.py
+# Incremental columnar export of checkin_responses and critical_alerts.
+#
+# Each run pages through a collection in `timestamp` order, starting at the
+# watermark the previous run left in <out>/_watermarks.json, and writes
+# Parquet (or Arrow IPC) files partitioned by UTC date:
+#
+#   exports/checkin_responses/date=2026-10-19/part-20261019T210000-00000.parquet
+#
+# Rows are buffered up to --batch-rows and flushed, so memory stays bounded
+# whatever the backlog; the watermark (last timestamp plus the ids exported
+# at exactly that timestamp) is saved after every flush, so an interrupted
+# run resumes without gaps or duplicates. Documents newer than
+# --lag-seconds are left for the next run: SERVER_TIMESTAMP writes still in
+# flight could otherwise land behind the watermark.
+#
+# --full rebuilds a collection from scratch instead of appending to its
+# partitions: files go to <out>/_full-<collection>/, which replaces the
+# collection's directory once the run completes, and only then is the
+# watermark saved. An interrupted --full run leaves the previous export
+# and watermark as they were.
+#
+# Check-ins are flattened into typed columns: for every parameter
+# `rating__<name>` (the raw answer, string), `rating_value__<name>` (its
+# number, float64, null for yes/no) and `status__<name>` (trend). Free-text
+# and contact fields (reply, summary, names, phone, email) are left out
+# unless --include-text is given.
+#
+# Needs pyarrow (optional; not used by the server).
+#
+# Run:  python -m agent.export --out exports
+#       python -m agent.export --out exports --collection critical_alerts --format arrow
+#       python -m agent.export --out exports --full          rebuild from scratch
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+from .log import get_logger
+from .storage import TIMESTAMPED_COLLECTIONS, StorageBackend, get_storage
+
+log = get_logger(__name__)
+
+WATERMARK_FILE = "_watermarks.json"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# (document field, column, type) per collection; types are resolved to
+# pyarrow types in _arrow_type
+FIELDS: Dict[str, List[Tuple[str, str, str]]] = {
+    "checkin_responses": [
+        ("patientDocId", "patient_doc_id", "string"),
+        ("dayNumber", "day_number", "int64"),
+        ("conditionCategory", "condition_category", "string"),
+        ("overallStatus", "overall_status", "string"),
+        ("alertTriggered", "alert_triggered", "bool"),
+        ("alertedParameters", "alerted_parameters", "list"),
+    ],
+    "critical_alerts": [
+        ("patientDocId", "patient_doc_id", "string"),
+        ("doctorId", "doctor_id", "string"),
+        ("alertType", "alert_type", "string"),
+        ("selfReportedCondition", "self_reported_condition", "string"),
+        ("dayNumber", "day_number", "int64"),
+        ("resolved", "resolved", "bool"),
+        ("notifiedVia", "notified_via", "list"),
+    ],
+}
+TEXT_FIELDS: Dict[str, List[Tuple[str, str, str]]] = {
+    "checkin_responses": [
+        ("patientName", "patient_name", "string"),
+        ("rawReply", "raw_reply", "string"),
+        ("subjective", "subjective", "string"),
+        ("doctorSummary", "doctor_summary", "string"),
+    ],
+    "critical_alerts": [
+        ("patientName", "patient_name", "string"),
+        ("patientPhone", "patient_phone", "string"),
+        ("patientEmail", "patient_email", "string"),
+        ("doctorName", "doctor_name", "string"),
+        ("reason", "reason", "string"),
+    ],
+}
+# Flattened per-parameter columns: prefix -> type
+DYNAMIC_PREFIXES = {"rating__": "string", "rating_value__": "float64", "status__": "string"}
+EXTRA_COLUMNS = {"anomalous_parameters": "list", "timings_total_ms": "int64"}
+
+
+def column_name(prefix: str, name: str) -> str:
+    """'rating__' + 'Blood Pressure' -> 'rating__blood_pressure'."""
+    return prefix + (re.sub(r"[^0-9a-z]+", "_", str(name).lower()).strip("_") or "unnamed")
+
+
+def to_utc(value: Any) -> Optional[datetime.datetime]:
+    """A stored timestamp (datetime or ISO text) as an aware UTC datetime."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime.datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).split("/")[0])
+    except ValueError:
+        return None
+
+
+def _coerce(value: Any, kind: str) -> Any:
+    if value is None:
+        return None
+    try:
+        if kind == "string":
+            return str(value)
+        if kind == "int64":
+            return int(value)
+        if kind == "float64":
+            return float(value)
+        if kind == "bool":
+            return bool(value)
+        if kind == "list":
+            return [str(v) for v in value] if isinstance(value, (list, tuple)) else [str(value)]
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def flatten(collection: str, doc: Dict[str, Any], include_text: bool = False) -> Dict[str, Any]:
+    """One export row for a stored document (which must have a timestamp)."""
+    row: Dict[str, Any] = {"id": doc["id"], "timestamp": to_utc(doc.get("timestamp"))}
+    fields = FIELDS[collection] + (TEXT_FIELDS[collection] if include_text else [])
+    for field, column, kind in fields:
+        row[column] = _coerce(doc.get(field), kind)
+
+    if collection == "checkin_responses":
+        for name, value in (doc.get("ratings") or {}).items():
+            row[column_name("rating__", name)] = None if value is None else str(value)
+            row[column_name("rating_value__", name)] = _number(value)
+        for name, status in (doc.get("statusPerParameter") or {}).items():
+            row[column_name("status__", name)] = None if status is None else str(status)
+        anomalies = doc.get("anomalousParameters") or []
+        row["anomalous_parameters"] = [str(a.get("name")) for a in anomalies if isinstance(a, dict)]
+        row["timings_total_ms"] = _coerce((doc.get("timings") or {}).get("total"), "int64")
+    return row
+
+
+def _arrow_type(kind: str):
+    return {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "list": pa.list_(pa.string()),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }[kind]
+
+
+def _column_kind(collection: str, column: str) -> str:
+    if column == "id":
+        return "string"
+    if column == "timestamp":
+        return "timestamp"
+    for _, name, kind in FIELDS[collection] + TEXT_FIELDS[collection]:
+        if name == column:
+            return kind
+    if column in EXTRA_COLUMNS:
+        return EXTRA_COLUMNS[column]
+    for prefix, kind in DYNAMIC_PREFIXES.items():
+        if column.startswith(prefix):
+            return kind
+    return "string"
+
+
+def schema_for(collection: str, rows: Sequence[Dict[str, Any]]):
+    """Fixed columns in declaration order, then the flattened ones sorted. Types never vary by row."""
+    present: Dict[str, None] = {}
+    for row in rows:
+        present.update(dict.fromkeys(row))
+    fixed = ["id", "timestamp"] + [c for _, c, _ in FIELDS[collection] + TEXT_FIELDS[collection]] + list(EXTRA_COLUMNS)
+    columns = [c for c in fixed if c in present] + sorted(c for c in present if c not in fixed)
+    return pa.schema([(c, _arrow_type(_column_kind(collection, c))) for c in columns])
+
+
+class PartitionWriter:
+    """Writes row batches as one file per date partition; files appear atomically."""
+
+    def __init__(self, root: str, collection: str, fmt: str = "parquet") -> None:
+        self.root = os.path.join(root, collection)
+        self.collection = collection
+        self.fmt = fmt
+        self.run_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self.seq = 0
+        self.files: List[str] = []
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        by_date: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_date.setdefault(row["timestamp"].date().isoformat(), []).append(row)
+        for day, day_rows in sorted(by_date.items()):
+            table = pa.Table.from_pylist(day_rows, schema=schema_for(self.collection, day_rows))
+            directory = os.path.join(self.root, f"date={day}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.run_id}-{self.seq:05d}{FORMATS[self.fmt]}")
+            self.seq += 1
+            tmp = path + ".tmp"
+            if self.fmt == "parquet":
+                pq.write_table(table, tmp, compression="zstd")
+            else:
+                feather.write_feather(table, tmp, compression="zstd")
+            os.replace(tmp, path)
+            self.files.append(path)
+
+
+def load_watermarks(out_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_watermark(
+    out_dir: str, collection: str, timestamp: Optional[datetime.datetime], ids: Iterable[str],
+) -> None:
+    """Records the collection's watermark; a None timestamp removes it."""
+    marks = load_watermarks(out_dir)
+    if timestamp is None:
+        marks.pop(collection, None)
+    else:
+        marks[collection] = {"timestamp": timestamp.isoformat(), "ids": sorted(set(ids))}
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(marks, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _swap_in(out_dir: str, collection: str, staging: str) -> None:
+    """Replaces <out>/<collection> with the partitions a --full run wrote under `staging`."""
+    target = os.path.join(out_dir, collection)
+    old = os.path.join(out_dir, f"_old-{collection}")
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, old)
+    built = os.path.join(staging, collection)
+    if os.path.exists(built):
+        os.rename(built, target)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def export_collection(
+    collection: str,
+    out_dir: str,
+    storage: Optional[StorageBackend] = None,
+    fmt: str = "parquet",
+    batch_rows: int = 5000,
+    page_size: int = 500,
+    lag_seconds: float = 120.0,
+    include_text: bool = False,
+    full: bool = False,
+) -> Dict[str, Any]:
+    """
+    Exports documents newer than the collection's watermark, or with
+    `full` all of them into a fresh set of partitions; returns run stats.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required for exports: pip install pyarrow")
+    if collection not in TIMESTAMPED_COLLECTIONS:
+        raise ValueError(f"cannot export {collection}; choose from {', '.join(TIMESTAMPED_COLLECTIONS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}; choose from {', '.join(FORMATS)}")
+
+    storage = storage or get_storage()
+    os.makedirs(out_dir, exist_ok=True)
+    mark = {} if full else load_watermarks(out_dir).get(collection, {})
+    since = to_utc(mark.get("timestamp"))
+    seen = set(mark.get("ids", []))
+    until = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=lag_seconds)
+
+    staging = os.path.join(out_dir, f"_full-{collection}")
+    if full:
+        # left over from an interrupted --full run
+        shutil.rmtree(staging, ignore_errors=True)
+    writer = PartitionWriter(staging if full else out_dir, collection, fmt)
+    started = time.perf_counter()
+    buffer: List[Dict[str, Any]] = []
+    last_ts, last_ids = since, set(seen)
+    exported = skipped = 0
+
+    def flush() -> None:
+        nonlocal exported
+        if not buffer:
+            return
+        writer.write(buffer)
+        exported += len(buffer)
+        buffer.clear()
+        if not full:
+            save_watermark(out_dir, collection, last_ts, last_ids)
+
+    for doc in storage.iter_by_timestamp(collection, since=since, until=until, page_size=page_size):
+        ts = to_utc(doc.get("timestamp"))
+        if ts is None:
+            skipped += 1
+            continue
+        if since is not None and ts == since and doc["id"] in seen:
+            continue
+        buffer.append(flatten(collection, doc, include_text))
+        if ts != last_ts:
+            last_ts, last_ids = ts, set()
+        last_ids.add(doc["id"])
+        if len(buffer) >= batch_rows:
+            flush()
+    flush()
+    if full:
+        _swap_in(out_dir, collection, staging)
+        save_watermark(out_dir, collection, last_ts, last_ids)
+
+    stats = {
+        "collection": collection,
+        "exported": exported,
+        "skipped_no_timestamp": skipped,
+        "files": len(writer.files),
+        "watermark": last_ts.isoformat() if last_ts else None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    log.info("Exported %s", stats)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CareFlow columnar export (Parquet / Arrow)")
+    parser.add_argument("--out", default="exports", help="output directory (holds the watermarks)")
+    parser.add_argument("--collection", action="append", choices=TIMESTAMPED_COLLECTIONS,
+                        help="repeatable; default: all")
+    parser.add_argument("--format", dest="fmt", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--batch-rows", type=int, default=5000, help="rows buffered per flush")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--lag-seconds", type=float, default=120.0,
+                        help="leave documents newer than this for the next run")
+    parser.add_argument("--include-text", action="store_true", help="also export free text and contact fields")
+    parser.add_argument("--full", action="store_true", help="re-export everything, replacing the collection's partitions")
+    args = parser.parse_args(argv)
+
+    for collection in args.collection or TIMESTAMPED_COLLECTIONS:
+        stats = export_collection(
+            collection, args.out, fmt=args.fmt, batch_rows=args.batch_rows,
+            page_size=args.page_size, lag_seconds=args.lag_seconds,
+            include_text=args.include_text, full=args.full,
+        )
+        print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from itertools import islice
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from . import dashboard
+from .firebase_client import (
+    _init_firebase, indexed_doc_ids, is_active_for_phone, patient_cache, phone_index, remember_followup,
+)
+from .log import get_logger
+from .metrics import STORAGE_SECONDS, record_state
+from .models import FollowupPatient
+from .tracing import span
+from .storage import (
+    SERVER_TIMESTAMP, actions_for_patients_queries, active_followup_by_phone_query, active_followups_query,
+    firestore_doc, get_storage, group_actions, patient_actions_query, stage_alert, stage_followup_write,
+    to_firestore,
+)
+
+if TYPE_CHECKING:
+    from firebase_admin import firestore_async
+
+_async_client: Optional[firestore_async.AsyncClient] = None
+
+log = get_logger(__name__)
+
+
+def get_async_firestore() -> firestore_async.AsyncClient:
+    """
+    Returns the shared Firestore AsyncClient.
+
+    Use this from `async def` code paths (the FastAPI webhook and
+    CareFlowAgent handlers) so Firestore round-trips never block the event loop.
+    """
+    global _async_client
+    if _async_client is None:
+        from firebase_admin import firestore_async
+
+        _init_firebase()
+        _async_client = firestore_async.client()
+    return _async_client
+
+
+def _local() -> bool:
+    """True when a non-Firestore backend (e.g. SQLite) is configured."""
+    return get_storage().name != "firestore"
+
+
+async def _offload(fn, *args, **kwargs):
+    # Local backends are synchronous; keep them off the event loop too.
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def _timed(op: str):
+    """Times one AsyncClient round-trip (careflow_storage_op_seconds + a trace span)."""
+    with STORAGE_SECONDS.time(backend="firestore_async", op=op), span(f"storage.{op}"):
+        yield
+
+
+async def get_patient_by_id(patient_id: str) -> Optional[Dict[str, Any]]:
+    cached = patient_cache.get("patients", patient_id)
+    if cached is not None:
+        return cached
+
+    if _local():
+        data = await _offload(get_storage().get_patient, patient_id)
+    else:
+        with _timed("get_patient"):
+            data = firestore_doc(await get_async_firestore().collection("patients").document(patient_id).get())
+
+    if data is None:
+        return None
+    patient_cache.put("patients", patient_id, data)
+    return data
+
+
+async def update_patient(patient_id: str, update: Dict[str, Any]) -> None:
+    if _local():
+        await _offload(get_storage().update_patient, patient_id, update, merge=True)
+    else:
+        with _timed("update_patient"):
+            await get_async_firestore().collection("patients").document(patient_id).set(
+                to_firestore(update), merge=True,
+            )
+    patient_cache.invalidate("patients", patient_id)
+
+
+async def get_patient_actions(patient_id: str) -> List[Dict[str, Any]]:
+    """
+    Fetches all treatment actions for a specific patient, sorted by time.
+    """
+    if _local():
+        return await _offload(get_storage().get_patient_actions, patient_id)
+
+    query = patient_actions_query(get_async_firestore(), patient_id)
+    with _timed("get_patient_actions"):
+        return [doc.to_dict() async for doc in query.stream()]
+
+
+async def get_actions_for_patients(patient_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Async counterpart of firebase_client.get_actions_for_patients().
+    The `in` queries for each chunk of ids run concurrently.
+    """
+    if _local():
+        return await _offload(get_storage().get_actions_for_patients, patient_ids)
+
+    ids = list(dict.fromkeys(patient_ids))
+
+    async def _fetch(query) -> List[Dict[str, Any]]:
+        with _timed("get_actions_for_patients"):
+            return [doc.to_dict() or {} async for doc in query.stream()]
+
+    pages = await asyncio.gather(*(_fetch(q) for q in actions_for_patients_queries(get_async_firestore(), ids)))
+    return group_actions((a for page in pages for a in page), ids)
+
+
+async def iter_active_followup_patients(
+    page_size: int = 200,
+    select: Optional[List[str]] = None,
+    factory: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+) -> AsyncIterator[Any]:
+    """
+    Async counterpart of firebase_client.iter_active_followup_patients().
+    With `factory` (e.g. FollowupPatient.from_dict) yields factory(doc_id, data).
+    """
+    if _local():
+        it = get_storage().iter_active_followups(page_size=page_size, select=select, factory=factory)
+        while True:
+            batch = await _offload(lambda: list(islice(it, page_size)))
+            for patient in batch:
+                yield patient
+            if len(batch) < page_size:
+                return
+
+    query = active_followups_query(get_async_firestore(), select)
+    last_doc = None
+    while True:
+        page = query.limit(page_size)
+        if last_doc is not None:
+            page = page.start_after(last_doc)
+
+        with _timed("iter_active_followups"):
+            docs = [doc async for doc in page.stream()]
+        for doc in docs:
+            if factory is not None:
+                yield factory(doc.id, doc.to_dict() or {})
+            else:
+                yield {**(doc.to_dict() or {}), "id": doc.id}
+
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+async def get_active_followup_patients() -> List[FollowupPatient]:
+    """
+    Returns all patients currently in the follow-up program.
+    """
+    return [p async for p in iter_active_followup_patients(
+        select=list(FollowupPatient.DOCUMENT_FIELDS), factory=FollowupPatient.from_dict,
+    )]
+
+
+async def get_followup(doc_id: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    if not fresh:
+        cached = patient_cache.get("followup_patients", doc_id)
+        if cached is not None:
+            return cached
+
+    if _local():
+        data = await _offload(get_storage().get_followup, doc_id)
+    else:
+        with _timed("get_followup"):
+            doc = await get_async_firestore().collection("followup_patients").document(doc_id).get()
+        data = firestore_doc(doc, "doc_id")
+
+    if data is None:
+        patient_cache.invalidate("followup_patients", doc_id)
+        return None
+    patient_cache.put("followup_patients", doc_id, data)
+    return data
+
+
+async def get_active_followup_by_phone(phone: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the active followup_patient whose stored phone matches `phone` exactly.
+    """
+    if _local():
+        data = await _offload(get_storage().find_active_followup_by_phone, phone)
+    else:
+        query = active_followup_by_phone_query(get_async_firestore(), phone)
+        with _timed("find_active_followup_by_phone"):
+            docs = [doc async for doc in query.stream()]
+        data = firestore_doc(docs[0], "doc_id") if docs else None
+
+    if data is not None:
+        remember_followup(data)
+    return data
+
+
+async def get_indexed_followup(phones: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """
+    The active followup_patient for any of `phones` known to the phone
+    index: one point read by id instead of a query per phone format. The
+    read is fresh because the caller acts on conversationState.
+    """
+    for phone, doc_id in indexed_doc_ids(phones):
+        data = await get_followup(doc_id, fresh=True)
+        if is_active_for_phone(data, phone):
+            return data
+        phone_index.invalidate("phones", phone)
+    return None
+
+
+async def _write_followup(doc_id: str, data: Dict[str, Any], replace: bool) -> None:
+    """
+    The followup write and its dashboard counter Increments in one
+    transaction that reads only that document (see dashboard.py).
+    """
+    from google.cloud.firestore import async_transactional
+
+    client = get_async_firestore()
+    ref = client.collection("followup_patients").document(doc_id)
+
+    @async_transactional
+    async def write(transaction) -> None:
+        snapshot = await ref.get(transaction=transaction)
+        before = snapshot.to_dict() if snapshot.exists else None
+        stage_followup_write(client, transaction, ref, before, data, replace)
+
+    await write(client.transaction())
+
+
+async def set_followup(doc_id: str, data: Dict[str, Any]) -> None:
+    """Creates or replaces a document in the followup_patients collection."""
+    if _local():
+        await _offload(get_storage().set_followup, doc_id, data)
+    else:
+        with _timed("set_followup"):
+            await _write_followup(doc_id, data, replace=True)
+    patient_cache.invalidate("followup_patients", doc_id)
+    record_state(data)
+
+
+async def update_followup(doc_id: str, data: Dict[str, Any]) -> None:
+    """Updates a document in the followup_patients collection."""
+    if _local():
+        await _offload(get_storage().update_followup, doc_id, data)
+    elif dashboard.touches(data):
+        with _timed("update_followup"):
+            await _write_followup(doc_id, data, replace=False)
+    else:
+        with _timed("update_followup"):
+            await get_async_firestore().collection("followup_patients").document(doc_id).update(to_firestore(data))
+    patient_cache.invalidate("followup_patients", doc_id)
+    record_state(data)
+
+
+async def save_checkin(doc_id: str, data: Dict[str, Any]) -> str:
+    """Saves a full checkin response record. Returns the new record id."""
+    if _local():
+        return await _offload(get_storage().add_checkin, data)
+    with _timed("add_checkin"):
+        _, ref = await get_async_firestore().collection("checkin_responses").add(to_firestore(data))
+    return ref.id
+
+
+async def save_alert(data: Dict[str, Any]) -> None:
+    """Saves a critical/moderate/no_response alert record."""
+    if _local():
+        await _offload(get_storage().add_alert, data)
+    else:
+        client = get_async_firestore()
+        batch = client.batch()
+        stage_alert(client, batch, data)
+        with _timed("add_alert"):
+            await batch.commit()
+
+
+async def save_checkin_response(phone: str, data: Dict[str, Any]) -> None:
+    """
+    Saves a patient's WhatsApp reply analysis to the responses collection.
+    """
+    record = {
+        **data,
+        "phone": phone,
+        "timestamp": SERVER_TIMESTAMP
+    }
+    if _local():
+        await _offload(get_storage().add_patient_response, record)
+    else:
+        with _timed("add_patient_response"):
+            await get_async_firestore().collection("patient_responses").add(to_firestore(record))
+
+
+async def flag_alert(doc_id: str, status: str, reason: str) -> None:
+    """
+    Flags a patient record if an alert is triggered.
+    """
+    update = {
+        "lastStatus": status,
+        "alertReason": reason,
+        "alertFlagged": True,
+        "updatedAt": SERVER_TIMESTAMP
+    }
+    if _local():
+        await _offload(get_storage().update_patient, doc_id, update, merge=False)
+    else:
+        with _timed("update_patient"):
+            await get_async_firestore().collection("patients").document(doc_id).update(to_firestore(update))
+    patient_cache.invalidate("patients", doc_id)
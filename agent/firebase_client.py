@@ -1,14 +1,152 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+from .log import debug_dumps_enabled, get_logger
+from .metrics import record_state
+from .models import FollowupPatient
+from .storage import SERVER_TIMESTAMP, FirestoreStorage, StorageBackend, get_storage
+
+if TYPE_CHECKING:
+    from firebase_admin import firestore
+
+log = get_logger(__name__)
 
 _firestore_client: Optional[firestore.Client] = None
 
 
+class PatientCache:
+    """
+    Bounded LRU cache with a TTL for `patients` / `followup_patients` docs.
+
+    Keys are (collection, doc_id). Writes made through this module invalidate
+    the matching entry, so a reader in the same process never sees its own
+    stale write. Other workers may still hold an entry for up to `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        key = (collection, doc_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, collection: str, doc_id: str, value: Dict[str, Any]) -> None:
+        if self.maxsize <= 0:
+            return
+        key = (collection, doc_id)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, dict(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, collection: str, doc_id: str) -> None:
+        with self._lock:
+            self._data.pop((collection, doc_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+patient_cache = PatientCache(
+    maxsize=int(os.getenv("PATIENT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PATIENT_CACHE_TTL_SECONDS", "30")),
+)
+
+
+# patientPhone -> followup doc_id. The mapping rarely changes, so it lives
+# longer than the documents; a hit is always re-checked against the
+# (cached or freshly read) document before it is trusted.
+phone_index = PatientCache(
+    maxsize=int(os.getenv("PHONE_INDEX_SIZE", "4096")),
+    ttl=float(os.getenv("PHONE_INDEX_TTL_SECONDS", "3600")),
+)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Hit/miss/eviction counters for the patient document cache."""
+    return patient_cache.stats()
+
+
+def remember_phone(data: Dict[str, Any]) -> None:
+    """Indexes an active followup doc by its stored patientPhone."""
+    phone, doc_id = data.get("patientPhone"), data.get("doc_id")
+    if phone and doc_id:
+        phone_index.put("phones", str(phone), {"doc_id": doc_id})
+
+
+def remember_followup(data: Dict[str, Any]) -> None:
+    """Caches an active followup doc found by phone, and indexes its phone."""
+    patient_cache.put("followup_patients", data["doc_id"], data)
+    remember_phone(data)
+
+
+def indexed_doc_ids(phones: Iterable[str]) -> List[Tuple[str, str]]:
+    """(phone, doc_id) for each phone format present in the phone index."""
+    hits = []
+    for phone in phones:
+        entry = phone_index.get("phones", phone)
+        if entry is not None:
+            hits.append((phone, entry["doc_id"]))
+    return hits
+
+
+def is_active_for_phone(data: Optional[Dict[str, Any]], phone: str) -> bool:
+    return bool(data) and data.get("status") == "active" and data.get("patientPhone") == phone
+
+
+def prime_caches(limit: Optional[int] = None) -> int:
+    """
+    Fills the phone index from active followup patients (startup warm-up),
+    reading only patientPhone and status: a full document per patient is
+    what the patient cache loads on demand. Returns the number indexed.
+    """
+    limit = phone_index.maxsize if limit is None else limit
+    count = 0
+    for data in get_storage().iter_active_followups(select=("patientPhone", "status")):
+        if count >= limit:
+            break
+        data["doc_id"] = data.pop("id")
+        remember_phone(data)
+        count += 1
+    return count
+
+
 def _init_firebase() -> firestore.Client:
     """
     Initialize Firebase Admin SDK and return a Firestore client.
@@ -18,6 +156,11 @@ def _init_firebase() -> firestore.Client:
     - FIREBASE_SERVICE_ACCOUNT_JSON containing raw JSON, or
     - FIREBASE_SERVICE_ACCOUNT_PATH pointing to the JSON file.
     """
+    # Imported here: the SDK (and grpc) take ~1s to load and are not
+    # needed at all with CAREFLOW_STORAGE=sqlite.
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
     if not firebase_admin._apps:  # type: ignore[attr-defined]
         service_account_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS") or os.getenv(
             "FIREBASE_SERVICE_ACCOUNT_PATH",
@@ -47,57 +190,104 @@ def get_firestore() -> firestore.Client:
     return _firestore_client
 
 
-def get_patient_by_id(db: firestore.Client, patient_id: str) -> Optional[Dict[str, Any]]:
-    doc = db.collection("patients").document(patient_id).get()
-    if not doc.exists:
+def _backend(db: Optional[firestore.Client]) -> StorageBackend:
+    """Uses the given Firestore client if passed, else the configured backend."""
+    if db is not None:
+        return FirestoreStorage(db)
+    return get_storage()
+
+
+def __getattr__(name: str) -> Any:
+    # `from .firebase_client import db` keeps working, but the Firestore
+    # client is only created when something actually asks for it.
+    if name == "db":
+        return get_firestore()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_patient_by_id(db: Optional[firestore.Client], patient_id: str) -> Optional[Dict[str, Any]]:
+    cached = patient_cache.get("patients", patient_id)
+    if cached is not None:
+        return cached
+
+    data = _backend(db).get_patient(patient_id)
+    if data is None:
         return None
-    data = doc.to_dict() or {}
-    data["id"] = doc.id
+    patient_cache.put("patients", patient_id, data)
     return data
 
 
-def update_patient(db: firestore.Client, patient_id: str, update: Dict[str, Any]) -> None:
-    db.collection("patients").document(patient_id).set(update, merge=True)
+def update_patient(db: Optional[firestore.Client], patient_id: str, update: Dict[str, Any]) -> None:
+    _backend(db).update_patient(patient_id, update, merge=True)
+    patient_cache.invalidate("patients", patient_id)
 
-def get_patient_actions(db: firestore.Client, patient_id: str) -> List[Dict[str, Any]]:
+def get_patient_actions(db: Optional[firestore.Client], patient_id: str) -> List[Dict[str, Any]]:
     """
     Fetches all treatment actions for a specific patient, sorted by time.
     """
-    query = db.collection("actions")\
-              .where("patientId", "==", patient_id)\
-              .order_by("createdAt", direction=firestore.Query.ASCENDING)\
-              .stream()
-    return [doc.to_dict() for doc in query]
+    return _backend(db).get_patient_actions(patient_id)
+
+
+def get_actions_for_patients(
+    db: Optional[firestore.Client],
+    patient_ids: Sequence[str],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Fetches treatment actions for many patients at once using batched `in`
+    queries. Returns {patient_id: [actions sorted by createdAt]}.
+    """
+    return _backend(db).get_actions_for_patients(patient_ids)
 
 
-def get_patients_needing_checkin(db: firestore.Client) -> List[Dict[str, Any]]:
+def get_patients_needing_checkin(db: Optional[firestore.Client] = None) -> List[Dict[str, Any]]:
     """
     Returns all active inpatients.
     """
-    query = db.collection("patients").where("status", "==", "admitted")
-    return [
-        {**(doc.to_dict() or {}), "id": doc.id}
-        for doc in query.stream()
-    ]
+    return _backend(db).get_admitted_patients()
 
-def get_active_followup_patients(db: firestore.Client) -> List[Dict[str, Any]]:
+def get_active_followup_patients(db: Optional[firestore.Client] = None) -> List[FollowupPatient]:
     """
     Returns all patients currently in the follow-up program.
+    Prefer iter_followup_records() for bulk jobs.
     """
-    query = db.collection("followup_patients")\
-              .where("status", "==", "active")\
-              .stream()
-    return [{**doc.to_dict(), "id": doc.id} for doc in query]
+    return list(iter_followup_records(db))
 
-def update_followup_patient(p_doc_id: str, data: Dict[str, Any]) -> None:
+
+def iter_active_followup_patients(
+    db: Optional[firestore.Client] = None,
+    page_size: int = 200,
+    select: Optional[Sequence[str]] = None,
+) -> Iterator[Dict[str, Any]]:
     """
-    Updates a document in the followup_patients collection.
+    Streams active follow-up patients page by page using a document cursor.
+
+    Only one page is held in memory at a time. Pass `select` to fetch just
+    the listed fields instead of whole documents (e.g. skip `parameters`
+    and `lastSubjective` when only contact details are needed).
     """
-    db.collection("followup_patients").document(p_doc_id).update(data)
+    return _backend(db).iter_active_followups(page_size=page_size, select=select)
+
 
+def iter_followup_records(
+    db: Optional[firestore.Client] = None,
+    page_size: int = 200,
+    fields: Sequence[str] = FollowupPatient.DOCUMENT_FIELDS,
+) -> Iterator[FollowupPatient]:
+    """
+    Like iter_active_followup_patients() but yields compact FollowupPatient
+    records fetching only `fields` (default: all a record holds).
+    """
+    return _backend(db).iter_active_followups(
+        page_size=page_size, select=fields, factory=FollowupPatient.from_dict,
+    )
 
-# Module-level db client (must be before helper functions that reference db)
-db = get_firestore()
+def update_followup_patient(p_doc_id: str, data: Dict[str, Any]) -> None:
+    """
+    Updates a document in the followup_patients collection.
+    """
+    get_storage().update_followup(p_doc_id, data)
+    patient_cache.invalidate("followup_patients", p_doc_id)
+    record_state(data)
 
 
 def get_patient_by_phone(phone: str):
@@ -115,52 +305,92 @@ def get_patient_by_phone(phone: str):
         normalized[2:] if normalized.startswith("91") and len(normalized) == 12 else "91" + normalized
     ])
 
+    for fmt, doc_id in indexed_doc_ids(formats):
+        d = get_followup(doc_id, fresh=True)
+        if is_active_for_phone(d, fmt):
+            return d
+        phone_index.invalidate("phones", fmt)
+
+    storage = get_storage()
     for fmt in formats:
-        docs = list(
-            db.collection("followup_patients")
-            .where("patientPhone", "==", fmt)
-            .where("status", "==", "active")
-            .limit(1)
-            .stream()
-        )
-        if docs:
-            d = docs[0].to_dict()
-            d["doc_id"] = docs[0].id
-            print(f"[FOUND] Patient with phone format '{fmt}'")
+        d = storage.find_active_followup_by_phone(fmt)
+        if d:
+            remember_followup(d)
+            log.debug("Patient found with phone format '%s'", fmt)
             return d
 
-    # Debug: show all active patients' phone numbers for diagnosis
-    all_active = list(
-        db.collection("followup_patients").where("status", "==", "active").stream()
-    )
-    print(f"[NOT FOUND] No patient for phone: '{raw}'")
-    print(f"   DB has: {[d.to_dict().get('patientPhone') for d in all_active]}")
+    log.warning("No patient for phone '%s'", raw)
+    if debug_dumps_enabled():
+        # Debug: show all active patients' phone numbers for diagnosis
+        all_active = storage.iter_active_followups(select=["patientPhone"])
+        log.debug("   DB has: %s", [d.get("patientPhone") for d in all_active])
     return None
 
 
+def get_followup(doc_id: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Reads a followup_patients doc through the patient cache.
+    Pass fresh=True when the caller must observe writes from other workers
+    (e.g. the no-response timer checking conversationState).
+    """
+    if not fresh:
+        cached = patient_cache.get("followup_patients", doc_id)
+        if cached is not None:
+            return cached
+
+    data = get_storage().get_followup(doc_id)
+    if data is None:
+        patient_cache.invalidate("followup_patients", doc_id)
+        return None
+    patient_cache.put("followup_patients", doc_id, data)
+    return data
+
+
+def set_followup(doc_id: str, data: Dict[str, Any]) -> None:
+    """Creates or replaces a document in the followup_patients collection."""
+    get_storage().set_followup(doc_id, data)
+    patient_cache.invalidate("followup_patients", doc_id)
+    record_state(data)
+
+
 def update_followup(doc_id: str, data: dict) -> None:
     """Updates a document in the followup_patients collection."""
-    db.collection("followup_patients").document(doc_id).update(data)
+    get_storage().update_followup(doc_id, data)
+    patient_cache.invalidate("followup_patients", doc_id)
+    record_state(data)
 
 
-def save_checkin(doc_id: str, data: dict) -> None:
-    """Saves a full checkin response record."""
-    db.collection("checkin_responses").add(data)
+def save_checkin(doc_id: str, data: dict, checkin_id: Optional[str] = None) -> str:
+    """
+    Saves a full checkin response record. Returns the record id; with
+    `checkin_id`, saving again replaces that record.
+    """
+    return get_storage().add_checkin(data, checkin_id)
+
+
+def update_checkin(checkin_id: str, data: Dict[str, Any]) -> None:
+    """Adds fields to an existing checkin response record (e.g. its timings)."""
+    get_storage().update_checkin(checkin_id, data)
 
 
 def save_alert(data: dict) -> None:
     """Saves a critical/moderate/no_response alert record."""
-    db.collection("critical_alerts").add(data)
+    get_storage().add_alert(data)
+
+
+def resolve_alert(alert_id: str) -> bool:
+    """Marks a critical_alerts record resolved; False if missing or already resolved."""
+    return get_storage().resolve_alert(alert_id)
 
 
 def save_checkin_response(phone: str, data: Dict[str, Any]) -> None:
     """
     Saves a patient's WhatsApp reply analysis to the responses collection.
     """
-    db.collection("patient_responses").add({
+    get_storage().add_patient_response({
         **data,
         "phone": phone,
-        "timestamp": firestore.SERVER_TIMESTAMP
+        "timestamp": SERVER_TIMESTAMP
     })
 
 def flag_alert(doc_id: str, status: str, reason: str) -> None:
@@ -168,10 +398,10 @@ def flag_alert(doc_id: str, status: str, reason: str) -> None:
     Flags a patient record in the warmup_patients collection if an alert is triggered.
     """
     # Assuming 'patients' is the main collection based on existing code
-    db.collection("patients").document(doc_id).update({
+    get_storage().update_patient(doc_id, {
         "lastStatus": status,
         "alertReason": reason,
         "alertFlagged": True,
-        "updatedAt": firestore.SERVER_TIMESTAMP
-    })
-
+        "updatedAt": SERVER_TIMESTAMP
+    }, merge=False)
+    patient_cache.invalidate("patients", doc_id)
@@ -3,17 +3,21 @@
 
 import time
 import threading
-import requests
 import smtplib
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from dotenv import load_dotenv
-load_dotenv()
+from .log import get_logger, log_context
+from .metrics import ACTIVE_TIMERS, timed_send
+from .models import FollowupPatient
+from .storage import SERVER_TIMESTAMP
+
+log = get_logger(__name__)
 
 # ── these imports happen at call time to avoid circular imports
 INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
 TOKEN    = os.getenv("ULTRAMSG_TOKEN")
+API_URL  = os.getenv("ULTRAMSG_API_URL", "https://api.ultramsg.com").rstrip("/")
 GMAIL    = os.getenv("GMAIL_ADDRESS")
 APP_PASS = os.getenv("GMAIL_APP_PASSWORD")
 DOC_PHONE = os.getenv("DOCTOR_PHONE")
@@ -22,20 +26,25 @@ DOC_PHONE = os.getenv("DOCTOR_PHONE")
 # CORE WHATSAPP SENDER
 # ─────────────────────────────────────────────
 def _send_wa(phone: str, msg: str):
+    from .whatsapp import TIMEOUT as WA_TIMEOUT, accepted, http_session
+
     try:
-        url = f"https://api.ultramsg.com/{INSTANCE}/messages/chat"
-        r = requests.post(url,
-                          json={"token": TOKEN, "to": phone, "body": msg},
-                          timeout=10)
-        print(f"📲 WA sent to {phone}: {r.status_code}")
+        url = f"{API_URL}/{INSTANCE}/messages/chat"
+        with timed_send("whatsapp", "timer") as sent:
+            r = http_session().post(url,
+                              json={"token": TOKEN, "to": phone, "body": msg},
+                              timeout=WA_TIMEOUT)
+            if not accepted(r):
+                sent.failed()
+        log.info("WA sent to %s: %s", phone, r.status_code)
     except Exception as e:
-        print(f"❌ WA send failed: {e}")
+        log.error("WA send failed: %s", e)
 
 
 # ─────────────────────────────────────────────
 # EMERGENCY EMAIL
 # ─────────────────────────────────────────────
-def _send_emergency_email(patient: dict):
+def _send_emergency_email(patient: FollowupPatient):
     ec = patient.get("emergencyContact", {})
     ec_email = ec.get("email", "")
     if not ec_email:
@@ -70,18 +79,18 @@ def _send_emergency_email(patient: dict):
         msg["From"]    = f"CareFlow <{GMAIL}>"
         msg["To"]      = ec_email
         msg.attach(MIMEText(body, "html"))
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as s:
+        with timed_send("email", "emergency"), smtplib.SMTP_SSL("smtp.gmail.com", 465) as s:
             s.login(GMAIL, APP_PASS)
             s.sendmail(GMAIL, ec_email, msg.as_string())
-        print(f"📧 Emergency email sent to {ec_email}")
+        log.info("Emergency email sent to %s", ec_email)
     except Exception as e:
-        print(f"❌ Emergency email failed: {e}")
+        log.error("Emergency email failed: %s", e)
 
 
 # ─────────────────────────────────────────────
 # BUILD Q1 MESSAGE
 # ─────────────────────────────────────────────
-def _build_q1(patient: dict) -> str:
+def _build_q1(patient: FollowupPatient) -> str:
     return (
         f"🏥 *CareFlow — Day 1 Recovery Check-in*\n\n"
         f"Hello *{patient['patientName']}* 👋\n\n"
@@ -98,9 +107,8 @@ def _build_q1(patient: dict) -> str:
 # ─────────────────────────────────────────────
 # NO-RESPONSE EMERGENCY TRIGGER
 # ─────────────────────────────────────────────
-def _trigger_emergency(patient: dict, doc_id: str):
-    from .firebase_client import db
-    from firebase_admin import firestore as fs
+def _trigger_emergency(patient: FollowupPatient, doc_id: str):
+    from .firebase_client import save_alert, update_followup
 
     name = patient["patientName"]
     ec   = patient.get("emergencyContact", {})
@@ -108,7 +116,7 @@ def _trigger_emergency(patient: dict, doc_id: str):
     ec_name  = ec.get("name", "Emergency Contact")
     ec_rel   = ec.get("relation", "Contact")
 
-    print(f"🚨 Triggering emergency for {name}")
+    log.warning("Triggering emergency for %s", name)
 
     # 1 — Message to patient
     _send_wa(patient["patientPhone"],
@@ -148,7 +156,7 @@ def _trigger_emergency(patient: dict, doc_id: str):
 
     # 5 — Save to Firestore
     try:
-        db.collection("critical_alerts").add({
+        save_alert({
             "patientDocId":  doc_id,
             "patientName":   name,
             "patientPhone":  patient["patientPhone"],
@@ -159,16 +167,16 @@ def _trigger_emergency(patient: dict, doc_id: str):
             "reason":        f"{name} did not respond to Day 1 check-in",
             "resolved":      False,
             "notifiedVia":   ["whatsapp", "email"],
-            "timestamp":     fs.SERVER_TIMESTAMP
+            "timestamp":     SERVER_TIMESTAMP
         })
 
-        db.collection("followup_patients").document(doc_id).update({
+        update_followup(doc_id, {
             "conversationState":     "no_response_emergency_sent",
-            "lastNoResponseAlert":   fs.SERVER_TIMESTAMP
+            "lastNoResponseAlert":   SERVER_TIMESTAMP
         })
-        print(f"✅ Emergency saved to Firestore for {name}")
+        log.info("Emergency saved to Firestore for %s", name)
     except Exception as e:
-        print(f"❌ Firestore emergency save failed: {e}")
+        log.error("Firestore emergency save failed: %s", e)
 
 
 # ─────────────────────────────────────────────
@@ -180,80 +188,72 @@ def schedule_first_questions(patient: dict, doc_id: str):
     Runs entirely in a background thread.
     Thread is daemon=False so it NEVER gets killed silently.
     """
+    # The thread lives ~45s: keep the few fields it needs, not the
+    # whole enrollment document with its parameters
+    patient = FollowupPatient.from_dict(doc_id, patient)
 
     def _run():
-        from .firebase_client import db
-        from firebase_admin import firestore as fs
+        from .firebase_client import get_followup, update_followup
         # from question_generator import generate_todays_questions
 
         name = patient.get("patientName", "Patient")
         phone = patient.get("patientPhone", "")
 
         # ── STEP 1: Wait 25 seconds ──────────────────────
-        print(f"⏳ [{name}] Waiting 25s before sending Q1...")
-        for i in range(25):
-            time.sleep(1)
-            if i % 5 == 0:
-                print(f"   [{name}] {25 - i}s remaining...")
+        log.info("[%s] Waiting 25s before sending Q1...", name)
+        time.sleep(25)
 
         # ── Verify patient still active ──────────────────
         try:
-            snap = db.collection("followup_patients")\
-                     .document(doc_id).get()
-            if not snap.exists:
-                print(f"❌ [{name}] Doc not found — aborting timer")
+            current = get_followup(doc_id)
+            if current is None:
+                log.error("[%s] Doc not found — aborting timer", name)
                 return
-            current = snap.to_dict()
             if current.get("status") != "active":
-                print(f"⚠️ [{name}] Status={current.get('status')} "
-                      f"— skipping questions")
+                log.warning("[%s] Status=%s — skipping questions", name, current.get("status"))
                 return
         except Exception as e:
-            print(f"❌ [{name}] Firebase read error: {e}")
+            log.error("[%s] Firebase read error: %s", name, e)
             return
 
         # ── STEP 2: Send Q1 ──────────────────────────────
-        print(f"📤 [{name}] 25s complete — sending Q1")
+        log.info("[%s] 25s complete — sending Q1", name)
         q1_msg = _build_q1(patient)
         _send_wa(phone, q1_msg)
 
         # Update Firestore state to awaiting_q1
         try:
-            db.collection("followup_patients").document(doc_id).update({
+            update_followup(doc_id, {
                 "conversationState": "awaiting_q1",
-                "q1SentAt":          fs.SERVER_TIMESTAMP,
+                "q1SentAt":          SERVER_TIMESTAMP,
                 "currentDay":        1
             })
-            print(f"✅ [{name}] Firestore state → awaiting_q1")
+            log.debug("[%s] Firestore state → awaiting_q1", name)
         except Exception as e:
-            print(f"❌ [{name}] Firestore update failed: {e}")
+            log.error("[%s] Firestore update failed: %s", name, e)
             return
 
         # ── STEP 3: Wait 15 seconds for response ─────────
-        print(f"[WAIT] [{name}] Waiting 15s for patient response...")
-        for i in range(15):
-            time.sleep(1)
-            if i % 5 == 0:
-                print(f"   [{name}] {15 - i}s remaining...")
+        log.debug("[%s] Waiting 15s for patient response...", name)
+        time.sleep(15)
 
         # Extra 3s buffer — gives Firestore write from webhook
         # time to fully propagate before we check the state.
         # Without this, a race condition fires emergency even
         # when the patient DID reply (webhook hadn't finished writing).
-        print(f"   [{name}] +3s buffer for Firestore write propagation...")
         time.sleep(3)
 
         # ── STEP 4: Check if patient responded ───────────
         try:
-            snap2 = db.collection("followup_patients")\
-                      .document(doc_id).get()
-            if not snap2.exists:
+            # Always read through to Firestore — the reply may have been
+            # handled by another worker whose write we never saw.
+            updated = get_followup(doc_id, fresh=True)
+            if updated is None:
                 return
 
-            updated = snap2.to_dict()
             state   = updated.get("conversationState", "")
 
-            print(f"   [{name}] State after 18s total: '{state}'")
+            log.debug("[%s] State after 18s total: '%s'", name, state)
 
             # These states mean the patient replied — do NOT alert
             safe_states = {
@@ -267,22 +267,29 @@ def schedule_first_questions(patient: dict, doc_id: str):
             }
 
             if state in safe_states:
-                print(f"[OK] [{name}] Patient responded (state='{state}') "
-                      f"— no emergency needed")
+                log.info("[%s] Patient responded (state='%s') — no emergency needed", name, state)
             elif state == "awaiting_q1":
                 # Still waiting — patient genuinely did not respond
-                print(f"[ALERT] [{name}] No response after 18s — triggering emergency")
+                log.warning("[%s] No response after 18s — triggering emergency", name)
                 _trigger_emergency(patient, doc_id)
             else:
-                print(f"[WARN] [{name}] Unexpected state '{state}' — skipping emergency")
+                log.warning("[%s] Unexpected state '%s' — skipping emergency", name, state)
 
         except Exception as e:
-            print(f"❌ [{name}] Response check failed: {e}")
+            log.error("[%s] Response check failed: %s", name, e)
 
     # ── Start thread ─────────────────────────────────────
     # daemon=False is CRITICAL — keeps thread alive
-    t = threading.Thread(target=_run, name=f"timer_{doc_id}",
+    def _run_with_context():
+        ACTIVE_TIMERS.inc()
+        try:
+            with log_context(patient_id=doc_id, request_id=f"timer-{doc_id}"):
+                _run()
+        finally:
+            ACTIVE_TIMERS.dec()
+
+    t = threading.Thread(target=_run_with_context, name=f"timer_{doc_id}",
                          daemon=False)
     t.start()
-    print(f"🚀 Timer thread started for {patient.get('patientName', 'Patient')} "
-          f"(thread id: {t.ident})")
+    log.info("Timer thread started for %s (thread id: %s)",
+             patient.get("patientName", "Patient"), t.ident)
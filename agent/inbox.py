@@ -0,0 +1,518 @@
+# agent/inbox.py
+# Durable local inbox + async worker pool for incoming webhook events.
+# The webhook only validates the payload, appends it here and returns;
+# workers run the slow part (Firestore, LLM, SMTP, WhatsApp) so UltraMsg
+# gets its 200 within milliseconds and never retries a slow delivery.
+# Events are serialized per patient (in order for one patient, parallel
+# across patients) under one overall concurrency bound.
+#
+# Several processes may share one inbox file (uvicorn --workers, a
+# rolling restart). Every event row carries the process that owns it, and
+# every process holds a lease it renews while it is alive. A process only
+# handles rows it owns and takes over another's rows only once that lease
+# has expired (it crashed or stopped), so a live worker's events never run
+# twice. Ownership also goes by ordering key: while a patient has
+# unfinished events, new ones are routed to the process that owns them,
+# so per-patient order holds across processes too.
+#
+#   INBOX_LEASE_SECONDS=30       how long a silent owner keeps its events
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .log import get_logger, log_context
+from .metrics import INBOX_EVENT_SECONDS, INBOX_LAG_SECONDS
+from .tracing import start_trace
+
+log = get_logger(__name__)
+
+_INBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbox_events (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    received_at  REAL NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    error        TEXT,
+    payload      TEXT NOT NULL,
+    owner        TEXT,
+    key          TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_inbox_status_id ON inbox_events (status, id);
+
+CREATE TABLE IF NOT EXISTS inbox_owners (
+    owner        TEXT PRIMARY KEY,
+    lease_until  REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inbox_seen (
+    dedup_key  TEXT PRIMARY KEY,
+    seen_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inbox_seen_at ON inbox_seen (seen_at);
+"""
+
+# Columns added after the first release, for inbox files created before them
+_INBOX_COLUMNS = {"owner": "TEXT", "key": "TEXT NOT NULL DEFAULT ''"}
+
+LEASE_SECONDS = float(os.getenv("INBOX_LEASE_SECONDS", "30"))
+
+InboxEvent = Tuple[int, float, Dict[str, Any]]
+
+# Rows whose owner is gone: released at shutdown, or its lease ran out
+_ORPHANED = "(owner IS NULL OR owner NOT IN (SELECT owner FROM inbox_owners WHERE lease_until >= ?))"
+
+
+class RecentKeys:
+    """
+    In-memory LRU of recently seen message keys, bounded by size and age.
+    Answers "seen it already?" in O(1) before touching disk.
+    """
+
+    def __init__(self, maxsize: int = 10000, window: float = 86400.0) -> None:
+        self.maxsize = maxsize
+        self.window = window
+        self._keys: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key: str) -> bool:
+        with self._lock:
+            seen_at = self._keys.get(key)
+            if seen_at is None:
+                return False
+            if seen_at < time.time() - self.window:
+                del self._keys[key]
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._keys[key] = time.time()
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+
+class Inbox:
+    """
+    Append-only event log on local disk.
+
+    Rows go pending → processing → deleted on success, or stay as 'failed'
+    (with the error) once `max_attempts` is exhausted. Each unfinished row
+    is owned by one Inbox instance (`owner`), and all unfinished rows of
+    one key by the same instance. An instance keeps its rows while its
+    lease in inbox_owners is current (renew()); claim_expired() hands the
+    rows of an instance whose lease ran out, e.g. left 'processing' by a
+    crash, to another one as a whole.
+    """
+
+    def __init__(
+        self,
+        path: str = "careflow_inbox.db",
+        max_attempts: int = 3,
+        dedup_window: float = 86400.0,
+        dedup_cache_size: int = 10000,
+        lease_seconds: float = LEASE_SECONDS,
+    ) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self.dedup_window = dedup_window
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.recent = RecentKeys(dedup_cache_size, dedup_window)
+        self.duplicates = 0
+        self._puts = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_INBOX_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(inbox_events)")}
+        for column, kind in _INBOX_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE inbox_events ADD COLUMN {column} {kind}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_owner ON inbox_events (owner, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_key ON inbox_events (key, status)")
+        self.renew()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(
+        self, payload: Dict[str, Any], dedup_key: Optional[str] = None, key: str = "",
+    ) -> Optional[Tuple[InboxEvent, List[InboxEvent]]]:
+        """
+        Appends the payload under ordering `key`. With a `dedup_key`,
+        returns None instead if the same key was already accepted within
+        the dedup window — the key is claimed in the same transaction as
+        the insert.
+
+        The event goes to the live instance that owns `key`'s unfinished
+        events, or to this one (taking over an expired owner's). Returns
+        the event and `key`'s pending events this instance now has to run,
+        oldest first: empty if another instance owns the key.
+        """
+        if dedup_key is not None and self.recent.seen(dedup_key):
+            self.duplicates += 1
+            return None
+
+        received_at = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if dedup_key is not None:
+                claimed = conn.execute(
+                    "INSERT INTO inbox_seen (dedup_key, seen_at) VALUES (?, ?) "
+                    "ON CONFLICT (dedup_key) DO UPDATE SET seen_at = excluded.seen_at "
+                    "WHERE inbox_seen.seen_at < ?",
+                    (dedup_key, received_at, received_at - self.dedup_window),
+                ).rowcount
+                if not claimed:
+                    self.recent.add(dedup_key)
+                    self.duplicates += 1
+                    return None
+            owner = self.owner
+            head = conn.execute(
+                "SELECT owner FROM inbox_events WHERE key = ? AND status IN ('pending', 'processing') "
+                "ORDER BY id LIMIT 1",
+                (key,),
+            ).fetchone()
+            if head is not None and head[0] != self.owner:
+                live = head[0] is not None and conn.execute(
+                    "SELECT 1 FROM inbox_owners WHERE owner = ? AND lease_until >= ?", (head[0], received_at),
+                ).fetchone()
+                if live:
+                    owner = head[0]
+                else:
+                    conn.execute(
+                        "UPDATE inbox_events SET status = 'pending', owner = ? "
+                        "WHERE key = ? AND status IN ('pending', 'processing')",
+                        (self.owner, key),
+                    )
+            cur = conn.execute(
+                "INSERT INTO inbox_events (received_at, payload, owner, key) VALUES (?, ?, ?, ?)",
+                (received_at, json.dumps(payload), owner, key),
+            )
+            due = [] if owner != self.owner else conn.execute(
+                "SELECT id, received_at, payload FROM inbox_events "
+                "WHERE key = ? AND owner = ? AND status = 'pending' ORDER BY id",
+                (key, self.owner),
+            ).fetchall()
+        if dedup_key is not None:
+            self.recent.add(dedup_key)
+
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            self.prune_seen()
+        return (cur.lastrowid, received_at, payload), [(r[0], r[1], json.loads(r[2])) for r in due]
+
+    def prune_seen(self) -> None:
+        """Drops dedup keys older than the window so the table stays bounded."""
+        self._conn().execute(
+            "DELETE FROM inbox_seen WHERE seen_at < ?", (time.time() - self.dedup_window,),
+        )
+
+    def mark_processing(self, event_id: int) -> bool:
+        """Starts an attempt; False if the event is no longer this instance's to handle."""
+        return self._conn().execute(
+            "UPDATE inbox_events SET status = 'processing', attempts = attempts + 1 "
+            "WHERE id = ? AND owner = ? AND status = 'pending'",
+            (event_id, self.owner),
+        ).rowcount == 1
+
+    def mark_done(self, event_id: int) -> None:
+        self._conn().execute("DELETE FROM inbox_events WHERE id = ? AND owner = ?", (event_id, self.owner))
+
+    def mark_failed(self, event_id: int, error: str) -> bool:
+        """Records the error. Returns True if the event should be retried."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT attempts FROM inbox_events WHERE id = ? AND owner = ?", (event_id, self.owner),
+        ).fetchone()
+        retry = row is not None and row[0] < self.max_attempts
+        conn.execute(
+            "UPDATE inbox_events SET status = ?, error = ? WHERE id = ? AND owner = ?",
+            ("pending" if retry else "failed", error[:2000], event_id, self.owner),
+        )
+        return retry
+
+    def renew(self) -> None:
+        """Extends this instance's lease on the events it owns."""
+        self._conn().execute(
+            "INSERT INTO inbox_owners (owner, lease_until) VALUES (?, ?) "
+            "ON CONFLICT (owner) DO UPDATE SET lease_until = excluded.lease_until",
+            (self.owner, time.time() + self.lease_seconds),
+        )
+
+    def claim_expired(self) -> List[InboxEvent]:
+        """
+        Takes over the unfinished events of instances whose lease has
+        expired (or that released them) and returns them with this
+        instance's own pending events, oldest first.
+        """
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, received_at, payload, owner FROM inbox_events "
+                f"WHERE (status IN ('pending', 'processing') AND {_ORPHANED}) "
+                "OR (owner = ? AND status = 'pending') ORDER BY id",
+                (now, self.owner),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE inbox_events SET status = 'pending', owner = ? WHERE id = ?",
+                [(self.owner, r[0]) for r in rows if r[3] != self.owner],
+            )
+            conn.execute("DELETE FROM inbox_owners WHERE lease_until < ?", (now,))
+        return [(r[0], r[1], json.loads(r[2])) for r in rows]
+
+    def recover(self) -> List[InboxEvent]:
+        """The unfinished events of stopped or crashed instances, claimed at startup."""
+        return self.claim_expired()
+
+    def release(self) -> None:
+        """Gives up this instance's unfinished events at shutdown, for any instance to claim now."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE inbox_events SET status = 'pending', owner = NULL "
+                "WHERE owner = ? AND status IN ('pending', 'processing')",
+                (self.owner,),
+            )
+            conn.execute("DELETE FROM inbox_owners WHERE owner = ?", (self.owner,))
+
+    def failed_count(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM inbox_events WHERE status = 'failed'",
+        ).fetchone()[0]
+
+
+class InboxWorkerPool:
+    """
+    Runs `handler(payload)` for inbox events, serialized per key and
+    bounded overall.
+
+    `key_fn(payload)` picks the ordering key (the patient's phone). A key
+    gets its own queue and drain task on its first event, dropped again as
+    soon as the queue runs empty, so one patient's messages run strictly in
+    arrival order and a slow patient never holds up anyone else. At most
+    `concurrency` handlers run at once across all keys. Failed events are
+    retried in place, before anything queued behind them for the same
+    patient.
+
+    Inbox I/O is offloaded to a thread so the event loop is never blocked
+    on disk. A heartbeat renews the inbox lease, and every `poll_interval`
+    picks up events other processes routed here and those of instances
+    whose lease expired. stats() reports queue depth and processing lag.
+    """
+
+    def __init__(
+        self,
+        inbox: Inbox,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        concurrency: int = 32,
+        key_fn: Optional[Callable[[Dict[str, Any]], str]] = None,
+        retry_delay: float = 1.0,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.inbox = inbox
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.key_fn = key_fn or (lambda payload: "")
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._queues: Dict[str, Deque[InboxEvent]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._known: Set[int] = set()
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.total_processing = 0.0
+
+    async def start(self) -> None:
+        if self._slots is not None:
+            return
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        await asyncio.to_thread(self.inbox.renew)
+        recovered = await asyncio.to_thread(self.inbox.recover)
+        for event in recovered:
+            self._enqueue(event)
+        self._heartbeat = asyncio.create_task(self._keep_leases(), name="inbox_heartbeat")
+        log.info("Inbox workers started: concurrency %d (recovered %d pending events for %d patients)",
+                 self.concurrency, len(recovered), len(self._queues))
+
+    async def stop(self) -> None:
+        # Unfinished events stay in the inbox, released for the next owner
+        tasks = [*self._tasks, *([self._heartbeat] if self._heartbeat else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(self.inbox.release)
+        self._queues.clear()
+        self._known.clear()
+        self._heartbeat = None
+        self._slots = None
+
+    async def _keep_leases(self) -> None:
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.poll_interval, self.inbox.lease_seconds / 3))
+            try:
+                if time.monotonic() - renewed >= self.inbox.lease_seconds / 3:
+                    await asyncio.to_thread(self.inbox.renew)
+                    renewed = time.monotonic()
+                for event in await asyncio.to_thread(self.inbox.claim_expired):
+                    if event[0] not in self._known:
+                        self._enqueue(event)
+            except Exception as e:
+                log.warning("Inbox lease heartbeat failed: %s", e)
+
+    async def submit(self, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> Optional[int]:
+        """
+        Persists the payload and queues it behind its key's earlier events,
+        here or in the process that owns the key. Returns the inbox event
+        id, or None if `dedup_key` marks it as a duplicate.
+        """
+        if dedup_key is not None and self.inbox.recent.seen(dedup_key):
+            self.inbox.duplicates += 1
+            return None
+        put = await asyncio.to_thread(self.inbox.put, payload, dedup_key, self.key_fn(payload) or "")
+        if put is None:
+            return None
+        event, due = put
+        for queued in due:
+            if queued[0] not in self._known:
+                self._enqueue(queued)
+        return event[0]
+
+    async def join(self) -> None:
+        """Waits until every queued event has been handled."""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def _enqueue(self, event: InboxEvent) -> None:
+        key = self.key_fn(event[2]) or ""
+        self._known.add(event[0])
+        self._idle.clear()
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(event)
+            return
+        self._queues[key] = deque([event])
+        task = asyncio.create_task(self._drain(key), name=f"inbox_event_{event[0]}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: str) -> None:
+        """Handles `key`'s events one at a time, then drops its queue."""
+        queue = self._queues[key]
+        try:
+            while queue:
+                event = queue.popleft()
+                try:
+                    await self._process(*event)
+                finally:
+                    self._known.discard(event[0])
+        finally:
+            # No await between the empty check and this: nothing can have
+            # been queued for `key` in between
+            if self._queues.get(key) is queue:
+                del self._queues[key]
+            if not self._queues:
+                self._idle.set()
+
+    async def _process(self, event_id: int, received_at: float, payload: Dict[str, Any]) -> None:
+        async with self._slots:
+            self.in_flight += 1
+            started = time.time()
+            lag = started - received_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            INBOX_LAG_SECONDS.observe(lag)
+            outcome = "cancelled"
+            try:
+                outcome = "ok" if await self._run(event_id, received_at, payload) else "failed"
+            finally:
+                elapsed = time.time() - started
+                self.total_processing += elapsed
+                INBOX_EVENT_SECONDS.observe(elapsed, outcome=outcome)
+                self.in_flight -= 1
+
+    async def _run(self, event_id: int, received_at: float, payload: Dict[str, Any]) -> bool:
+        """Handles one event, retrying in place. Returns False once it is marked failed."""
+        while True:
+            try:
+                if not await asyncio.to_thread(self.inbox.mark_processing, event_id):
+                    # Already done, or our lease lapsed and another
+                    # instance took the event over
+                    log.info("Inbox event %s is no longer ours to handle; skipped", event_id)
+                    return True
+                # Own task (and so own context) per event: ids bound by the
+                # handler never leak into the patient's next event.
+                # One trace per attempt; the wait in the inbox is recorded
+                # on the root span so per-check-in timings include it.
+                with log_context(request_id=f"evt-{event_id}"), start_trace(
+                    "inbox.event", event_id=event_id,
+                    queued_ms=(time.time() - received_at) * 1000,
+                ):
+                    await asyncio.create_task(self.handler(payload))
+                await asyncio.to_thread(self.inbox.mark_done, event_id)
+                self.processed += 1
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("Inbox event %s failed: %s: %s", event_id, type(e).__name__, e)
+                retry = await asyncio.to_thread(
+                    self.inbox.mark_failed, event_id, f"{type(e).__name__}: {e}",
+                )
+                if not retry:
+                    self.failed += 1
+                    return False
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        handled = self.processed + self.failed
+        depths = [len(queue) for queue in self._queues.values()]
+        return {
+            "concurrency": self.concurrency,
+            "active_patients": len(depths),
+            "queue_depth": sum(depths),
+            "max_patient_depth": max(depths) if depths else 0,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "duplicates": self.inbox.duplicates,
+            "lag_last_s": round(self.last_lag, 4),
+            "lag_max_s": round(self.max_lag, 4),
+            "lag_avg_s": round(self.total_lag / handled, 4) if handled else 0.0,
+            "processing_avg_s": round(self.total_processing / handled, 4) if handled else 0.0,
+        }
@@ -0,0 +1,542 @@
+# agent/loadtest.py
+# Load test for POST /webhook with synthetic UltraMsg traffic.
+#
+# Everything external is replaced by local stand-ins so a run needs no
+# credentials and never messages a real patient:
+#   - UltraMsg + Groq: one local HTTP server (ULTRAMSG_API_URL / GROQ_BASE_URL)
+#   - SMTP: smtplib.SMTP / SMTP_SSL swapped for an in-process fake
+#   - storage: CAREFLOW_STORAGE=sqlite on a temp file seeded with the cohort
+# Each stand-in sleeps for a configurable, jittered latency.
+#
+# Traffic is open-loop at --rate requests/s: Q1 answers, parameter replies,
+# redelivered duplicates and messages from unknown numbers. Reports webhook
+# ack latency, end-to-end processing latency (ack → inbox worker done),
+# throughput and error rates, and saves the result as JSON for comparison.
+#
+# Run:  python -m agent.loadtest --patients 200 --rate 50 --duration 30
+#       python -m agent.loadtest --compare loadtest_results/<previous>.json
+#       python -m agent.loadtest --url http://localhost:8000   (ack latency only)
+# Requires httpx.
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import smtplib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import synthetic
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_results")
+
+
+# ─────────────────────────────────────────────
+# STAND-INS
+# ─────────────────────────────────────────────
+class Latency:
+    def __init__(self, mean: float, jitter: float = 0.5, seed: int = 0) -> None:
+        self.mean = mean
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self) -> None:
+        if self.mean <= 0:
+            return
+        with self._lock:
+            factor = self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(self.mean * factor)
+
+
+def _fake_completion(prompt: str, rng: random.Random) -> str:
+    """Answers the agent's three prompt shapes with plausible JSON/text."""
+    if "Extract health data" in prompt:
+        names = re.findall(r"^\s*- (.+?) \((?:rate|yesno|value)\)", prompt, re.MULTILINE)
+        ratings = {}
+        for name in names:
+            kind = re.search(rf"- {re.escape(name)} \((\w+)\)", prompt).group(1)
+            ratings[name] = (rng.randint(0, 5) if kind == "rate"
+                             else rng.choice(["yes", "no"]) if kind == "yesno"
+                             else round(rng.uniform(97.0, 101.0), 1))
+        return json.dumps({"ratings": ratings, "subjective": "feeling a bit better today"})
+    if "Internal Clinical Analysis" in prompt:
+        alert = rng.random() < 0.1
+        return json.dumps({
+            "overall_status": "warning" if alert else "good",
+            "trend": rng.choice(["improving", "stable", "declining"]),
+            "alert_doctor": alert,
+            "alerted_parameters": [],
+            "doctor_summary": "Synthetic load-test summary.",
+            "patient_reply": "Thank you for checking in, keep resting well.",
+        })
+    return ("2. How would you rate your pain today from 0 to 5?\n"
+            "3. Have you had any fever since yesterday? (Yes/No)\n"
+            "4. How are you feeling overall?")
+
+
+class StandInServer:
+    """Local HTTP stand-in for the UltraMsg send API and Groq chat completions."""
+
+    def __init__(self, wa_latency: Latency, llm_latency: Latency, seed: int = 0) -> None:
+        self.wa_latency = wa_latency
+        self.llm_latency = llm_latency
+        self.counts = {"whatsapp": 0, "llm": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, reply: Optional[Dict[str, Any]]) -> None:
+                data = json.dumps(reply).encode("utf-8") if reply is not None else b""
+                self.send_response(status)
+                if data:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                # Warm-up probes: UltraMsg instance status, Groq model list
+                path = self.path.split("?", 1)[0]
+                if path.endswith("/instance/status"):
+                    self._reply(200, {"status": {"accountStatus": {"status": "authenticated"}}})
+                elif path.endswith("/models"):
+                    self._reply(200, {"object": "list", "data": [{"id": "stand-in", "object": "model"}]})
+                else:
+                    self._reply(404, None)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.endswith("/messages/chat"):
+                    stand_in.wa_latency.sleep()
+                    reply = {"sent": "true", "message": "ok", "id": stand_in._bump("whatsapp")}
+                elif self.path.endswith("/chat/completions"):
+                    stand_in.llm_latency.sleep()
+                    prompt = body.get("messages", [{}])[-1].get("content", "")
+                    with stand_in._lock:
+                        content = _fake_completion(prompt, stand_in._rng)
+                    reply = {
+                        "id": f"chatcmpl-{stand_in._bump('llm')}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stand-in"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                                  "total_tokens": (len(prompt) + len(content)) // 4},
+                    }
+                else:
+                    self._reply(404, None)
+                    return
+                self._reply(200, reply)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stand_in_http", daemon=True)
+
+    def _bump(self, key: str) -> int:
+        with self._lock:
+            self.counts[key] += 1
+            return self.counts[key]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+def install_smtp_stand_in(latency: Latency) -> Dict[str, int]:
+    """Replaces smtplib.SMTP / SMTP_SSL; returns the live send counter."""
+    sent = {"email": 0}
+    lock = threading.Lock()
+
+    class StandInSMTP:
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            latency.sleep()  # connect + TLS + login round-trips
+
+        def __enter__(self) -> "StandInSMTP":
+            return self
+
+        def __exit__(self, *exc: Any) -> None:
+            pass
+
+        def ehlo(self, *args: Any) -> None:
+            pass
+
+        def starttls(self, *args: Any, **kwargs: Any) -> None:
+            pass
+
+        def login(self, *args: Any) -> None:
+            pass
+
+        def sendmail(self, *args: Any) -> Dict[str, Any]:
+            with lock:
+                sent["email"] += 1
+            return {}
+
+        send_message = sendmail
+
+        def quit(self) -> None:
+            pass
+
+    smtplib.SMTP = StandInSMTP
+    smtplib.SMTP_SSL = StandInSMTP
+    return sent
+
+
+# ─────────────────────────────────────────────
+# TRAFFIC
+# ─────────────────────────────────────────────
+class TrafficMix:
+    """
+    Picks the next message by weight. Patients seeded as awaiting_q1 get Q1
+    answers, the rest parameter replies; once a patient's state moves on,
+    later messages exercise the late/extra-reply branches as in production.
+    """
+
+    def __init__(self, cohort: List[Tuple[str, Dict[str, Any]]], weights: Dict[str, float], seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.q1 = [p for _, p in cohort if p["conversationState"] == "awaiting_q1"]
+        self.params = [p for _, p in cohort if p["conversationState"] == "awaiting_parameters"]
+        self.weights = weights
+        self.sent: List[Dict[str, Any]] = []
+
+    def next(self) -> Tuple[str, Dict[str, Any]]:
+        kinds = [k for k in self.weights if self._available(k)]
+        kind = self.rng.choices(kinds, weights=[self.weights[k] for k in kinds])[0]
+        if kind == "duplicate":
+            return kind, self.rng.choice(self.sent)
+        if kind == "unknown":
+            phone = f"9180000{self.rng.randint(0, 99999):05d}"
+            payload = synthetic.ultramsg_payload(phone, synthetic.q1_reply(self.rng))
+        elif kind == "q1":
+            patient = self.rng.choice(self.q1)
+            payload = synthetic.ultramsg_payload(patient["patientPhone"], synthetic.q1_reply(self.rng))
+        else:
+            patient = self.rng.choice(self.params)
+            body = synthetic.parameter_reply(patient["parameters"], self.rng)
+            payload = synthetic.ultramsg_payload(patient["patientPhone"], body)
+        self.sent.append(payload)
+        return kind, payload
+
+    def _available(self, kind: str) -> bool:
+        if kind == "duplicate":
+            return bool(self.sent)
+        if kind == "q1":
+            return bool(self.q1)
+        if kind == "params":
+            return bool(self.params)
+        return True
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "p50": round(rank(0.50) * 1000, 2),
+        "p95": round(rank(0.95) * 1000, 2),
+        "p99": round(rank(0.99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+# ─────────────────────────────────────────────
+# RUN
+# ─────────────────────────────────────────────
+def _configure_environment(args: argparse.Namespace, workdir: str, stand_in_url: str) -> None:
+    os.environ.update({
+        "CAREFLOW_STORAGE": "sqlite",
+        "CAREFLOW_SQLITE_PATH": os.path.join(workdir, "careflow.db"),
+        "CAREFLOW_INBOX_PATH": os.path.join(workdir, "inbox.db"),
+        "INBOX_CONCURRENCY": str(args.inbox_concurrency),
+        "ULTRAMSG_API_URL": stand_in_url,
+        "ULTRAMSG_INSTANCE": "instance00000",
+        "ULTRAMSG_TOKEN": "loadtest",
+        "GROQ_API_KEY": "loadtest",
+        "GROQ_BASE_URL": stand_in_url,
+        "GMAIL_ADDRESS": "loadtest@example.invalid",
+        "GMAIL_APP_PASSWORD": "loadtest",
+        "DOCTOR_EMAIL": "doctor@example.invalid",
+        "LOG_LEVEL": args.log_level,
+        "TRACE_EXPORT": "none",
+    })
+
+
+async def _drive(args: argparse.Namespace, mix: TrafficMix, client) -> Dict[str, Any]:
+    sem = asyncio.Semaphore(args.concurrency)
+    sent_at: Dict[str, float] = {}
+    acks: List[float] = []
+    by_kind: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+    errors = 0
+    tasks = []
+
+    async def one(kind: str, payload: Dict[str, Any]) -> None:
+        nonlocal errors
+        async with sem:
+            started = time.perf_counter()
+            try:
+                resp = await client.post("/webhook", json=payload)
+                elapsed = time.perf_counter() - started
+                body = resp.json() if resp.status_code == 200 else {}
+                status = body.get("status", f"http_{resp.status_code}")
+                if resp.status_code != 200 or status == "error":
+                    errors += 1
+                else:
+                    acks.append(elapsed)
+                    if status == "queued":
+                        sent_at.setdefault(payload["data"]["id"], time.time() - elapsed)
+            except Exception as e:
+                errors += 1
+                status = f"exception:{type(e).__name__}"
+            statuses[status] = statuses.get(status, 0) + 1
+
+    interval = 1.0 / args.rate
+    started = time.perf_counter()
+    n = 0
+    while time.perf_counter() - started < args.duration:
+        kind, payload = mix.next()
+        by_kind[kind] = by_kind.get(kind, 0) + 1
+        tasks.append(asyncio.create_task(one(kind, payload)))
+        n += 1
+        # open loop: keep the schedule even if responses are slow
+        delay = started + n * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*tasks)
+    send_window = time.perf_counter() - started
+
+    return {
+        "requests": n,
+        "by_kind": by_kind,
+        "statuses": statuses,
+        "errors": errors,
+        "acks": acks,
+        "sent_at": sent_at,
+        "send_window": send_window,
+    }
+
+
+async def _run_inprocess(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="careflow_loadtest_")
+    stand_in = StandInServer(
+        Latency(args.wa_latency, seed=args.seed), Latency(args.llm_latency, seed=args.seed + 1), seed=args.seed,
+    )
+    stand_in.start()
+    email = install_smtp_stand_in(Latency(args.smtp_latency, seed=args.seed + 2))
+    _configure_environment(args, workdir, stand_in.url)
+
+    from agent.storage import get_storage
+    cohort = synthetic.make_cohort(args.patients, seed=args.seed, n_params=args.params)
+    storage = get_storage()
+    for doc_id, patient in cohort:
+        storage.set_followup(doc_id, patient)
+
+    from agent.main import create_app
+    app = create_app()
+    pool = app.state.inbox_pool
+
+    done_at: Dict[str, float] = {}
+    handler = pool.handler
+
+    async def timed_handler(data: Dict[str, Any]) -> Any:
+        try:
+            return await handler(data)
+        finally:
+            done_at[data.get("id", "")] = time.time()
+
+    pool.handler = timed_handler
+    await app.router.startup()
+    # Same gate as a rolling deploy: no traffic until the warm-up is done
+    if not await app.state.readiness.wait(timeout=60):
+        print("warning: worker not ready after 60s, driving traffic anyway")
+
+    mix = TrafficMix(cohort, _weights(args), seed=args.seed)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            drive = await _drive(args, mix, client)
+            try:
+                await asyncio.wait_for(pool.join(), timeout=args.drain_timeout)
+                drained = True
+            except asyncio.TimeoutError:
+                drained = False
+    finally:
+        await app.router.shutdown()
+        stand_in.stop()
+
+    e2e = [done_at[k] - t for k, t in drive["sent_at"].items() if k in done_at]
+    last_done = max(done_at.values()) if done_at else time.time()
+    first_sent = min(drive["sent_at"].values()) if drive["sent_at"] else last_done
+    stats = pool.stats()
+    result = _summarize(args, drive)
+    result.update({
+        "mode": "inprocess",
+        "drained": drained,
+        "processed": stats["processed"],
+        "handler_failed": stats["failed"],
+        "retried": stats["retried"],
+        "duplicates_dropped": stats["duplicates"],
+        "processed_per_s": round(stats["processed"] / max(last_done - first_sent, 1e-9), 2),
+        "e2e_ms": percentiles(e2e),
+        "inbox_lag_max_s": stats["lag_max_s"],
+        "stand_in_calls": {**stand_in.counts, **email},
+    })
+    handled = stats["processed"] + stats["failed"]
+    result["handler_error_rate"] = round(stats["failed"] / handled, 4) if handled else 0.0
+    return result
+
+
+async def _run_remote(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    cohort = synthetic.make_cohort(args.patients, seed=args.seed, n_params=args.params)
+    mix = TrafficMix(cohort, _weights(args), seed=args.seed)
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        drive = await _drive(args, mix, client)
+    result = _summarize(args, drive)
+    result["mode"] = "remote"
+    result["target"] = args.url
+    return result
+
+
+def _weights(args: argparse.Namespace) -> Dict[str, float]:
+    return {"q1": args.mix_q1, "params": args.mix_params,
+            "duplicate": args.mix_duplicate, "unknown": args.mix_unknown}
+
+
+def _summarize(args: argparse.Namespace, drive: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": _git_rev(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "out")},
+        "requests": drive["requests"],
+        "by_kind": drive["by_kind"],
+        "statuses": drive["statuses"],
+        "offered_rps": round(drive["requests"] / drive["send_window"], 2),
+        "acked_rps": round(len(drive["acks"]) / drive["send_window"], 2),
+        "ack_ms": percentiles(drive["acks"]),
+        "http_errors": drive["errors"],
+        "http_error_rate": round(drive["errors"] / drive["requests"], 4) if drive["requests"] else 0.0,
+    }
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def save(result: Dict[str, Any], out_dir: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"{result['timestamp'].replace(':', '')}-{result['label'] or result['mode']}.json"
+    path = os.path.join(out_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def _report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    rows = [
+        ("offered req/s", "offered_rps"), ("acked req/s", "acked_rps"),
+        ("processed ev/s", "processed_per_s"),
+        ("ack p50 ms", "ack_ms.p50"), ("ack p95 ms", "ack_ms.p95"), ("ack p99 ms", "ack_ms.p99"),
+        ("e2e p50 ms", "e2e_ms.p50"), ("e2e p95 ms", "e2e_ms.p95"), ("e2e p99 ms", "e2e_ms.p99"),
+        ("http error rate", "http_error_rate"), ("handler error rate", "handler_error_rate"),
+    ]
+
+    def get(d: Optional[Dict[str, Any]], path: str) -> Any:
+        for part in path.split("."):
+            if not isinstance(d, dict):
+                return None
+            d = d.get(part)
+        return d
+
+    print(f"\n{'metric':<20}{'this run':>14}" + (f"{'baseline':>14}{'change':>10}" if baseline else ""))
+    for title, key in rows:
+        value = get(result, key)
+        if value is None:
+            continue
+        line = f"{title:<20}{value:>14}"
+        if baseline:
+            old = get(baseline, key)
+            if old is not None:
+                change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+                line += f"{old:>14}{change:>10}"
+        print(line)
+    print(f"\nrequests: {result['requests']}  by kind: {result['by_kind']}")
+    print(f"statuses: {result['statuses']}")
+    if "stand_in_calls" in result:
+        print(f"stand-in calls: {result['stand_in_calls']}  drained: {result['drained']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CareFlow /webhook load test")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--params", type=int, default=4, help="parameters per patient")
+    parser.add_argument("--rate", type=float, default=50.0, help="offered requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--concurrency", type=int, default=256, help="max in-flight webhook requests")
+    parser.add_argument("--inbox-concurrency", type=int, default=32,
+                        help="INBOX_CONCURRENCY for the app under test")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--wa-latency", type=float, default=0.15, help="UltraMsg stand-in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Groq stand-in seconds")
+    parser.add_argument("--smtp-latency", type=float, default=0.4, help="SMTP stand-in seconds")
+    parser.add_argument("--mix-q1", type=float, default=0.45)
+    parser.add_argument("--mix-params", type=float, default=0.35)
+    parser.add_argument("--mix-duplicate", type=float, default=0.1)
+    parser.add_argument("--mix-unknown", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--url", help="drive an already running server instead (ack latency only)")
+    parser.add_argument("--label", default="", help="name for the saved result")
+    parser.add_argument("--out", default=RESULTS_DIR, help="directory for result JSON")
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(_run_remote(args) if args.url else _run_inprocess(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _report(result, baseline)
+    print(f"\nsaved: {save(result, args.out)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
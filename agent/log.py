@@ -0,0 +1,160 @@
+# agent/log.py
+# Structured, low-overhead logging for the agent.
+#
+# - get_logger(__name__) everywhere instead of print()
+# - records are handed to a background QueueListener; formatting and the
+#   stdout write happen off the request path
+# - LOG_FORMAT=json emits one JSON object per line with the patient_id /
+#   request_id bound via log_context()
+# - LOG_SAMPLE_RATE < 1 keeps only that fraction of DEBUG/INFO records
+# - LOG_DEBUG_DUMPS=1 enables expensive diagnostic dumps (full webhook
+#   bodies, active-patient listings); off by default
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Iterator, Optional
+
+_patient_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("patient_id", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+_STD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a logger under the `careflow` namespace."""
+    if name.startswith("agent."):
+        name = name[len("agent."):]
+    return logging.getLogger(f"careflow.{name}")
+
+
+def debug_dumps_enabled() -> bool:
+    return os.getenv("LOG_DEBUG_DUMPS", "0").lower() in ("1", "true", "yes")
+
+
+@contextlib.contextmanager
+def log_context(patient_id: Optional[str] = None, request_id: Optional[str] = None) -> Iterator[None]:
+    """Binds correlation ids to every record logged inside the block (incl. to_thread calls)."""
+    tokens = []
+    if patient_id is not None:
+        tokens.append((_patient_id, _patient_id.set(str(patient_id))))
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(str(request_id))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def bind_patient(patient_id: str) -> None:
+    """Sets the patient id for the rest of the current context."""
+    _patient_id.set(str(patient_id))
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps correlation ids and drops sampled-out low-level records."""
+
+    def __init__(self, sample_rate: float = 1.0) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate < 1.0 and record.levelno < logging.WARNING:
+            if random.random() >= self.sample_rate:
+                return False
+        record.patient_id = _patient_id.get()
+        record.request_id = _request_id.get()
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the record as-is. The stock QueueHandler formats the message
+    in the caller's thread; here %-args are only merged by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                  + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "patient_id", None):
+            entry["patient_id"] = record.patient_id
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _STD_ATTRS and key not in entry and key not in ("patient_id", "request_id"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s%(ctx)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        ids = [f"{k}={getattr(record, k)}" for k in ("request_id", "patient_id") if getattr(record, k, None)]
+        record.ctx = f" [{' '.join(ids)}]" if ids else ""
+        return super().format(record)
+
+
+def configure_logging(force: bool = False) -> None:
+    """
+    Installs the queued handler on the `careflow` logger. Idempotent.
+
+    LOG_LEVEL (INFO), LOG_FORMAT (text|json), LOG_SAMPLE_RATE (1.0).
+    """
+    global _listener
+    if _listener is not None and not force:
+        return
+    if _listener is not None:
+        _listener.stop()
+
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    fmt = JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else TextFormatter()
+    sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(fmt)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    handler.addFilter(_ContextFilter(sample_rate))
+
+    root = logging.getLogger("careflow")
+    root.handlers = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records (call on process shutdown)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
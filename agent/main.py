@@ -1,25 +1,44 @@
 import os
 import json
-from typing import Any, Dict
+import asyncio
+import hashlib
+import time
+import uuid
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from dotenv import load_dotenv
-
-load_dotenv()
 
 from .agent import CareFlowAgent
+from .alarm_rules import rule_cache
+from .anomaly import ALERTS_ENABLED as ANOMALY_ALERTS_ENABLED, ANOMALIES, describe as describe_anomalies
+from .cohort_whatif import load_snapshot as cohort_whatif_snapshot
 from .scheduler import start_scheduler
 from .whatsapp import send_whatsapp_message
 from .alerts import send_doctor_alert
 from .firebase_client import (
-    db, flag_alert,
-    get_patient_by_phone, update_followup,
-    save_checkin, save_alert
+    flag_alert, update_followup,
+    save_checkin, save_alert, update_checkin, patient_cache, resolve_alert
 )
+from . import dashboard
+from . import firebase_async
+from . import metrics
+from . import recovery_curves
+from . import tracing
+from .inbox import Inbox, InboxWorkerPool
+from .phone import normalize_phone
+from .log import bind_patient, configure_logging, debug_dumps_enabled, get_logger, shutdown_logging
 from .response_analyzer import run_full_analysis_pipeline
-from firebase_admin import firestore
+from .storage import SERVER_TIMESTAMP
+from .warmup import Readiness
+
+
+log = get_logger(__name__)
+
+# Check-ins slower than this end-to-end are logged with their breakdown
+SLOW_CHECKIN_MS = int(os.getenv("SLOW_CHECKIN_MS", "20000"))
 
 
 class WebhookEvent(BaseModel):
@@ -28,27 +47,35 @@ class WebhookEvent(BaseModel):
     payload: Dict[str, Any] | None = None
 
 
-# ── Phone normalizer ─────────────────────────────────────
-def normalize_phone(phone: str) -> str:
+class ActionsBatchRequest(BaseModel):
+    patient_ids: List[str]
+
+
+class WhatIfRequest(BaseModel):
+    # {"Pain Level": {"alarmingRate": 3}, ...}
+    overrides: Dict[str, Dict[str, Any]]
+    doctor_id: str | None = None
+    refresh: bool = False
+
+
+# ── Idempotency key for incoming messages ────────────────
+def message_dedup_key(data: Dict[str, Any]) -> str:
     """
-    Normalizes phone number to match Firestore format.
-    +919876543210  → 919876543210
-    919876543210   → 919876543210
-    9876543210     → 919876543210 (adds India 91)
-    whatsapp:+91.. → 919876543210
+    UltraMsg's message id when present; otherwise a hash of the message
+    body + sender + timestamp so redelivered payloads still collapse.
     """
-    phone = str(phone).strip()
-    phone = phone.replace("whatsapp:", "")
-    phone = phone.replace("+", "")
-    phone = phone.replace(" ", "")
-    phone = phone.replace("-", "")
-    if len(phone) == 10:
-        phone = "91" + phone
-    return phone
+    msg_id = data.get("id")
+    if msg_id:
+        return f"id:{msg_id}"
+    raw = json.dumps(
+        [data.get("from"), data.get("body"), data.get("time") or data.get("timestamp")],
+        sort_keys=True, default=str,
+    )
+    return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
 
 # ── Find patient with multi-format phone lookup ──────────
-def get_patient_by_phone(phone: str):
+async def get_patient_by_phone(phone: str):
     """
     Tries multiple phone formats to find the patient.
     Handles format mismatches between UltraMsg and Firestore.
@@ -61,35 +88,238 @@ def get_patient_by_phone(phone: str):
         normalized[2:] if normalized.startswith("91") else "91" + normalized,
     ])
 
+    data = await firebase_async.get_indexed_followup(formats_to_try)
+    if data:
+        return data
+
     for fmt in formats_to_try:
-        docs = list(
-            db.collection("followup_patients")
-            .where("patientPhone", "==", fmt)
-            .where("status", "==", "active")
-            .limit(1)
-            .stream()
-        )
-        if docs:
-            data = docs[0].to_dict()
-            data["doc_id"] = docs[0].id
-            print(f"[FOUND] Patient with phone format '{fmt}'")
+        data = await firebase_async.get_active_followup_by_phone(fmt)
+        if data:
+            log.debug("Patient found with phone format '%s'", fmt)
             return data
 
-    # Debug — show all active patients so you can compare phone formats
-    print(f"[NOT FOUND] No patient for phone: '{phone}' (normalized: '{normalized}')")
-    all_docs = list(
-        db.collection("followup_patients")
-        .where("status", "==", "active")
-        .stream()
-    )
-    print(f"  Active patients in Firestore:")
-    for d in all_docs:
-        pdata = d.to_dict()
-        print(f"    -> '{pdata.get('patientName')}': '{pdata.get('patientPhone')}'")
+    log.warning("No patient for phone '%s' (normalized: '%s')", phone, normalized)
+    if debug_dumps_enabled():
+        # Debug — show all active patients so you can compare phone formats
+        async for pdata in firebase_async.iter_active_followup_patients(
+            select=["patientName", "patientPhone"],
+        ):
+            log.debug("  active -> '%s': '%s'", pdata.get("patientName"), pdata.get("patientPhone"))
     return None
 
 
+# ── Inbox worker: process one UltraMsg reply ─────────────
+async def process_whatsapp_event(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs the conversation state machine for one incoming WhatsApp message.
+    Called by the inbox workers after /webhook has already acknowledged it.
+    """
+    from_number = data.get("from", "")
+    message_text = data.get("body", "").strip()
+
+    # Normalize phone before lookup
+    from_number_normalized = normalize_phone(from_number)
+    log.debug("Phone raw '%s' -> normalized '%s'", from_number, from_number_normalized)
+    log.debug("Message text: '%s'", message_text)
+
+    # Find patient (tries multiple formats)
+    with tracing.span("lookup_patient"):
+        patient_data = await get_patient_by_phone(from_number)
+
+    if not patient_data:
+        return {"status": "patient not found"}
+
+    p_doc_id = patient_data["doc_id"]
+    name = patient_data.get("patientName", "Patient")
+    state = patient_data.get("conversationState", "awaiting_q1")
+    current_day = patient_data.get("currentDay", 1)
+    phone = patient_data.get("patientPhone", from_number)
+
+    bind_patient(p_doc_id)
+    root = tracing.current_span()
+    if root is not None:
+        root.set(patient_id=p_doc_id, state=state, day=current_day)
+    log.info("Reply from %s | state '%s' | day %s", name, state, current_day)
+
+    # ════════════════════════════════════════════════════════
+    # CRITICAL: Update conversationState in Firestore FIRST
+    # BEFORE doing anything else — this cancels the 15s timer.
+    # The timer checks this field; if still "awaiting_q1"
+    # after 18s (15s+3s buffer) → emergency fires.
+    # ════════════════════════════════════════════════════════
+
+    if state == "awaiting_q1":
+        # Parsing is pure, so the answer goes out in the same write that
+        # cancels the timer: a retried event resumes from it (see below)
+        from .response_analyzer import parse_q1_answer
+        q1_result = parse_q1_answer(message_text)
+        await firebase_async.update_followup(p_doc_id, {
+            "conversationState": "q1_answered",
+            "q1AnsweredAt": SERVER_TIMESTAMP,
+            "q1RawReply": message_text,
+            "lastQ1Answer": q1_result,
+            "q1Step": "parsed",
+        })
+        log.info("State -> 'q1_answered' (emergency timer cancelled), Q1 parsed as '%s'", q1_result)
+        return await _continue_q1(
+            {**patient_data, "q1RawReply": message_text}, p_doc_id, phone, q1_result, "parsed",
+        )
+
+    elif state == "q1_answered" and patient_data.get("q1Step"):
+        # Q1 handling failed part-way (the inbox retries the event, or the
+        # patient writes again): pick up after the last completed step
+        step = patient_data["q1Step"]
+        q1_result = patient_data.get("lastQ1Answer", "normal")
+        log.info("Resuming Q1 '%s' after step '%s'", q1_result, step)
+        return await _continue_q1(patient_data, p_doc_id, phone, q1_result, step)
+
+    elif state == "awaiting_parameters":
+        # Update state IMMEDIATELY; the check-in id is fixed here so a
+        # retried analysis replaces its record instead of adding another
+        checkin_id = uuid.uuid4().hex[:20]
+        await firebase_async.update_followup(p_doc_id, {
+            "conversationState": "parameters_answered",
+            "rawParameterReply": message_text,
+            "repliedAt": SERVER_TIMESTAMP,
+            "paramStep": "received",
+            "paramCheckinId": checkin_id,
+        })
+        log.info("State -> 'parameters_answered'")
+
+        # Run the analysis pipeline (already off the request path)
+        await asyncio.to_thread(
+            _process_parameter_reply,
+            {**patient_data, "rawParameterReply": message_text, "paramCheckinId": checkin_id},
+            p_doc_id, current_day, phone, "received",
+        )
+        return {"status": "parameters received"}
+
+    elif state == "parameters_answered" and patient_data.get("paramStep"):
+        # The analysis or a send failed part-way: pick up after the last
+        # completed step, with the reply that was recorded
+        step = patient_data["paramStep"]
+        log.info("Resuming parameter reply after step '%s'", step)
+        await asyncio.to_thread(_process_parameter_reply, patient_data, p_doc_id, current_day, phone, step)
+        return {"status": "parameters received"}
+
+    elif state == "no_response_emergency_sent":
+        # Patient replied AFTER emergency was sent
+        await firebase_async.update_followup(p_doc_id, {
+            "conversationState": "q1_answered",
+            "q1Step": None,
+            "lateReply": message_text,
+            "repliedAt": SERVER_TIMESTAMP
+        })
+        await asyncio.to_thread(
+            send_whatsapp_message,
+            phone,
+            f"Thank you for responding *{name}*! "
+            f"We're glad you're okay.\n\n"
+            f"*How is your condition currently?*\n"
+            f"A) Normal\nB) Moderate\nC) Critical\n\n"
+            f"Please reply A, B, or C."
+        )
+        return {"status": "re-engaged"}
+
+    else:
+        log.info("State '%s' — no action needed", state)
+        if state != "completed_today":
+            await asyncio.to_thread(
+                send_whatsapp_message,
+                phone,
+                "Thank you! Your responses for today have been recorded."
+            )
+        return {"status": f"state: {state}"}
+
+
+async def _continue_q1(
+    patient_data: Dict[str, Any], p_doc_id: str, phone: str, q1_result: str, step: str,
+) -> Dict[str, Any]:
+    """
+    Side effects of a recorded Q1 answer. Each one is followed by a write
+    of the step it completed (q1Step: parsed -> notified -> cleared), so a
+    retry neither repeats the alert nor mistakes the half-handled reply for
+    a finished day.
+    """
+    name = patient_data.get("patientName", "Patient")
+    current_day = patient_data.get("currentDay", 1)
+
+    if step == "parsed":
+        if q1_result == "critical":
+            from .critical_alerts import send_critical_alert
+            with tracing.span("critical_alert"):
+                await asyncio.to_thread(send_critical_alert, patient_data, p_doc_id, current_day)
+        elif q1_result == "moderate":
+            from .critical_alerts import send_moderate_alert
+            with tracing.span("moderate_alert"):
+                await asyncio.to_thread(send_moderate_alert, patient_data, p_doc_id, current_day)
+        else:
+            await asyncio.to_thread(
+                send_whatsapp_message,
+                phone,
+                f"Glad to hear you are feeling okay *{name}*!\n\n"
+                f"Please answer a few quick questions:"
+            )
+        await firebase_async.update_followup(p_doc_id, {"q1Step": "notified"})
+
+    if q1_result == "critical":
+        await firebase_async.save_checkin(p_doc_id, {
+            "patientDocId": p_doc_id,
+            "patientName": name,
+            "dayNumber": current_day,
+            "rawReply": patient_data.get("q1RawReply", ""),
+            "conditionCategory": "critical",
+            "alertTriggered": True,
+            "doctorSummary": f"{name} reported CRITICAL condition.",
+            "timings": tracing.breakdown(),
+            "timestamp": SERVER_TIMESTAMP
+        })
+        await firebase_async.update_followup(p_doc_id, {
+            "conversationState": "completed_today",
+            "lastStatus": "critical",
+            "q1Step": None,
+        })
+        return {"status": "critical handled"}
+
+    # Send parameter questions (already off the request path)
+    with tracing.span("parameter_questions"):
+        await asyncio.to_thread(
+            _send_parameter_questions, patient_data, p_doc_id, current_day, phone
+        )
+    return {"status": "q1 processed", "q1": q1_result}
+
+
+def _register_gauges(inbox_pool: InboxWorkerPool) -> None:
+    """Scrape-time views over state the app already tracks."""
+    metrics.gauge(
+        "careflow_inbox_queue_depth", "Inbox events waiting across all patients.",
+    ).set_function(lambda: inbox_pool.stats()["queue_depth"])
+    metrics.gauge(
+        "careflow_inbox_in_flight", "Inbox events currently being handled.",
+    ).set_function(lambda: inbox_pool.in_flight)
+    metrics.counter(
+        "careflow_inbox_duplicates_total", "Webhook deliveries dropped as duplicates.",
+    ).set_function(lambda: inbox_pool.inbox.duplicates)
+    metrics.gauge(
+        "careflow_patient_cache_size", "Documents held in the patient cache.",
+    ).set_function(lambda: patient_cache.stats()["size"])
+    metrics.counter(
+        "careflow_patient_cache_hits_total", "Patient cache hits.",
+    ).set_function(lambda: patient_cache.hits)
+    metrics.counter(
+        "careflow_patient_cache_misses_total", "Patient cache misses.",
+    ).set_function(lambda: patient_cache.misses)
+    metrics.gauge(
+        "careflow_rule_cache_size", "Compiled alarm rule sets (distinct protocols) cached.",
+    ).set_function(lambda: rule_cache.stats()["size"])
+    metrics.counter(
+        "careflow_rule_cache_misses_total", "Alarm rule compilations.",
+    ).set_function(lambda: rule_cache.misses)
+
+
 def create_app() -> FastAPI:
+    configure_logging()
+
     app = FastAPI(
         title="CareFlow Agent",
         description="Python AI / automation backend for CareFlow.",
@@ -106,15 +336,138 @@ def create_app() -> FastAPI:
 
     agent = CareFlowAgent()
 
+    inbox_pool = InboxWorkerPool(
+        Inbox(
+            os.getenv("CAREFLOW_INBOX_PATH", "careflow_inbox.db"),
+            max_attempts=int(os.getenv("INBOX_MAX_ATTEMPTS", "3")),
+            dedup_window=float(os.getenv("DEDUP_WINDOW_SECONDS", "86400")),
+            dedup_cache_size=int(os.getenv("DEDUP_CACHE_SIZE", "10000")),
+        ),
+        handler=process_whatsapp_event,
+        concurrency=int(os.getenv("INBOX_CONCURRENCY", "32")),
+        # Serialized per patient phone: replies from the same patient are
+        # handled strictly in order (Q1 before the parameter answers).
+        key_fn=lambda data: normalize_phone(data.get("from", "")),
+    )
+    app.state.inbox_pool = inbox_pool
+    _register_gauges(inbox_pool)
+
+    readiness = Readiness.from_env()
+    app.state.readiness = readiness
+    metrics.gauge("careflow_ready", "1 once the startup warm-up has finished.").set_function(
+        lambda: 1.0 if readiness.ready else 0.0
+    )
+
+    @app.middleware("http")
+    async def _observe_latency(request: Request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Route template, not the raw path, to keep label cardinality bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=request.method, route=route, status=str(status),
+            )
+
+    @app.on_event("startup")
+    async def _start_inbox_workers() -> None:
+        await inbox_pool.start()
+        # In the background: the server accepts connections (liveness)
+        # while /ready keeps traffic away until the warm-up is done.
+        app.state.warmup_task = asyncio.create_task(readiness.run())
+
+    @app.on_event("shutdown")
+    async def _stop_inbox_workers() -> None:
+        app.state.warmup_task.cancel()
+        await inbox_pool.stop()
+        tracing.exporter.flush()
+        shutdown_logging()
+
     @app.get("/")
     def health_check():
         return {"status": "CareFlow Agent is running"}
 
+    @app.get("/ready")
+    def readiness_check():
+        """Readiness probe: 200 once warmed up, 503 before."""
+        return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    @app.get("/inbox/stats")
+    def inbox_stats():
+        return inbox_pool.stats()
+
+    @app.post("/actions/batch")
+    async def actions_batch(req: ActionsBatchRequest):
+        """Treatment actions for many patients, grouped by patient and sorted by createdAt."""
+        actions = await firebase_async.get_actions_for_patients(req.patient_ids)
+        return {"actions": actions}
+
+    @app.post("/cohort/whatif")
+    async def cohort_whatif(req: WhatIfRequest):
+        """Active patients whose category/trends would change under the given thresholds."""
+        def run():
+            snapshot = cohort_whatif_snapshot(max_age=0 if req.refresh else None)
+            return snapshot.whatif(req.overrides, doctor_id=req.doctor_id)
+        try:
+            return await asyncio.to_thread(run)
+        except ValueError as e:
+            return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
+
+    @app.get("/dashboard")
+    async def dashboard_stats(doctor_id: Optional[str] = None):
+        """Materialized counts for one doctor (or everyone): one batched read of its shards."""
+        return await asyncio.to_thread(dashboard.get_dashboard, doctor_id)
+
+    @app.post("/alerts/{alert_id}/resolve")
+    async def resolve_critical_alert(alert_id: str):
+        """Resolves an alert and decrements the dashboards' unresolved count with it."""
+        if not await asyncio.to_thread(resolve_alert, alert_id):
+            return JSONResponse({"status": "error", "detail": "unknown or already resolved"}, status_code=404)
+        return {"status": "resolved"}
+
+    @app.get("/analytics/recovery-curve")
+    async def recovery_curve(surgery_type: str, parameter: str, protocol: Optional[str] = None):
+        """Per-day percentiles of a parameter across a surgery cohort: one cached document read."""
+        return await asyncio.to_thread(recovery_curves.curve, surgery_type, parameter, protocol)
+
+    @app.get("/analytics/recovery-curve/patient/{doc_id}")
+    async def patient_recovery_curve(doc_id: str, parameter: str, protocol: Optional[str] = None):
+        """A patient's readings against the p10-p90 band of their surgery cohort."""
+        def run():
+            from .archive import ARCHIVES
+            from .storage import get_storage
+
+            # Completed follow-ups and their check-ins may have been archived
+            storage = get_storage()
+            patient = storage.get_followup(doc_id) or storage.get_archived(ARCHIVES["followup_patients"], doc_id)
+            if patient is None:
+                return None
+            checkins = {c["id"]: c for c in storage.get_archived_for_patient(ARCHIVES["checkin_responses"], doc_id)}
+            checkins.update((c["id"], c) for c in storage.get_checkins_for_patient(doc_id))
+            return recovery_curves.compare_patient(patient, checkins.values(), parameter, protocol)
+        try:
+            result = await asyncio.to_thread(run)
+        except ValueError as e:
+            return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
+        if result is None:
+            return JSONResponse({"status": "error", "detail": "unknown patient"}, status_code=404)
+        return result
+
     @app.post("/webhook")
-    async def universal_webhook(request: Request, background_tasks: BackgroundTasks):
+    async def universal_webhook(request: Request):
         try:
             body = await request.json()
-            print(f"\n[WEBHOOK] Received: {json.dumps(body, indent=2)}")
+            if debug_dumps_enabled():
+                log.debug("Webhook received: %s", body)
 
             # ─── CASE 1: UltraMsg WhatsApp Reply ────────────────────────
             if "data" in body and "body" in body.get("data", {}):
@@ -124,149 +477,40 @@ def create_app() -> FastAPI:
 
                 # Ignore outgoing messages
                 if data.get("fromMe", False):
-                    print("[SKIP] Outgoing message — ignored")
+                    log.debug("Outgoing message — ignored")
+                    metrics.WEBHOOK_EVENTS.inc(source="ultramsg", outcome="outgoing")
                     return {"status": "ignored - outgoing"}
 
                 # Ignore empty messages
                 if not message_text or not from_number:
-                    print("[SKIP] Empty message — ignored")
+                    log.debug("Empty message — ignored")
+                    metrics.WEBHOOK_EVENTS.inc(source="ultramsg", outcome="empty")
                     return {"status": "ignored - empty"}
 
-                # Normalize phone before lookup
-                from_number_normalized = normalize_phone(from_number)
-                print(f"[PHONE] Raw: '{from_number}' → Normalized: '{from_number_normalized}'")
-                print(f"[MSG] Text: '{message_text}'")
-
-                # Find patient (tries multiple formats)
-                patient_data = get_patient_by_phone(from_number)
-
-                if not patient_data:
-                    return {"status": "patient not found"}
-
-                p_doc_id = patient_data["doc_id"]
-                name = patient_data.get("patientName", "Patient")
-                state = patient_data.get("conversationState", "awaiting_q1")
-                current_day = patient_data.get("currentDay", 1)
-                phone = patient_data.get("patientPhone", from_number)
-
-                print(f"[PATIENT] {name} | State: '{state}' | Day: {current_day}")
-
-                # ════════════════════════════════════════════════════════
-                # CRITICAL: Update conversationState in Firestore FIRST
-                # BEFORE doing anything else — this cancels the 15s timer.
-                # The timer checks this field; if still "awaiting_q1"
-                # after 18s (15s+3s buffer) → emergency fires.
-                # ════════════════════════════════════════════════════════
-
-                if state == "awaiting_q1":
-                    # Step 1 — Update state IMMEDIATELY
-                    db.collection("followup_patients").document(p_doc_id).update({
-                        "conversationState": "q1_answered",
-                        "q1AnsweredAt": firestore.SERVER_TIMESTAMP,
-                        "q1RawReply": message_text
-                    })
-                    print(f"[STATE] Updated to 'q1_answered' — emergency timer cancelled")
-
-                    # Step 2 — Parse A/B/C
-                    from .response_analyzer import parse_q1_answer
-                    q1_result = parse_q1_answer(message_text)
-                    print(f"[Q1] Parsed as: '{q1_result}'")
-
-                    # Save Q1 result
-                    db.collection("followup_patients").document(p_doc_id).update({
-                        "lastQ1Answer": q1_result
-                    })
-
-                    if q1_result == "critical":
-                        from .critical_alerts import send_critical_alert
-                        send_critical_alert(patient_data, p_doc_id, current_day)
-                        db.collection("followup_patients").document(p_doc_id).update({
-                            "conversationState": "completed_today",
-                            "lastStatus": "critical"
-                        })
-                        db.collection("checkin_responses").add({
-                            "patientDocId": p_doc_id,
-                            "patientName": name,
-                            "dayNumber": current_day,
-                            "rawReply": message_text,
-                            "conditionCategory": "critical",
-                            "alertTriggered": True,
-                            "doctorSummary": f"{name} reported CRITICAL condition.",
-                            "timestamp": firestore.SERVER_TIMESTAMP
-                        })
-                        return {"status": "critical handled"}
-
-                    elif q1_result == "moderate":
-                        from .critical_alerts import send_moderate_alert
-                        send_moderate_alert(patient_data, p_doc_id, current_day)
-
-                    else:
-                        send_whatsapp_message(
-                            phone,
-                            f"Glad to hear you are feeling okay *{name}*!\n\n"
-                            f"Please answer a few quick questions:"
-                        )
-
-                    # Send parameter questions in background
-                    background_tasks.add_task(
-                        _send_parameter_questions, patient_data, p_doc_id, current_day, phone
-                    )
-                    return {"status": "q1 processed", "q1": q1_result}
-
-                elif state == "awaiting_parameters":
-                    # Update state IMMEDIATELY
-                    db.collection("followup_patients").document(p_doc_id).update({
-                        "conversationState": "parameters_answered",
-                        "rawParameterReply": message_text,
-                        "repliedAt": firestore.SERVER_TIMESTAMP
-                    })
-                    print(f"[STATE] Updated to 'parameters_answered'")
-
-                    # Process in background
-                    background_tasks.add_task(
-                        _process_parameter_reply, patient_data, p_doc_id, current_day,
-                        message_text, phone
-                    )
-                    return {"status": "parameters received"}
-
-                elif state == "no_response_emergency_sent":
-                    # Patient replied AFTER emergency was sent
-                    db.collection("followup_patients").document(p_doc_id).update({
-                        "conversationState": "q1_answered",
-                        "lateReply": message_text,
-                        "repliedAt": firestore.SERVER_TIMESTAMP
-                    })
-                    send_whatsapp_message(
-                        phone,
-                        f"Thank you for responding *{name}*! "
-                        f"We're glad you're okay.\n\n"
-                        f"*How is your condition currently?*\n"
-                        f"A) Normal\nB) Moderate\nC) Critical\n\n"
-                        f"Please reply A, B, or C."
-                    )
-                    return {"status": "re-engaged"}
-
-                else:
-                    print(f"[SKIP] State '{state}' — no action needed")
-                    if state != "completed_today":
-                        send_whatsapp_message(
-                            phone,
-                            "Thank you! Your responses for today have been recorded."
-                        )
-                    return {"status": f"state: {state}"}
+                # Persist and acknowledge — the inbox workers do the rest.
+                # Redeliveries of the same message are dropped here, before
+                # any Firestore or LLM work.
+                event_id = await inbox_pool.submit(data, dedup_key=message_dedup_key(data))
+                if event_id is None:
+                    log.info("Duplicate delivery — ignored")
+                    metrics.WEBHOOK_EVENTS.inc(source="ultramsg", outcome="duplicate")
+                    return {"status": "ignored - duplicate"}
+                metrics.WEBHOOK_EVENTS.inc(source="ultramsg", outcome="queued")
+                return {"status": "queued", "event_id": event_id}
 
             # ─── CASE 2: Next.js Internal Event ─────────────────────────
             if "event_type" in body:
                 event = WebhookEvent(**body)
                 result = await agent.handle_event(event.dict())
+                metrics.WEBHOOK_EVENTS.inc(source="nextjs", outcome="handled")
                 return {"ok": True, "result": result, "source": "nextjs"}
 
+            metrics.WEBHOOK_EVENTS.inc(source="unknown", outcome="ignored")
             return {"status": "unknown format"}
 
         except Exception as e:
-            print(f"[ERROR] Webhook error: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Webhook error: %s: %s", type(e).__name__, e)
+            metrics.WEBHOOK_EVENTS.inc(source="any", outcome="error")
             return {"status": "error", "detail": str(e)}
 
     start_scheduler(app)
@@ -279,13 +523,11 @@ def _send_parameter_questions(patient: dict, doc_id: str, day: int, phone: str):
         from .question_generator import generate_parameter_questions
         msg = generate_parameter_questions(patient, day)
 
-        update_followup(doc_id, {"conversationState": "awaiting_parameters"})
+        update_followup(doc_id, {"conversationState": "awaiting_parameters", "q1Step": None})
         send_whatsapp_message(phone, msg)
-        print(f"[OK] Parameter questions sent to {patient.get('patientName')}")
+        log.info("Parameter questions sent to %s", patient.get("patientName"))
     except Exception as e:
-        print(f"[ERROR] send_parameter_questions: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("send_parameter_questions failed: %s", e)
         # Send a fallback so patient is never left hanging
         try:
             send_whatsapp_message(phone,
@@ -297,83 +539,146 @@ def _send_parameter_questions(patient: dict, doc_id: str, day: int, phone: str):
 
 
 # ── Background: Process parameter reply ─────────────────
-def _process_parameter_reply(
-    patient: dict, doc_id: str, day: int, raw_reply: str, phone: str
-):
-    try:
-        q1_ans = patient.get("lastQ1Answer", "normal")
-        analysis = run_full_analysis_pipeline(
-            patient=patient,
-            day_number=day,
-            raw_reply=raw_reply,
-            q1_answer=q1_ans
-        )
+def _process_parameter_reply(patient: dict, doc_id: str, day: int, phone: str, step: str):
+    """
+    Analyses the recorded parameter reply and acts on it. Each step ends
+    with a write of the step it completed (paramStep: received -> saved ->
+    alerted -> cleared), so the inbox's retry of a failed event resumes
+    where it stopped: the check-in is stored and counted once, the doctor
+    alerted once. Failures propagate so that retry happens.
+    """
+    name = patient.get("patientName", "Patient")
+
+    if step == "received":
+        with tracing.span("analysis"):
+            analysis = run_full_analysis_pipeline(
+                patient=patient,
+                day_number=day,
+                raw_reply=patient.get("rawParameterReply", ""),
+                q1_answer=patient.get("lastQ1Answer", "normal")
+            )
 
         if not analysis:
-            print(f"[WARN] Analysis returned None for {patient.get('patientName')}")
+            log.warning("Analysis returned None for %s", name)
             send_whatsapp_message(phone,
-                f"Thank you *{patient.get('patientName')}*! "
+                f"Thank you *{name}*! "
                 f"Your responses have been recorded. Your doctor will review them."
             )
             update_followup(doc_id, {
                 "conversationState": "completed_today",
+                "paramStep": None,
                 "checkinsCompleted": patient.get("checkinsCompleted", 0) + 1
             })
             return
 
         # Save checkin response using centralized helper
-        save_checkin(doc_id, {
+        checkin_id = save_checkin(doc_id, {
             "patientDocId":       doc_id,
-            "patientName":        patient.get("patientName", "Patient"),
+            "patientName":        name,
             "dayNumber":          day,
-            "rawReply":           raw_reply,
+            "rawReply":           patient.get("rawParameterReply", ""),
             "ratings":            analysis.get("ratings", {}),
             "subjective":         analysis.get("subjective", ""),
             "conditionCategory":  analysis.get("condition_category", "normal"),
             "statusPerParameter": analysis.get("status_per_parameter", {}),
+            "trendSignals":       analysis.get("trend_signals", {}),
             "overallStatus":      analysis.get("overall_status", "good"),
             "alertTriggered":     analysis.get("alert_doctor", False),
             "alertedParameters":  [p["name"] for p in analysis.get("crossed_parameters", [])],
+            "anomalousParameters": analysis.get("anomalous_parameters", []),
             "doctorSummary":      analysis.get("doctor_summary", ""),
-            "timestamp":          firestore.SERVER_TIMESTAMP
-        })
+            "timestamp":          SERVER_TIMESTAMP
+        }, checkin_id=patient.get("paramCheckinId"))
+
+        # What the remaining steps send, kept on the record for a resume
+        anomalies = analysis.get("anomalous_parameters", [])
+        alert = None
+        if analysis.get("alert_doctor"):
+            reason = analysis.get("doctor_summary", "")
+            if anomalies:
+                reason += f" Unusual for this patient: {describe_anomalies(anomalies)}."
+            alert = {"flag": True, "severity": analysis.get("condition_category", "warning"),
+                     "summary": analysis.get("doctor_summary", ""), "reason": reason}
+        elif anomalies and ANOMALY_ALERTS_ENABLED:
+            # Within thresholds but out of line with the patient's own history
+            alert = {"flag": False, "severity": "anomaly",
+                     "reason": f"Unusual for this patient: {describe_anomalies(anomalies)}."}
 
         # Update patient record using centralized helper
         update_followup(doc_id, {
-            "conversationState":  "completed_today",
             "lastStatus":         analysis.get("condition_category", "normal"),
             "lastRatings":        analysis.get("ratings", {}),
+            "previousRatings":    patient.get("lastRatings", {}),
+            "trendSeries":        analysis.get("trend_series", patient.get("trendSeries", {})),
+            "ratingStats":        analysis.get("rating_stats", patient.get("ratingStats", {})),
             "lastSubjective":     analysis.get("subjective", ""),
-            "checkinsCompleted":  patient.get("checkinsCompleted", 0) + 1
+            "checkinsCompleted":  patient.get("checkinsCompleted", 0) + 1,
+            "paramStep":          "saved",
+            "paramPending":       {"alert": alert, "reply": analysis.get("patient_reply", "")},
         })
+        for anomaly in anomalies:
+            ANOMALIES.inc(kind=anomaly["kind"])
 
-        # Alert doctor if needed
-        if analysis.get("alert_doctor"):
-            flag_alert(doc_id, analysis.get("condition_category", "warning"),
-                       analysis.get("doctor_summary", ""))
-            send_doctor_alert(
-                patient_name=patient.get("patientName", "Patient"),
-                reason=analysis.get("doctor_summary", ""),
-                severity=analysis.get("condition_category", "warning")
-            )
+        # Cohort recovery curves; a failed increment must not cost the reply
+        try:
+            with tracing.span("recovery_curves"):
+                recovery_curves.record_checkin(patient, day, analysis.get("ratings", {}))
+        except Exception as e:
+            recovery_curves.record_failure(e)
 
-        # Empathetic reply to patient
-        patient_reply = analysis.get("patient_reply", "")
-        if patient_reply:
-            send_whatsapp_message(phone, patient_reply)
-        else:
-            send_whatsapp_message(phone,
-                f"Thank you *{patient.get('patientName')}*! "
-                f"Your responses have been recorded. "
-                f"Dr. {patient.get('doctorName', 'your doctor')} will review them."
-            )
+        _record_timings(checkin_id)
+        patient = {**patient, "paramPending": {"alert": alert, "reply": analysis.get("patient_reply", "")}}
+        step = "saved"
+
+    pending = patient.get("paramPending") or {}
+
+    if step == "saved":
+        # Alert doctor if needed
+        alert = pending.get("alert")
+        if alert:
+            with tracing.span("doctor_alert"):
+                if alert.get("flag"):
+                    flag_alert(doc_id, alert["severity"], alert.get("summary", ""))
+                send_doctor_alert(patient_name=name, reason=alert["reason"], severity=alert["severity"])
+        update_followup(doc_id, {"paramStep": "alerted"})
+
+    # Empathetic reply to patient
+    if pending.get("reply"):
+        send_whatsapp_message(phone, pending["reply"])
+    else:
+        send_whatsapp_message(phone,
+            f"Thank you *{name}*! "
+            f"Your responses have been recorded. "
+            f"Dr. {patient.get('doctorName', 'your doctor')} will review them."
+        )
+    update_followup(doc_id, {"conversationState": "completed_today", "paramStep": None, "paramPending": None})
+    log.info("Full analysis complete for %s", name)
 
-        print(f"[OK] Full analysis complete for {patient.get('patientName')}")
 
+def _record_timings(checkin_id: str) -> None:
+    """Stores the per-step timing breakdown (ms) on the checkin record."""
+    timings = tracing.breakdown()
+    if not timings or not checkin_id:
+        return
+    try:
+        update_checkin(checkin_id, {"timings": timings})
     except Exception as e:
-        print(f"[ERROR] process_parameter_reply: {e}")
-        import traceback
-        traceback.print_exc()
+        log.warning("Could not store check-in timings: %s", e)
+    if timings.get("total", 0) >= SLOW_CHECKIN_MS:
+        log.warning("Slow check-in: %s ms", timings["total"], extra={"timings": timings})
+
+
+
+_app: FastAPI | None = None
 
 
-app = create_app()
+def __getattr__(name: str) -> Any:
+    # `uvicorn agent.main:app` still works, but importing agent.main (tests,
+    # scripts, the load-test harness) no longer builds the app, opens the
+    # inbox database or registers the scheduler as a side effect.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
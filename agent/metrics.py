@@ -0,0 +1,317 @@
+# agent/metrics.py
+# In-process metrics registry rendered in the Prometheus text format.
+#
+# Dependency-free and cheap enough to leave on: an observation is a dict
+# lookup, a bisect and a couple of additions under a per-metric lock.
+# Counters and gauges can also be backed by a callback that is only evaluated when
+# /metrics is scraped (queue depth, cache size, live timers).
+
+from __future__ import annotations
+
+import bisect
+import contextlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """Reads the value from `fn()` at scrape time (label-less counters/gauges only)."""
+        self._function = fn
+
+    def _function_samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {_fmt(self._function())}"]
+        except Exception:
+            return []
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labelstr(self, key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra is not None:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            return self._function_samples()
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {} if self.labelnames else {(): 0.0}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            return self._function_samples()
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), s[0]) for k, (c, s) in self._values.items()]
+        lines: List[str] = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._labelstr(key, ('le', _fmt(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labelstr(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._labelstr(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# ── Hot-path metrics shared across modules ──────────────
+HTTP_REQUEST_SECONDS = histogram(
+    "careflow_http_request_seconds", "HTTP request latency by route.",
+    ("method", "route", "status"),
+)
+WEBHOOK_EVENTS = counter(
+    "careflow_webhook_events_total", "Webhook deliveries by source and outcome.",
+    ("source", "outcome"),
+)
+INBOX_EVENT_SECONDS = histogram(
+    "careflow_inbox_event_seconds", "Time to process one inbox event (all attempts).",
+    ("outcome",),
+)
+INBOX_LAG_SECONDS = histogram(
+    "careflow_inbox_lag_seconds", "Delay between webhook receipt and a worker picking the event up.",
+)
+LLM_CALL_SECONDS = histogram(
+    "careflow_llm_call_seconds", "LLM completion latency per model.",
+    ("model", "outcome"),
+)
+STORAGE_SECONDS = histogram(
+    "careflow_storage_op_seconds", "Storage round-trip latency per backend and operation.",
+    ("backend", "op"),
+)
+MESSAGE_SEND_SECONDS = histogram(
+    "careflow_message_send_seconds", "Outbound notification latency (UltraMsg WhatsApp, SMTP email).",
+    ("channel", "kind", "outcome"),
+)
+DAILY_CHECKIN_SECONDS = histogram(
+    "careflow_daily_checkins_seconds", "Duration of one run_daily_checkins job.",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+)
+DAILY_CHECKIN_PATIENTS = counter(
+    "careflow_daily_checkin_patients_total", "Patients handled by run_daily_checkins by outcome.",
+    ("outcome",),
+)
+STATE_TRANSITIONS = counter(
+    "careflow_conversation_state_transitions_total", "conversationState writes by target state.",
+    ("state",),
+)
+ACTIVE_TIMERS = gauge(
+    "careflow_followup_timers_active", "Follow-up timer threads currently running.",
+)
+
+
+class SendResult:
+    """Yielded by timed_send; mark it failed when the provider rejected the send."""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self) -> None:
+        self.outcome = "ok"
+
+    def failed(self) -> None:
+        self.outcome = "error"
+
+
+@contextlib.contextmanager
+def timed_send(channel: str, kind: str) -> Iterator[SendResult]:
+    """
+    Times an outbound send; `outcome` is error if the block raises or
+    calls failed() on the yielded result (an HTTP error or a rejection in
+    the response body).
+    """
+    started = time.perf_counter()
+    result = SendResult()
+    try:
+        yield result
+    except BaseException:
+        result.failed()
+        raise
+    finally:
+        MESSAGE_SEND_SECONDS.observe(
+            time.perf_counter() - started, channel=channel, kind=kind, outcome=result.outcome,
+        )
+
+
+def record_state(data: Dict[str, object]) -> None:
+    """Counts a conversationState transition if the update sets one."""
+    state = data.get("conversationState")
+    if state is not None:
+        STATE_TRANSITIONS.inc(state=str(state))
+
+
+def render() -> str:
+    return REGISTRY.render()
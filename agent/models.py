@@ -0,0 +1,80 @@
+# agent/models.py
+# Compact, typed records for jobs that walk the whole follow-up cohort.
+#
+# A followup_patients document as a dict carries every field (parameters,
+# trendSeries, ratingStats, replies...) plus the per-key overhead of a
+# dict, and `{**doc.to_dict(), "id": doc.id}` copies it once more. Bulk
+# paths (the daily check-in trigger, the no-response timer) only read a
+# handful of fields, so they use FollowupPatient: a __slots__ object built
+# straight from each streamed snapshot with just those fields, the page it
+# came from released as soon as the iterator moves on.
+#
+# Records also answer `record["patientName"]` and `record.get(...)`, so
+# helpers written for document dicts accept them unchanged.
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+# Document field -> attribute, in slot order
+FIELDS: Dict[str, str] = {
+    "patientName": "patient_name",
+    "patientPhone": "patient_phone",
+    "doctorName": "doctor_name",
+    "doctorId": "doctor_id",
+    "surgeryType": "surgery_type",
+    "status": "status",
+    "conversationState": "conversation_state",
+    "lastStatus": "last_status",
+    "currentDay": "current_day",
+    "followupDays": "followup_days",
+    "checkinsCompleted": "checkins_completed",
+    "emergencyContact": "emergency_contact",
+}
+
+
+class FollowupPatient:
+    """The fields of a followup_patients document that bulk jobs read; absent ones are None."""
+
+    __slots__ = ("id", *FIELDS.values())
+
+    # Projection (`select`) that fetches everything a record holds
+    DOCUMENT_FIELDS = tuple(FIELDS)
+
+    def __init__(self, doc_id: str, **values: Any) -> None:
+        self.id = doc_id
+        for attr in FIELDS.values():
+            setattr(self, attr, values.get(attr))
+
+    @classmethod
+    def from_dict(cls, doc_id: str, data: Dict[str, Any]) -> "FollowupPatient":
+        record = cls.__new__(cls)
+        record.id = doc_id
+        for field, attr in FIELDS.items():
+            setattr(record, attr, data.get(field))
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Document-shaped dict of the fields that are set, with "id"."""
+        data = {field: getattr(self, attr) for field, attr in FIELDS.items() if getattr(self, attr) is not None}
+        data["id"] = self.id
+        return data
+
+    # Read-only mapping access by document field name
+    def __getitem__(self, field: str) -> Any:
+        if field == "id":
+            return self.id
+        value = getattr(self, FIELDS[field])
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def get(self, field: str, default: Any = None) -> Any:
+        if field == "id":
+            return self.id
+        attr = FIELDS.get(field)
+        value = getattr(self, attr) if attr else None
+        return default if value is None else value
+
+    def __repr__(self) -> str:
+        return f"FollowupPatient(id={self.id!r}, patient_name={self.patient_name!r})"
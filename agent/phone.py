@@ -0,0 +1,23 @@
+# agent/phone.py
+# Phone number normalization shared by the webhook and tools.
+# Kept dependency-free so it can be imported (and benchmarked) cheaply.
+
+
+def normalize_phone(phone: str) -> str:
+    """
+    Normalizes phone number to match Firestore format.
+    +919876543210  → 919876543210
+    919876543210   → 919876543210
+    9876543210     → 919876543210 (adds India 91)
+    whatsapp:+91.. → 919876543210
+    919876543210@c.us → 919876543210 (UltraMsg chat id)
+    """
+    phone = str(phone).strip()
+    phone = phone.split("@", 1)[0]
+    phone = phone.replace("whatsapp:", "")
+    phone = phone.replace("+", "")
+    phone = phone.replace(" ", "")
+    phone = phone.replace("-", "")
+    if len(phone) == 10:
+        phone = "91" + phone
+    return phone
@@ -2,8 +2,9 @@
 
 import os
 from .ai_client import ask_ai
-from dotenv import load_dotenv
-load_dotenv()
+from .log import get_logger
+
+log = get_logger(__name__)
 
 
 # ──────────────────────────────────────────────────────────
@@ -119,7 +120,7 @@ Output ONLY the questions, nothing else."""
         if result and len(result) > 50:
             return result
     except Exception as e:
-        print(f"[WARN] AI question generation failed: {e}")
+        log.warning("AI question generation failed: %s", e)
     return None
 
 
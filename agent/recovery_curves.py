@@ -0,0 +1,374 @@
+# agent/recovery_curves.py
+# Cohort recovery curves: what a typical Day 1..N looks like per surgery
+# type, protocol and parameter, kept as pre-aggregated histograms.
+#
+# A curve is one parameter of one surgery type, either across all
+# protocols (`<surgery>:<parameter>`) or for the protocol a check-in was
+# answered under (`<surgery>@<rules digest>:<parameter>`). It is stored as
+# one document per CURVE_DAYS_PER_DOC follow-up days, `<curve>:<n>`:
+#
+#   knee_replacement:pain:1
+#   {"surgeryType": "Knee replacement", "protocol": null,
+#    "parameter": "Pain", "questionType": "rate",
+#    "days": {"3": {"n": 41, "sum": 98.0, "bins": {"2": 17, "3": 20, "4": 4}}}}
+#
+# Bins are the reading rounded to a step of 5 in its third significant
+# digit (98.6 -> 98.5, 123 -> 125), so a percentile is within 2.5% of the
+# exact one and a decade of readings has at most 180 bins a day: a
+# document stays at a few thousand fields whatever the cohort size.
+# Yes/no answers are stored as 1 (alarming) / 0, making the day's mean the
+# share of alarming answers. A check-in is one batch of Increment
+# transforms over the documents of its parameters and day, so concurrent
+# check-ins never lose counts and land on different documents unless they
+# share surgery type, parameter and week. A curve query is one cached
+# multi-document read plus a sort of its bins. Failed updates are counted
+# in careflow_recovery_curve_failures_total; --backfill, run with the
+# agent stopped, rebuilds every document and deletes stale ones.
+#
+#   CURVE_MAX_DAYS=60             check-ins after this follow-up day are not aggregated
+#   CURVE_DAYS_PER_DOC=7          follow-up days per stored document
+#   CURVE_CACHE_TTL_SECONDS=60    how long a read curve is reused
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import anomaly, metrics
+from .alarm_rules import compile_rules
+from .firebase_client import PatientCache
+from .log import get_logger
+
+log = get_logger(__name__)
+
+COLLECTION = "recovery_curves"
+PERCENTILES = (10, 25, 50, 75, 90)
+MAX_DAYS = int(os.getenv("CURVE_MAX_DAYS", "60"))
+DAYS_PER_DOC = max(1, int(os.getenv("CURVE_DAYS_PER_DOC", "7")))
+
+UPDATE_FAILURES = metrics.counter(
+    "careflow_recovery_curve_failures_total",
+    "Check-ins whose recovery curve increments failed (backfill to repair).",
+)
+
+curve_cache = PatientCache(maxsize=256, ttl=float(os.getenv("CURVE_CACHE_TTL_SECONDS", "60")))
+
+
+def _slug(text: Any) -> str:
+    return re.sub(r"[^0-9a-z]+", "_", str(text).lower()).strip("_") or "unknown"
+
+
+def curve_key(surgery_type: Any, parameter: Any, protocol: Optional[str] = None) -> str:
+    return _slug(surgery_type) + (f"@{protocol}" if protocol else "") + ":" + _slug(parameter)
+
+
+def curve_id(surgery_type: Any, parameter: Any, day: int, protocol: Optional[str] = None) -> str:
+    """The document holding `day` of a curve."""
+    return f"{curve_key(surgery_type, parameter, protocol)}:{(day - 1) // DAYS_PER_DOC + 1}"
+
+
+def curve_ids(surgery_type: Any, parameter: Any, protocol: Optional[str] = None) -> List[str]:
+    return [curve_id(surgery_type, parameter, d, protocol) for d in range(1, MAX_DAYS + 1, DAYS_PER_DOC)]
+
+
+def bin_key(value: float) -> str:
+    """
+    A step of 5 in the third significant digit (0.05 below 10); '.' is not
+    allowed in a Firestore map key, so 98.6 -> '98_5'.
+    """
+    exponent = max(0, math.floor(math.log10(abs(value)))) if value else 0
+    step = 5 * 10.0 ** (exponent - 2)
+    text = f"{round(value / step) * step + 0.0:.{max(0, 2 - exponent)}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text.replace(".", "_")
+
+
+def bin_value(key: str) -> float:
+    return float(key.replace("_", "."))
+
+
+def reading(param: Dict[str, Any], value: Any) -> Optional[float]:
+    """anomaly.reading for rates and measurements; yes/no as 1 (alarming) or 0."""
+    if value is not None and param.get("questionType") == "yesno":
+        return 1.0 if str(value).lower() == str(param.get("alarmingAnswer", "yes")).lower() else 0.0
+    return anomaly.reading(param, value)
+
+
+def checkin_increments(
+    parameters: List[Dict[str, Any]],
+    day: int,
+    ratings: Dict[str, Any],
+) -> Dict[str, Tuple[Dict[Tuple[str, ...], float], Dict[str, Any]]]:
+    """Per parameter name, (counter increments, metadata fields) for one check-in."""
+    updates: Dict[str, Tuple[Dict[Tuple[str, ...], float], Dict[str, Any]]] = {}
+    if not 0 < day <= MAX_DAYS:
+        return updates
+    d = str(day)
+    for param in parameters:
+        x = reading(param, ratings.get(param["name"]))
+        if x is None:
+            continue
+        increments = {("days", d, "n"): 1, ("days", d, "sum"): x, ("days", d, "bins", bin_key(x)): 1}
+        updates[param["name"]] = (increments, {"parameter": param["name"], "questionType": param.get("questionType")})
+    return updates
+
+
+def record_checkin(patient: Dict[str, Any], day: int, ratings: Dict[str, Any]) -> None:
+    """Adds one check-in's readings to the surgery-type and protocol curves."""
+    from .storage import get_storage
+
+    parameters = patient.get("parameters") or []
+    by_param = checkin_increments(parameters, day, ratings)
+    if not by_param:
+        return
+    surgery = patient.get("surgeryType") or "unknown"
+    protocol = compile_rules(parameters).digest
+    updates = {}
+    for name, (increments, meta) in by_param.items():
+        for proto in (None, protocol):
+            fields = {"surgeryType": surgery, "protocol": proto, **meta}
+            updates[curve_id(surgery, name, day, proto)] = (increments, fields)
+    get_storage().increment_aggregates(COLLECTION, updates)
+    for name in by_param:
+        for proto in (None, protocol):
+            curve_cache.invalidate(COLLECTION, curve_key(surgery, name, proto))
+
+
+def record_failure(error: Exception) -> None:
+    """A check-in's curve update failed: count it, never fail the check-in."""
+    UPDATE_FAILURES.inc()
+    log.warning("Recovery curves not updated (run python -m agent.recovery_curves --backfill to repair): %s", error)
+
+
+def percentile(bins: Dict[str, int], q: float) -> Optional[float]:
+    """Nearest-rank q-th percentile (0-100) of a bin map."""
+    items = sorted((bin_value(k), int(c)) for k, c in bins.items() if c)
+    total = sum(c for _, c in items)
+    if not total:
+        return None
+    rank = max(1, -(-q * total // 100))
+    running = 0
+    for value, count in items:
+        running += count
+        if running >= rank:
+            return value
+    return items[-1][0]
+
+
+def percentile_rank(bins: Dict[str, int], value: float) -> Optional[float]:
+    """Share (0-100) of the cohort below `value`, counting ties as half."""
+    total = below = equal = 0
+    target = bin_value(bin_key(value))
+    for key, count in bins.items():
+        v = bin_value(key)
+        total += count
+        if v < target:
+            below += count
+        elif v == target:
+            equal += count
+    return round(100 * (below + equal / 2) / total, 1) if total else None
+
+
+def day_summary(day: Dict[str, Any]) -> Dict[str, Any]:
+    bins = day.get("bins") or {}
+    n = int(day.get("n", 0))
+    summary: Dict[str, Any] = {"n": n, "mean": round(day.get("sum", 0) / n, 3) if n else None}
+    for q in PERCENTILES:
+        summary[f"p{q}"] = percentile(bins, q)
+    return summary
+
+
+def load_curve(
+    surgery_type: str,
+    parameter: str,
+    protocol: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """A curve's stored documents merged into {"parameter", "questionType", "days"}."""
+    from .storage import get_storage
+
+    key = curve_key(surgery_type, parameter, protocol)
+    cached = curve_cache.get(COLLECTION, key)
+    if cached is not None:
+        return cached
+    docs = get_storage().get_aggregates(COLLECTION, curve_ids(surgery_type, parameter, protocol))
+    if not docs:
+        return None
+    merged: Dict[str, Any] = {"days": {}}
+    for doc in docs.values():
+        merged["parameter"] = doc.get("parameter")
+        merged["questionType"] = doc.get("questionType")
+        merged["days"].update(doc.get("days") or {})
+    curve_cache.put(COLLECTION, key, merged)
+    return merged
+
+
+def curve(
+    surgery_type: str,
+    parameter: str,
+    protocol: Optional[str] = None,
+    days: Optional[Sequence[int]] = None,
+) -> Dict[str, Any]:
+    """Per-day n, mean and percentiles of a parameter for a surgery type (and protocol)."""
+    entry = load_curve(surgery_type, parameter, protocol) or {}
+    stored = entry.get("days") or {}
+    wanted = days if days is not None else sorted(int(d) for d in stored)
+    return {
+        "surgeryType": surgery_type,
+        "protocol": protocol,
+        "parameter": entry.get("parameter") or parameter,
+        "questionType": entry.get("questionType"),
+        "days": [{"day": d, **day_summary(stored.get(str(d)) or {})} for d in wanted],
+    }
+
+
+def compare_patient(
+    patient: Dict[str, Any],
+    checkins: Iterable[Dict[str, Any]],
+    parameter: str,
+    protocol: Optional[str] = None,
+    band: Tuple[int, int] = (10, 90),
+) -> Dict[str, Any]:
+    """
+    The patient's readings of `parameter` per day against their surgery
+    cohort: percentile rank and whether the reading is outside the band.
+    """
+    surgery = patient.get("surgeryType") or "unknown"
+    param = next((p for p in patient.get("parameters") or [] if p.get("name") == parameter), None)
+    if param is None:
+        raise ValueError(f"patient has no parameter '{parameter}'")
+    stored = (load_curve(surgery, parameter, protocol) or {}).get("days") or {}
+    low_q, high_q = band
+    points = []
+    for checkin in checkins:
+        day = checkin.get("dayNumber")
+        x = reading(param, (checkin.get("ratings") or {}).get(parameter))
+        if day is None or x is None:
+            continue
+        bins = (stored.get(str(day)) or {}).get("bins") or {}
+        low, high = percentile(bins, low_q), percentile(bins, high_q)
+        points.append({
+            "day": day,
+            "value": x,
+            "cohort_n": sum(bins.values()),
+            f"p{low_q}": low,
+            "p50": percentile(bins, 50),
+            f"p{high_q}": high,
+            "percentile_rank": percentile_rank(bins, x),
+            "outside_band": None if low is None else (x < low or x > high),
+        })
+    return {"surgeryType": surgery, "protocol": protocol, "parameter": parameter, "points": points}
+
+
+def _utc_day(checkin: Dict[str, Any]) -> str:
+    from .export import to_utc
+
+    stamp = to_utc(checkin.get("timestamp"))
+    return stamp.date().isoformat() if stamp else ""
+
+
+def _dedupe_daily(checkins: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Drops repeated ids from check-ins ordered by UTC day, holding one day's ids at a time."""
+    day, seen = None, set()
+    for checkin in checkins:
+        if _utc_day(checkin) != day:
+            day, seen = _utc_day(checkin), set()
+        if checkin.get("id") in seen:
+            continue
+        seen.add(checkin.get("id"))
+        yield checkin
+
+
+def backfill(page_size: int = 500, archive_dir: Optional[str] = None) -> int:
+    """
+    Rebuilds every curve from all check-ins, hot and archived: the
+    checkin_responses collection and its archive collection, plus the files
+    `archive --out` wrote to `archive_dir` (default ARCHIVE_OUT). Replaces
+    the stored documents and deletes those no check-in maps to any more;
+    returns check-ins used.
+
+    Run it with the agent stopped: a check-in recorded while it runs is
+    overwritten by the rebuilt documents (the same caveat as
+    dashboard.rebuild()).
+    """
+    from .archive import ARCHIVES, iter_archived_files
+    from .storage import add_increments, get_storage
+
+    storage = get_storage()
+    archive_dir = archive_dir if archive_dir is not None else os.getenv("ARCHIVE_OUT") or None
+    hot = storage.iter_by_timestamp("checkin_responses", page_size=page_size)
+    if archive_dir:
+        # A check-in written to a file can still be hot (a crash before its
+        # batch was deleted) or be in two files, always under its own UTC
+        # date: merged by day, one day's ids are enough to drop the copies.
+        # The archive collection never overlaps either (moves are atomic).
+        hot = _dedupe_daily(heapq.merge(hot, iter_archived_files(archive_dir, "checkin_responses"), key=_utc_day))
+    checkins = itertools.chain(hot, storage.iter_archive(ARCHIVES["checkin_responses"], page_size=page_size))
+
+    # Only what the curves need per patient: surgery type, parameters and protocol
+    patients: Dict[str, Optional[Tuple[str, List[Dict[str, Any]], str]]] = {}
+    docs: Dict[str, Dict[str, Any]] = {}
+    used = 0
+    for checkin in checkins:
+        doc_id = checkin.get("patientDocId")
+        if doc_id not in patients:
+            patient = storage.get_followup(doc_id) if doc_id else None
+            if patient is None and doc_id:
+                patient = storage.get_archived(ARCHIVES["followup_patients"], doc_id)
+            parameters = (patient or {}).get("parameters") or []
+            patients[doc_id] = (
+                (patient.get("surgeryType") or "unknown", parameters, compile_rules(parameters).digest)
+                if patient else None
+            )
+        if patients[doc_id] is None or checkin.get("dayNumber") is None:
+            continue
+        surgery, parameters, protocol = patients[doc_id]
+        day = int(checkin["dayNumber"])
+        by_param = checkin_increments(parameters, day, checkin.get("ratings") or {})
+        if not by_param:
+            continue
+        used += 1
+        for name, (increments, meta) in by_param.items():
+            for proto in (None, protocol):
+                doc = docs.setdefault(curve_id(surgery, name, day, proto), {"surgeryType": surgery, "protocol": proto, "days": {}})
+                doc.update(meta)
+                add_increments(doc, increments)
+    stale = sorted(set(storage.list_aggregates(COLLECTION)) - set(docs))
+    for doc_id, doc in docs.items():
+        storage.set_aggregate(COLLECTION, doc_id, doc)
+    storage.delete_aggregates(COLLECTION, stale)
+    curve_cache.clear()
+    log.info("Rebuilt %d recovery curve documents from %d check-ins; deleted %d stale ones",
+             len(docs), used, len(stale))
+    return used
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CareFlow recovery curves")
+    parser.add_argument("--backfill", action="store_true",
+                        help="rebuild all curves from every check-in, archived too (stop the agent first)")
+    parser.add_argument("--archive-dir", help="also read check-ins archive --out wrote here (default ARCHIVE_OUT)")
+    parser.add_argument("--surgery-type")
+    parser.add_argument("--parameter")
+    parser.add_argument("--protocol")
+    args = parser.parse_args(argv)
+
+    if args.backfill:
+        try:
+            print(json.dumps({"checkins": backfill(archive_dir=args.archive_dir)}))
+        except RuntimeError as e:
+            parser.error(str(e))
+    if args.surgery_type and args.parameter:
+        print(json.dumps(curve(args.surgery_type, args.parameter, args.protocol), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
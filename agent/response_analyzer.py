@@ -1,9 +1,16 @@
 import os
 import json
 from .ai_client import ask_ai
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+from .alarm_rules import compile_rules
+from .anomaly import describe as describe_anomalies, detect as detect_anomalies
+from .timeseries import trend_signals, update_series
 from . import alerts
 from . import whatsapp
+from .log import get_logger
+from .tracing import span
+
+log = get_logger(__name__)
 
 def parse_q1_answer(raw_reply: str) -> str:
     """
@@ -68,40 +75,14 @@ def parse_parameter_replies(raw_reply: str, parameters: List[Dict[str, Any]]) ->
         text = raw.strip().replace("```json", "").replace("```", "")
         return json.loads(text)
     except Exception as e:
-        print(f"❌ Parsing Error: {e}")
+        log.error("Parsing Error: %s", e)
         return {"ratings": {}, "subjective": "Error parsing response"}
 
 def check_alarms(ratings: Dict[str, Any], parameters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Checks parsed values against doctor-defined thresholds.
     """
-    crossed = []
-    for param in parameters:
-        name = param["name"]
-        val = ratings.get(name)
-        if val is None:
-            continue
-        
-        qtype = param["questionType"]
-        if qtype == "rate":
-            try:
-                if float(val) >= float(param.get("alarmingRate", 5)):
-                    crossed.append(param)
-            except: pass
-        elif qtype == "yesno":
-            if str(val).lower() == str(param.get("alarmingAnswer", "yes")).lower():
-                crossed.append(param)
-        elif qtype == "value":
-            try:
-                # Value parsing (handling 120/80 etc)
-                val_str = str(val).split('/')[0] # Check systolic for BP mostly
-                val_num = float(val_str)
-                lo = param.get("alarmingValueMin")
-                hi = param.get("alarmingValueMax")
-                if (lo is not None and val_num < lo) or (hi is not None and val_num > hi):
-                    crossed.append(param)
-            except: pass
-    return crossed
+    return compile_rules(parameters).check(ratings, parameters)
 
 def compute_condition_category(
     q1_answer: str,
@@ -112,26 +93,7 @@ def compute_condition_category(
     Determines overall condition category for the day.
     q1_answer: 'normal' | 'moderate' | 'critical'
     """
-    critical_keywords = [
-        "chest", "heart", "cardiac", "pulse", "bp",
-        "blood pressure", "breathing", "oxygen"
-    ]
-
-    crossed_count = len(crossed_params)
-    has_critical_param = any(
-        any(kw in c["name"].lower() for kw in critical_keywords)
-        for c in crossed_params
-    )
-
-    # Priority 1: Self-reported Critical or Severe Alarms
-    if q1_answer == "critical" or crossed_count >= 2 or has_critical_param:
-        return "critical"
-    
-    # Priority 2: Self-reported Moderate or Single Alarm
-    if q1_answer == "moderate" or crossed_count == 1:
-        return "note"
-    
-    return "normal"
+    return compile_rules(parameters).category(q1_answer, crossed_params)
 
 def compute_status_per_parameter(
     parameters: List[Dict[str, Any]],
@@ -141,71 +103,15 @@ def compute_status_per_parameter(
     """
     Computes improving/stable/deteriorating for EACH parameter.
     """
-    status = {}
-
-    for param in parameters:
-        name = param["name"]
-        qtype = param["questionType"]
-        today = today_ratings.get(name)
-        yesterday = yesterday_ratings.get(name)
-
-        if today is None or yesterday is None:
-            status[name] = "stable"
-            continue
-
-        if qtype == "rate":
-            try:
-                if float(today) < float(yesterday): status[name] = "improving"
-                elif float(today) > float(yesterday): status[name] = "deteriorating"
-                else: status[name] = "stable"
-            except: status[name] = "stable"
-
-        elif qtype == "yesno":
-            alarming = str(param.get("alarmingAnswer", "yes")).lower()
-            today_str = str(today).lower()
-            yesterday_str = str(yesterday).lower()
-
-            if today_str == alarming and yesterday_str != alarming:
-                status[name] = "deteriorating"
-            elif today_str != alarming and yesterday_str == alarming:
-                status[name] = "improving"
-            else:
-                status[name] = "stable"
-
-        elif qtype == "value":
-            try:
-                # Basic float comparison for values
-                today_val = float(str(today).split('/')[0])
-                yesterday_val = float(str(yesterday).split('/')[0])
-                
-                lo = param.get("alarmingValueMin")
-                hi = param.get("alarmingValueMax")
-
-                if lo is not None and hi is not None:
-                    # Target center of range
-                    target = (lo + hi) / 2
-                    if abs(today_val - target) < abs(yesterday_val - target):
-                        status[name] = "improving"
-                    elif abs(today_val - target) > abs(yesterday_val - target):
-                        status[name] = "deteriorating"
-                    else:
-                        status[name] = "stable"
-                else:
-                    if today_val < yesterday_val: status[name] = "improving"
-                    elif today_val > yesterday_val: status[name] = "deteriorating"
-                    else: status[name] = "stable"
-            except: status[name] = "stable"
-
-    return status
-
-    return status
+    return compile_rules(parameters).status(today_ratings, yesterday_ratings)
 
 def analyze_patient_response(
     patient: Dict[str, Any],
     day_number: int,
     ratings: Dict[str, Any],
     subjective: str,
-    crossed_params: List[Dict[str, Any]]
+    crossed_params: List[Dict[str, Any]],
+    anomalies: Optional[List[Dict[str, Any]]] = None
 ) -> Dict[str, Any]:
     """
     Uses the AI Client to generate clinical summary and patient reply.
@@ -219,6 +125,7 @@ def analyze_patient_response(
     Ratings: {json.dumps(ratings)}
     Subjective: "{subjective}"
     Alarms Triggered: {[p['name'] for p in crossed_params]}
+    Unusual For This Patient: {describe_anomalies(anomalies or []) or "none"}
     
     Return a JSON object:
     {{
@@ -246,40 +153,43 @@ def run_full_analysis_pipeline(
     """Master pipeline — now includes both criteria and two-step flow"""
 
     # 1. Parse ratings from Step 2 reply
-    parsed_result = parse_parameter_replies(raw_reply, patient.get("parameters", []))
+    with span("analysis.parse_replies"):
+        parsed_result = parse_parameter_replies(raw_reply, patient.get("parameters", []))
     today_ratings = parsed_result.get("ratings", {})
     subjective = parsed_result.get("subjective", "")
 
-    # 2. Check alarms
-    crossed = check_alarms(today_ratings, patient.get("parameters", []))
-
-    # 3. Compute condition category (overall day)
-    condition_category = compute_condition_category(
-        q1_answer, crossed, patient.get("parameters", [])
-    )
-
-    # 4. Compute status per parameter (vs yesterday)
-    yesterday_ratings = patient.get("lastRatings", {})
-    status_per_param = compute_status_per_parameter(
-        patient.get("parameters", []),
-        today_ratings,
-        yesterday_ratings
-    )
+    with span("analysis.rules"):
+        # 2-4. Alarms, condition category (overall day), status per
+        # parameter (vs yesterday) from the protocol's compiled rules
+        parameters = patient.get("parameters", [])
+        crossed, condition_category, status_per_param = compile_rules(parameters).evaluate(
+            parameters, q1_answer, today_ratings, patient.get("lastRatings", {})
+        )
+        # Multi-day trend from the series stored on the patient document
+        trend_series, series = update_series(patient.get("trendSeries"), parameters, today_ratings, day_number)
+        # Readings unusual against the patient's own running statistics
+        rating_stats, anomalies = detect_anomalies(patient.get("ratingStats"), parameters, today_ratings, day_number)
 
     # 5. Gemini full analysis for clinician summary and patient empathetic reply
-    analysis = analyze_patient_response(
-        patient=patient,
-        day_number=day_number,
-        ratings=today_ratings,
-        subjective=subjective,
-        crossed_params=crossed
-    )
+    with span("analysis.llm"):
+        analysis = analyze_patient_response(
+            patient=patient,
+            day_number=day_number,
+            ratings=today_ratings,
+            subjective=subjective,
+            crossed_params=crossed,
+            anomalies=anomalies
+        )
 
     # Attach both criteria to analysis result
     analysis["ratings"] = today_ratings
     analysis["subjective"] = subjective
     analysis["crossed_parameters"] = crossed
+    analysis["anomalous_parameters"] = anomalies
+    analysis["rating_stats"] = rating_stats
     analysis["condition_category"] = condition_category
     analysis["status_per_parameter"] = status_per_param
+    analysis["trend_series"] = trend_series
+    analysis["trend_signals"] = trend_signals(series)
 
     return analysis
@@ -2,48 +2,69 @@ from __future__ import annotations
 
 import os
 from datetime import datetime
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI
 
 from . import firebase_client
 from . import whatsapp
+from .log import get_logger
+from .metrics import DAILY_CHECKIN_PATIENTS, DAILY_CHECKIN_SECONDS
+from .storage import SERVER_TIMESTAMP
+
+if TYPE_CHECKING:
+    from apscheduler.schedulers.background import BackgroundScheduler
 
 _scheduler: BackgroundScheduler | None = None
 
+log = get_logger(__name__)
 
-import pytz
 from .question_generator import generate_standard_q1
 
+# Only the fields the daily trigger reads — keeps parameters/replies off the wire.
+# Patients arrive as compact models.FollowupPatient records.
+CHECKIN_FIELDS = ("patientName", "patientPhone", "doctorName", "currentDay", "followupDays")
+
 def run_daily_checkins() -> None:
     """
     Main job: Sends Q1 to all active follow-up patients at 9 AM IST.
     """
-    print("🚀 Running daily check-in trigger...")
-    db = firebase_client.get_firestore()
-    active_patients = firebase_client.get_active_followup_patients(db)
+    with DAILY_CHECKIN_SECONDS.time():
+        _run_daily_checkins()
+
+
+def _run_daily_checkins() -> None:
+    log.info("Running daily check-in trigger...")
+    page_size = int(os.getenv("CHECKIN_PAGE_SIZE", "200"))
+    active_patients = firebase_client.iter_followup_records(
+        page_size=page_size, fields=CHECKIN_FIELDS,
+    )
 
     for patient in active_patients:
-        p_doc_id = patient['id']
-        current_day = patient.get("currentDay", 0) + 1
-        total_days = patient.get("followupDays", 7)
-        phone = patient.get("patientPhone") # Use patientPhone as per spec
+        p_doc_id = patient.id
+        current_day = (patient.current_day or 0) + 1
+        total_days = patient.followup_days if patient.followup_days is not None else 7
+        phone = patient.patient_phone # Use patientPhone as per spec
 
         if not phone:
-            print("[WARN] No phone for patient " + patient.get('patientName', p_doc_id))
+            log.warning("No phone for patient %s", patient.patient_name or p_doc_id)
+            DAILY_CHECKIN_PATIENTS.inc(outcome="no_phone")
             continue
 
         # 1. Check if program is over
         if current_day > total_days:
-            firebase_client.update_followup_patient(p_doc_id, {"status": "completed"})
-            print(f"[OK] Follow-up completed for {patient.get('patientName')}")
+            firebase_client.update_followup_patient(p_doc_id, {
+                "status": "completed",
+                "completedAt": SERVER_TIMESTAMP,
+            })
+            log.info("Follow-up completed for %s", patient.patient_name)
+            DAILY_CHECKIN_PATIENTS.inc(outcome="completed")
             continue
 
         # 2. Reset state and send Q1
         q1_msg = generate_standard_q1(
-            patient.get("patientName", "Patient"),
-            patient.get("doctorName", "Mehta"),
+            patient.patient_name or "Patient",
+            patient.doctor_name or "Mehta",
             current_day,
             total_days
         )
@@ -57,13 +78,34 @@ def run_daily_checkins() -> None:
                 "conversationState": "awaiting_q1",
                 "notificationSent": True
             })
-            print(f"[OK] Sent Day {current_day} Q1 to {patient.get('patientName')}")
+            log.info("Sent Day %s Q1 to %s", current_day, patient.patient_name)
+            DAILY_CHECKIN_PATIENTS.inc(outcome="sent")
+        else:
+            DAILY_CHECKIN_PATIENTS.inc(outcome="send_failed")
 
 def start_scheduler(app: FastAPI) -> None:
+    """
+    Registers the scheduler with the app. APScheduler and pytz are imported
+    and the jobs started on the startup event, not at import/create_app time.
+    """
+    @app.on_event("startup")
+    async def _start_scheduler() -> None:
+        _start()
+
+    @app.on_event("shutdown")
+    async def _shutdown_scheduler() -> None:
+        if _scheduler is not None and _scheduler.running:
+            _scheduler.shutdown(wait=False)
+
+
+def _start() -> None:
     global _scheduler
     if _scheduler is not None:
         return
 
+    import pytz
+    from apscheduler.schedulers.background import BackgroundScheduler
+
     # IST timezone for 9AM trigger
     ist = pytz.timezone("Asia/Kolkata")
     
@@ -87,18 +129,21 @@ def start_scheduler(app: FastAPI) -> None:
         id="daily_checkin_flow"
     )
 
+    # 3. Nightly hot/cold archival at 03:00 IST (opt-in, see archive.py)
+    if os.getenv("ARCHIVE_NIGHTLY", "false").lower() == "true":
+        from .archive import run_archive
+
+        scheduler.add_job(run_archive, "cron", hour=3, minute=0, id="nightly_archive")
+
     scheduler.start()
     _scheduler = scheduler
-    print("[OK] Scheduler started: 9 AM IST Daily Check-ins enabled.")
-
-    @app.on_event("shutdown")
-    async def _shutdown_scheduler() -> None:
-        if scheduler.running:
-            scheduler.shutdown(wait=False)
+    log.info("Scheduler started: 9 AM IST Daily Check-ins enabled.")
 
 def get_scheduler() -> BackgroundScheduler:
     global _scheduler
     if _scheduler is None:
+        from apscheduler.schedulers.background import BackgroundScheduler
+
         # Fallback if start_scheduler wasn't called (e.g. testing)
         _scheduler = BackgroundScheduler()
         _scheduler.start()
@@ -0,0 +1,1351 @@
+from __future__ import annotations
+
+import datetime
+import functools
+from abc import ABC, abstractmethod
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import dashboard
+from .metrics import STORAGE_SECONDS
+from .tracing import span
+
+_storage: Optional["StorageBackend"] = None
+_storage_lock = threading.Lock()
+
+# Max values per Firestore `in` filter
+FIRESTORE_IN_LIMIT = 30
+# Documents per batch when each needs two writes (batches hold 500)
+FIRESTORE_BATCH_DOCS = 250
+
+# Append-only collections that can be paged by `timestamp` (iter_by_timestamp)
+TIMESTAMPED_COLLECTIONS = ("checkin_responses", "critical_alerts")
+
+# (field, operator, value) filters of count() / query(), all ANDed
+Filter = Tuple[str, str, Any]
+FILTER_OPS = ("==", "<", "<=", ">", ">=")
+
+
+class _ServerTimestamp:
+    """
+    Backend-neutral "set to the server's time on write" marker. Lets callers
+    build documents without importing the Firestore SDK; FirestoreStorage
+    swaps it for firestore.SERVER_TIMESTAMP and SQLiteStorage for the
+    local UTC time.
+    """
+
+    def __repr__(self) -> str:
+        return "SERVER_TIMESTAMP"
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+def to_firestore(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Replaces SERVER_TIMESTAMP markers with the Firestore sentinel."""
+    if not any(value is SERVER_TIMESTAMP for value in data.values()):
+        return data
+    from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP as FIRESTORE_TS
+    return {k: (FIRESTORE_TS if v is SERVER_TIMESTAMP else v) for k, v in data.items()}
+
+
+# Aggregate counter documents: (path, ...) -> amount to add
+Increments = Dict[Sequence[str], float]
+
+
+def nest(flat: Dict[Sequence[str], Any], leaf: Callable[[Any], Any] = lambda v: v) -> Dict[str, Any]:
+    """{("a", "b"): 1} -> {"a": {"b": leaf(1)}}."""
+    nested: Dict[str, Any] = {}
+    for path, value in flat.items():
+        node = nested
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = leaf(value)
+    return nested
+
+
+def add_increments(doc: Dict[str, Any], increments: Increments) -> Dict[str, Any]:
+    """Applies `increments` to a plain nested dict in place."""
+    for path, amount in increments.items():
+        node = doc
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = node.get(path[-1], 0) + amount
+    return doc
+
+
+def _merge(doc: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep-merges nested `fields` into `doc` in place (like Firestore's set merge)."""
+    for key, value in fields.items():
+        if isinstance(value, dict):
+            # Copied, so later increments on `doc` never write into `fields`
+            if not isinstance(doc.get(key), dict):
+                doc[key] = {}
+            _merge(doc[key], value)
+        else:
+            doc[key] = value
+    return doc
+
+
+def chunked(items: Sequence[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield list(items[i:i + size])
+
+
+def _time_key(value: Any) -> str:
+    if value is None:
+        return ""
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _created_at_key(action: Dict[str, Any]) -> Any:
+    return _time_key(action.get("createdAt"))
+
+
+def group_actions(
+    actions: Iterable[Dict[str, Any]],
+    patient_ids: Sequence[str],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Groups action docs by patientId, each list sorted by createdAt."""
+    grouped: Dict[str, List[Dict[str, Any]]] = {pid: [] for pid in patient_ids}
+    for action in actions:
+        pid = action.get("patientId")
+        if pid in grouped:
+            grouped[pid].append(action)
+    for items in grouped.values():
+        items.sort(key=_created_at_key)
+    return grouped
+
+
+# Single-round-trip operations timed into careflow_storage_op_seconds.
+# iter_active_followups is a generator and times each page fetch itself.
+_TIMED_OPS = (
+    "get_patient", "update_patient", "get_patient_actions", "get_actions_for_patients",
+    "get_admitted_patients", "get_followup", "set_followup", "update_followup",
+    "find_active_followup_by_phone", "add_checkin", "update_checkin", "add_alert",
+    "resolve_alert", "add_patient_response", "get_dashboard_stats", "set_dashboard_stats",
+    "get_checkins_for_patient", "get_aggregate", "get_aggregates", "set_aggregate", "increment_aggregates",
+    "list_aggregates", "delete_aggregates",
+    "count", "query", "move_documents", "get_archived", "get_archived_for_patient", "delete_documents",
+)
+
+
+def _timed_op(op: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with STORAGE_SECONDS.time(backend=self.name, op=op), span(f"storage.{op}"):
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+class StorageBackend(ABC):
+    """
+    The storage operations the agent actually uses.
+
+    `firebase_client` and `firebase_async` route every read/write through the
+    configured backend (see get_storage()), so the full webhook flow can run
+    against Firestore in production or an embedded SQLite file offline.
+    Subclasses get their operations timed automatically and must implement
+    every operation: an incomplete backend fails when it is instantiated.
+    """
+
+    name = "base"
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        for op in _TIMED_OPS:
+            fn = cls.__dict__.get(op)
+            if fn is not None:
+                setattr(cls, op, _timed_op(op, fn))
+
+    # ── patients ─────────────────────────────────────────
+    @abstractmethod
+    def get_patient(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_patient(self, patient_id: str, update: Dict[str, Any], merge: bool = True) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_patient_actions(self, patient_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_actions_for_patients(self, patient_ids: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_admitted_patients(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # ── followup_patients ────────────────────────────────
+    @abstractmethod
+    def get_followup(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_active_followups(
+        self,
+        page_size: int = 200,
+        select: Optional[Sequence[str]] = None,
+        factory: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+    ) -> Iterator[Any]:
+        """
+        Active follow-ups a page at a time, as dicts with their "id" or, with
+        `factory`, as factory(doc_id, data) built without that extra copy.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_active_followup_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # ── append-only logs ─────────────────────────────────
+    @abstractmethod
+    def add_checkin(self, data: Dict[str, Any], checkin_id: Optional[str] = None) -> str:
+        """
+        Stores a check-in record and returns its id. Given `checkin_id`, a
+        repeated call replaces the same record, so a retried step is idempotent.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_checkin(self, checkin_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_alert(self, data: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def resolve_alert(self, alert_id: str) -> bool:
+        """Marks an alert resolved; False if it does not exist or already was."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_unresolved_alerts(self, select: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_patient_response(self, data: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_by_timestamp(
+        self,
+        collection: str,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        page_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Documents of one of TIMESTAMPED_COLLECTIONS with since <= timestamp
+        < until, oldest first, fetched a page at a time. Each has its "id".
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def move_documents(self, collection: str, docs: Sequence[Dict[str, Any]], archive: str) -> None:
+        """
+        Writes each document (without its "id") into `archive` under the same
+        id and deletes it from `collection`, in atomic batches.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_archived(self, archive: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """A document moved into `archive` by move_documents."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_archive(self, archive: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Every document of `archive` in id order, fetched a page at a time. Each has its "id"."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_archived_for_patient(self, archive: str, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """The patient's most recent documents in `archive` (by patientDocId), oldest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_documents(self, collection: str, doc_ids: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, collection: str, filters: Sequence[Filter] = ()) -> int:
+        """Number of documents matching `filters`, counted server-side."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(
+        self,
+        collection: str,
+        filters: Sequence[Filter] = (),
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        limit: int = 20,
+        after: Optional[str] = None,
+        select: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        One page of documents matching `filters`, sorted by `order_by` (then
+        id). `after` is the id of the last document of the previous page.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_checkins_for_patient(self, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """The patient's most recent check-in records, oldest first."""
+        raise NotImplementedError
+
+    # ── aggregate documents (recovery_curves, ...) ───────
+    @abstractmethod
+    def get_aggregate(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_aggregates(self, collection: str, doc_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """The existing documents among `doc_ids`, by id, in one round trip."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_aggregate(self, collection: str, doc_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_aggregates(self, collection: str) -> List[str]:
+        """The ids of every document in `collection`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_aggregates(self, collection: str, doc_ids: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def increment_aggregates(
+        self,
+        collection: str,
+        updates: Dict[str, Tuple[Increments, Dict[str, Any]]],
+    ) -> None:
+        """
+        For each doc id, adds the increments to nested counters and merges
+        the plain fields; all documents in one atomic write.
+        """
+        raise NotImplementedError
+
+    # ── dashboard_stats (see dashboard.py) ───────────────
+    # set_followup / update_followup / add_alert / resolve_alert apply the
+    # counter deltas of each write; get / set work on a whole stats
+    # document, whatever shards it is stored as.
+    @abstractmethod
+    def get_dashboard_stats(self, scope: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_dashboard_stats(self, scope: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_dashboard_stats(self) -> List[str]:
+        raise NotImplementedError
+
+
+# ─────────────────────────────────────────────
+# FIRESTORE
+# ─────────────────────────────────────────────
+# Queries and transaction writes shared with firebase_async: the sync
+# Client and the AsyncClient build them the same way, only the fetch and
+# commit (awaited or not) differ.
+def firestore_doc(snapshot, id_field: str = "id") -> Optional[Dict[str, Any]]:
+    """The snapshot's data with its id under `id_field`; None if it does not exist."""
+    if not snapshot.exists:
+        return None
+    return {**(snapshot.to_dict() or {}), id_field: snapshot.id}
+
+
+def patient_actions_query(client, patient_id: str):
+    from firebase_admin import firestore
+
+    return client.collection("actions")\
+                 .where("patientId", "==", patient_id)\
+                 .order_by("createdAt", direction=firestore.Query.ASCENDING)
+
+
+def actions_for_patients_queries(client, ids: Sequence[str]) -> List[Any]:
+    """One `in` query per FIRESTORE_IN_LIMIT distinct ids; group the results with group_actions()."""
+    return [client.collection("actions").where("patientId", "in", chunk) for chunk in chunked(ids, FIRESTORE_IN_LIMIT)]
+
+
+def active_followups_query(client, select: Optional[Sequence[str]] = None):
+    """Active followup_patients in document id order, for paging with start_after()."""
+    from firebase_admin import firestore
+
+    query = client.collection("followup_patients")\
+                  .where("status", "==", "active")\
+                  .order_by(firestore.FieldPath.document_id())
+    return query.select(list(select)) if select else query
+
+
+def active_followup_by_phone_query(client, phone: str):
+    return client.collection("followup_patients")\
+                 .where("patientPhone", "==", phone)\
+                 .where("status", "==", "active")\
+                 .limit(1)
+
+
+def stage_followup_write(client, transaction, ref, before: Optional[Dict[str, Any]], data: Dict[str, Any],
+                         replace: bool) -> None:
+    """
+    Stages a followup write and its dashboard counter Increments in
+    `transaction`. `before` must have been read inside the same
+    transaction, so the counters move with exactly this transition (the
+    Increments are blind writes to a random shard; see dashboard.py).
+    """
+    if replace:
+        transaction.set(ref, to_firestore(data))
+    else:
+        transaction.update(ref, to_firestore(data))
+    dashboard.stage_firestore_writes(client, transaction, dashboard.followup_deltas(before, data, replace=replace))
+
+
+def stage_alert(client, writer, data: Dict[str, Any]):
+    """Stages a new critical_alerts doc and its counter Increments in a batch; returns its ref."""
+    ref = client.collection("critical_alerts").document()
+    writer.set(ref, to_firestore(data))
+    dashboard.stage_firestore_writes(client, writer, dashboard.alert_deltas(data))
+    return ref
+
+
+class FirestoreStorage(StorageBackend):
+    name = "firestore"
+
+    def __init__(self, client) -> None:
+        from firebase_admin import firestore
+
+        self.client = client
+        self._fs = firestore
+
+    def get_patient(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        return firestore_doc(self.client.collection("patients").document(patient_id).get())
+
+    def update_patient(self, patient_id: str, update: Dict[str, Any], merge: bool = True) -> None:
+        ref = self.client.collection("patients").document(patient_id)
+        update = to_firestore(update)
+        if merge:
+            ref.set(update, merge=True)
+        else:
+            ref.update(update)
+
+    def get_patient_actions(self, patient_id: str) -> List[Dict[str, Any]]:
+        return [doc.to_dict() for doc in patient_actions_query(self.client, patient_id).stream()]
+
+    def get_actions_for_patients(self, patient_ids: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+        ids = list(dict.fromkeys(patient_ids))
+        docs: List[Dict[str, Any]] = []
+        for query in actions_for_patients_queries(self.client, ids):
+            docs.extend(doc.to_dict() or {} for doc in query.stream())
+        return group_actions(docs, ids)
+
+    def get_admitted_patients(self) -> List[Dict[str, Any]]:
+        query = self.client.collection("patients").where("status", "==", "admitted")
+        return [{**(doc.to_dict() or {}), "id": doc.id} for doc in query.stream()]
+
+    def get_followup(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return firestore_doc(self.client.collection("followup_patients").document(doc_id).get(), "doc_id")
+
+    def _stats_ref(self, doc_id: str):
+        return self.client.collection(dashboard.COLLECTION).document(doc_id)
+
+    def _write_followup(self, doc_id: str, data: Dict[str, Any], replace: bool) -> None:
+        ref = self.client.collection("followup_patients").document(doc_id)
+
+        @self._fs.transactional
+        def write(transaction) -> None:
+            snapshot = ref.get(transaction=transaction)
+            before = snapshot.to_dict() if snapshot.exists else None
+            stage_followup_write(self.client, transaction, ref, before, data, replace)
+
+        write(self.client.transaction())
+
+    def set_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        self._write_followup(doc_id, data, replace=True)
+
+    def update_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        if not dashboard.touches(data):
+            self.client.collection("followup_patients").document(doc_id).update(to_firestore(data))
+            return
+        self._write_followup(doc_id, data, replace=False)
+
+    def iter_active_followups(
+        self,
+        page_size: int = 200,
+        select: Optional[Sequence[str]] = None,
+        factory: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+    ) -> Iterator[Any]:
+        query = active_followups_query(self.client, select)
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_active_followups"):
+                docs = list(page.stream())
+            for doc in docs:
+                if factory is not None:
+                    yield factory(doc.id, doc.to_dict() or {})
+                else:
+                    yield {**(doc.to_dict() or {}), "id": doc.id}
+
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def find_active_followup_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        docs = list(active_followup_by_phone_query(self.client, phone).stream())
+        return firestore_doc(docs[0], "doc_id") if docs else None
+
+    def add_checkin(self, data: Dict[str, Any], checkin_id: Optional[str] = None) -> str:
+        ref = self.client.collection("checkin_responses").document(checkin_id)
+        ref.set(to_firestore(data))
+        return ref.id
+
+    def update_checkin(self, checkin_id: str, data: Dict[str, Any]) -> None:
+        self.client.collection("checkin_responses").document(checkin_id).update(to_firestore(data))
+
+    def add_alert(self, data: Dict[str, Any]) -> str:
+        batch = self.client.batch()
+        ref = stage_alert(self.client, batch, data)
+        batch.commit()
+        return ref.id
+
+    def resolve_alert(self, alert_id: str) -> bool:
+        ref = self.client.collection("critical_alerts").document(alert_id)
+
+        @self._fs.transactional
+        def resolve(transaction) -> bool:
+            snapshot = ref.get(transaction=transaction)
+            alert = snapshot.to_dict() if snapshot.exists else None
+            if not alert or alert.get("resolved"):
+                return False
+            transaction.update(ref, to_firestore({"resolved": True, "resolvedAt": SERVER_TIMESTAMP}))
+            dashboard.stage_firestore_writes(self.client, transaction, dashboard.alert_deltas(alert, sign=-1))
+            return True
+
+        return resolve(self.client.transaction())
+
+    def iter_unresolved_alerts(self, select: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+        query = self.client.collection("critical_alerts").where("resolved", "==", False)
+        if select:
+            query = query.select(list(select))
+        for doc in query.stream():
+            yield {**(doc.to_dict() or {}), "id": doc.id}
+
+    def add_patient_response(self, data: Dict[str, Any]) -> str:
+        _, ref = self.client.collection("patient_responses").add(to_firestore(data))
+        return ref.id
+
+    def iter_by_timestamp(
+        self,
+        collection: str,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        page_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        if collection not in TIMESTAMPED_COLLECTIONS:
+            raise ValueError(f"{collection} is not paged by timestamp")
+        query = self.client.collection(collection)
+        if since is not None:
+            query = query.where("timestamp", ">=", since)
+        if until is not None:
+            query = query.where("timestamp", "<", until)
+        query = query.order_by("timestamp").order_by(self._fs.FieldPath.document_id())
+
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_by_timestamp"):
+                docs = list(page.stream())
+            for doc in docs:
+                yield {**(doc.to_dict() or {}), "id": doc.id}
+
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def move_documents(self, collection: str, docs: Sequence[Dict[str, Any]], archive: str) -> None:
+        # A set and a delete per document: 250 documents stay under the 500-write batch limit
+        for chunk in chunked(docs, FIRESTORE_BATCH_DOCS):
+            batch = self.client.batch()
+            for doc in chunk:
+                data = {k: v for k, v in doc.items() if k != "id"}
+                batch.set(self.client.collection(archive).document(doc["id"]), to_firestore(data))
+                batch.delete(self.client.collection(collection).document(doc["id"]))
+            batch.commit()
+
+    def get_archived(self, archive: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = self.client.collection(archive).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_archived_for_patient(self, archive: str, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        # Same shape as get_checkins_for_patient: equality filter, sorted here
+        docs = self.client.collection(archive).where("patientDocId", "==", patient_doc_id).stream()
+        archived = [{**(doc.to_dict() or {}), "id": doc.id} for doc in docs]
+        archived.sort(key=lambda d: _time_key(d.get("timestamp")))
+        return archived[-limit:]
+
+    def iter_archive(self, archive: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        query = self.client.collection(archive).order_by(self._fs.FieldPath.document_id())
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_archive"):
+                docs = list(page.stream())
+            for doc in docs:
+                yield {**(doc.to_dict() or {}), "id": doc.id}
+
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def delete_documents(self, collection: str, doc_ids: Sequence[str]) -> None:
+        for chunk in chunked(doc_ids, 2 * FIRESTORE_BATCH_DOCS):
+            batch = self.client.batch()
+            for doc_id in chunk:
+                batch.delete(self.client.collection(collection).document(doc_id))
+            batch.commit()
+
+    def _filtered(self, collection: str, filters: Sequence[Filter]):
+        query = self.client.collection(collection)
+        for field, op, value in filters:
+            query = query.where(field, op, value)
+        return query
+
+    def count(self, collection: str, filters: Sequence[Filter] = ()) -> int:
+        result = self._filtered(collection, filters).count(alias="n").get()
+        return int(result[0][0].value)
+
+    def query(
+        self,
+        collection: str,
+        filters: Sequence[Filter] = (),
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        limit: int = 20,
+        after: Optional[str] = None,
+        select: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        query = self._filtered(collection, filters)
+        if order_by:
+            direction = self._fs.Query.DESCENDING if descending else self._fs.Query.ASCENDING
+            query = query.order_by(order_by, direction=direction)
+        if select:
+            query = query.select(list(select))
+        if after:
+            cursor = self.client.collection(collection).document(after).get()
+            if cursor.exists:
+                query = query.start_after(cursor)
+        return [{**(doc.to_dict() or {}), "id": doc.id} for doc in query.limit(limit).stream()]
+
+    def get_checkins_for_patient(self, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        # Equality filter only (no composite index); a patient has at most
+        # one check-in per follow-up day, so sorting here is cheap
+        docs = self.client.collection("checkin_responses")\
+                   .where("patientDocId", "==", patient_doc_id).stream()
+        checkins = [{**(doc.to_dict() or {}), "id": doc.id} for doc in docs]
+        checkins.sort(key=lambda c: _time_key(c.get("timestamp")))
+        return checkins[-limit:]
+
+    def get_aggregate(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = self.client.collection(collection).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_aggregates(self, collection: str, doc_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        refs = [self.client.collection(collection).document(doc_id) for doc_id in doc_ids]
+        return {doc.id: doc.to_dict() for doc in self.client.get_all(refs) if doc.exists}
+
+    def set_aggregate(self, collection: str, doc_id: str, data: Dict[str, Any]) -> None:
+        self.client.collection(collection).document(doc_id).set(to_firestore(data))
+
+    def list_aggregates(self, collection: str) -> List[str]:
+        return [ref.id for ref in self.client.collection(collection).list_documents()]
+
+    def delete_aggregates(self, collection: str, doc_ids: Sequence[str]) -> None:
+        for chunk in chunked(doc_ids, 500):
+            batch = self.client.batch()
+            for doc_id in chunk:
+                batch.delete(self.client.collection(collection).document(doc_id))
+            batch.commit()
+
+    def increment_aggregates(
+        self,
+        collection: str,
+        updates: Dict[str, Tuple[Increments, Dict[str, Any]]],
+    ) -> None:
+        batch = self.client.batch()
+        for doc_id, (increments, fields) in updates.items():
+            data = _merge(nest(increments, self._fs.Increment), to_firestore(fields))
+            batch.set(self.client.collection(collection).document(doc_id), data, merge=True)
+        batch.commit()
+
+    def get_dashboard_stats(self, scope: str) -> Optional[Dict[str, Any]]:
+        # The unsharded document is what counters written before sharding left
+        refs = [self._stats_ref(doc_id) for doc_id in (scope, *dashboard.shard_ids(scope))]
+        return dashboard.merge_shards(doc.to_dict() for doc in self.client.get_all(refs) if doc.exists)
+
+    def set_dashboard_stats(self, scope: str, data: Dict[str, Any]) -> None:
+        first, *rest = dashboard.shard_ids(scope)
+        batch = self.client.batch()
+        batch.set(self._stats_ref(first), to_firestore({**data, "updatedAt": SERVER_TIMESTAMP}))
+        for doc_id in (scope, *rest):
+            batch.delete(self._stats_ref(doc_id))
+        batch.commit()
+
+    def list_dashboard_stats(self) -> List[str]:
+        refs = self.client.collection(dashboard.COLLECTION).list_documents()
+        return sorted({dashboard.scope_of(ref.id) for ref in refs})
+
+
+# ─────────────────────────────────────────────
+# SQLITE (offline / load-testing)
+# ─────────────────────────────────────────────
+# Tables count() / query() may read; fields are matched as JSON paths
+_SQLITE_QUERYABLE = (
+    "patients", "followup_patients", "actions", "checkin_responses", "critical_alerts", "patient_responses",
+)
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id         TEXT PRIMARY KEY,
+    status     TEXT,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patients_status ON patients (status);
+
+CREATE TABLE IF NOT EXISTS followup_patients (
+    id            TEXT PRIMARY KEY,
+    status        TEXT,
+    patient_phone TEXT,
+    data          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_followup_phone_status ON followup_patients (patient_phone, status);
+CREATE INDEX IF NOT EXISTS idx_followup_status_id ON followup_patients (status, id);
+
+CREATE TABLE IF NOT EXISTS actions (
+    id          TEXT PRIMARY KEY,
+    patient_id  TEXT,
+    created_at  TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_actions_patient_created ON actions (patient_id, created_at);
+
+CREATE TABLE IF NOT EXISTS checkin_responses (
+    id              TEXT PRIMARY KEY,
+    patient_doc_id  TEXT,
+    timestamp       TEXT,
+    data            TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_checkins_patient_ts ON checkin_responses (patient_doc_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_checkins_ts ON checkin_responses (timestamp);
+
+CREATE TABLE IF NOT EXISTS critical_alerts (
+    id              TEXT PRIMARY KEY,
+    patient_doc_id  TEXT,
+    resolved        INTEGER,
+    timestamp       TEXT,
+    data            TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_patient_ts ON critical_alerts (patient_doc_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_alerts_resolved_ts ON critical_alerts (resolved, timestamp);
+CREATE INDEX IF NOT EXISTS idx_alerts_ts ON critical_alerts (timestamp);
+
+CREATE TABLE IF NOT EXISTS patient_responses (
+    id         TEXT PRIMARY KEY,
+    phone      TEXT,
+    timestamp  TEXT,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_phone_ts ON patient_responses (phone, timestamp);
+
+CREATE TABLE IF NOT EXISTS dashboard_stats (
+    scope  TEXT PRIMARY KEY,
+    data   TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    collection  TEXT NOT NULL,
+    id          TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+
+CREATE TABLE IF NOT EXISTS archive (
+    collection  TEXT NOT NULL,
+    id          TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+CREATE INDEX IF NOT EXISTS idx_archive_patient ON archive (collection, json_extract(data, '$.patientDocId'));
+"""
+
+
+def _server_timestamp_sentinel():
+    # Only recognise Firestore's own sentinel if the SDK is already loaded;
+    # importing it just for this would cost the SQLite backend a second.
+    transforms = sys.modules.get("google.cloud.firestore_v1.transforms")
+    return getattr(transforms, "SERVER_TIMESTAMP", None)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _new_id() -> str:
+    # Same length as Firestore auto-ids
+    return uuid.uuid4().hex[:20]
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Embedded single-file backend. Documents are stored as JSON with the
+    fields the agent filters on (status, phone, patient id, timestamp)
+    lifted into indexed columns. One connection per thread, WAL journal.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "careflow.db") -> None:
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _resolve(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Replaces SERVER_TIMESTAMP markers (ours or Firestore's) with the local time."""
+        firestore_ts = _server_timestamp_sentinel()
+        now = None
+        resolved = {}
+        for key, value in data.items():
+            if value is SERVER_TIMESTAMP or (firestore_ts is not None and value is firestore_ts):
+                now = now or datetime.datetime.now(datetime.timezone.utc)
+                value = now
+            resolved[key] = value
+        return resolved
+
+    @staticmethod
+    def _dump(data: Dict[str, Any]) -> str:
+        return json.dumps(data, default=_json_default)
+
+    @staticmethod
+    def _ts(value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        return _json_default(value) if not isinstance(value, str) else value
+
+    # ── patients ─────────────────────────────────────────
+    def get_patient(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM patients WHERE id = ?", (patient_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        data["id"] = patient_id
+        return data
+
+    def update_patient(self, patient_id: str, update: Dict[str, Any], merge: bool = True) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM patients WHERE id = ?", (patient_id,)).fetchone()
+            if row is None and not merge:
+                raise KeyError(f"patients/{patient_id} does not exist")
+            data = json.loads(row[0]) if row else {}
+            data.update(self._resolve(update))
+            conn.execute(
+                "INSERT OR REPLACE INTO patients (id, status, data) VALUES (?, ?, ?)",
+                (patient_id, data.get("status"), self._dump(data)),
+            )
+
+    def get_patient_actions(self, patient_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT data FROM actions WHERE patient_id = ? ORDER BY created_at ASC",
+            (patient_id,),
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def get_actions_for_patients(self, patient_ids: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+        ids = list(dict.fromkeys(patient_ids))
+        docs: List[Dict[str, Any]] = []
+        # Stay well under SQLITE_MAX_VARIABLE_NUMBER
+        for chunk in chunked(ids, 500):
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn().execute(
+                f"SELECT data FROM actions WHERE patient_id IN ({placeholders})", chunk,
+            ).fetchall()
+            docs.extend(json.loads(r[0]) for r in rows)
+        return group_actions(docs, ids)
+
+    def get_admitted_patients(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, data FROM patients WHERE status = 'admitted'",
+        ).fetchall()
+        return [{**json.loads(data), "id": pid} for pid, data in rows]
+
+    # ── followup_patients ────────────────────────────────
+    def get_followup(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM followup_patients WHERE id = ?", (doc_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        data["doc_id"] = doc_id
+        return data
+
+    def _write_followup(self, conn: sqlite3.Connection, doc_id: str, data: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO followup_patients (id, status, patient_phone, data) "
+            "VALUES (?, ?, ?, ?)",
+            (doc_id, data.get("status"), data.get("patientPhone"), self._dump(data)),
+        )
+
+    def set_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM followup_patients WHERE id = ?", (doc_id,),
+            ).fetchone()
+            data = self._resolve(data)
+            self._write_followup(conn, doc_id, data)
+            before = json.loads(row[0]) if row else None
+            self._apply_stats(conn, dashboard.followup_deltas(before, data, replace=True))
+
+    def update_followup(self, doc_id: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM followup_patients WHERE id = ?", (doc_id,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"followup_patients/{doc_id} does not exist")
+            before = json.loads(row[0])
+            current = {**before, **self._resolve(data)}
+            self._write_followup(conn, doc_id, current)
+            if dashboard.touches(data):
+                self._apply_stats(conn, dashboard.followup_deltas(before, data))
+
+    def iter_active_followups(
+        self,
+        page_size: int = 200,
+        select: Optional[Sequence[str]] = None,
+        factory: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+    ) -> Iterator[Any]:
+        last_id = ""
+        while True:
+            # fetchall() per page: no cursor is held open between yields
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_active_followups"):
+                rows = self._conn().execute(
+                    "SELECT id, data FROM followup_patients "
+                    "WHERE status = 'active' AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, page_size),
+                ).fetchall()
+            for doc_id, raw in rows:
+                data = json.loads(raw)
+                if select:
+                    data = {k: data[k] for k in select if k in data}
+                if factory is not None:
+                    yield factory(doc_id, data)
+                    continue
+                data["id"] = doc_id
+                yield data
+
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def find_active_followup_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, data FROM followup_patients "
+            "WHERE patient_phone = ? AND status = 'active' LIMIT 1",
+            (phone,),
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[1])
+        data["doc_id"] = row[0]
+        return data
+
+    # ── append-only logs ─────────────────────────────────
+    def add_checkin(self, data: Dict[str, Any], checkin_id: Optional[str] = None) -> str:
+        data = self._resolve(data)
+        doc_id = checkin_id or _new_id()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkin_responses (id, patient_doc_id, timestamp, data) "
+                "VALUES (?, ?, ?, ?)",
+                (doc_id, data.get("patientDocId"), self._ts(data.get("timestamp")), self._dump(data)),
+            )
+        return doc_id
+
+    def update_checkin(self, checkin_id: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM checkin_responses WHERE id = ?", (checkin_id,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"checkin_responses/{checkin_id} does not exist")
+            current = json.loads(row[0])
+            current.update(self._resolve(data))
+            conn.execute(
+                "UPDATE checkin_responses SET data = ? WHERE id = ?", (self._dump(current), checkin_id),
+            )
+
+    def add_alert(self, data: Dict[str, Any]) -> str:
+        data = self._resolve(data)
+        doc_id = _new_id()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO critical_alerts (id, patient_doc_id, resolved, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    doc_id,
+                    data.get("patientDocId"),
+                    1 if data.get("resolved") else 0,
+                    self._ts(data.get("timestamp")),
+                    self._dump(data),
+                ),
+            )
+            self._apply_stats(conn, dashboard.alert_deltas(data))
+        return doc_id
+
+    def resolve_alert(self, alert_id: str) -> bool:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM critical_alerts WHERE id = ?", (alert_id,),
+            ).fetchone()
+            alert = json.loads(row[0]) if row else None
+            if not alert or alert.get("resolved"):
+                return False
+            updated = {**alert, **self._resolve({"resolved": True, "resolvedAt": SERVER_TIMESTAMP})}
+            conn.execute(
+                "UPDATE critical_alerts SET resolved = 1, data = ? WHERE id = ?",
+                (self._dump(updated), alert_id),
+            )
+            self._apply_stats(conn, dashboard.alert_deltas(alert, sign=-1))
+        return True
+
+    def iter_unresolved_alerts(self, select: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, data FROM critical_alerts WHERE resolved = 0",
+        ).fetchall()
+        for alert_id, raw in rows:
+            data = json.loads(raw)
+            if select:
+                data = {k: data[k] for k in select if k in data}
+            data["id"] = alert_id
+            yield data
+
+    def add_patient_response(self, data: Dict[str, Any]) -> str:
+        data = self._resolve(data)
+        doc_id = _new_id()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO patient_responses (id, phone, timestamp, data) VALUES (?, ?, ?, ?)",
+                (doc_id, data.get("phone"), self._ts(data.get("timestamp")), self._dump(data)),
+            )
+        return doc_id
+
+    def iter_by_timestamp(
+        self,
+        collection: str,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        page_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        if collection not in TIMESTAMPED_COLLECTIONS:
+            raise ValueError(f"{collection} is not paged by timestamp")
+        # Timestamps are stored as ISO-8601 UTC text, which sorts chronologically
+        low = self._ts(since) or ""
+        high = self._ts(until) or "\uffff"
+        last_ts, last_id = low, ""
+        while True:
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_by_timestamp"):
+                rows = self._conn().execute(
+                    f"SELECT id, timestamp, data FROM {collection} "
+                    "WHERE timestamp >= ? AND timestamp < ? AND (timestamp > ? OR (timestamp = ? AND id > ?)) "
+                    "ORDER BY timestamp, id LIMIT ?",
+                    (low, high, last_ts, last_ts, last_id, page_size),
+                ).fetchall()
+            for doc_id, _, raw in rows:
+                yield {**json.loads(raw), "id": doc_id}
+
+            if len(rows) < page_size:
+                return
+            last_id, last_ts = rows[-1][0], rows[-1][1]
+
+    def move_documents(self, collection: str, docs: Sequence[Dict[str, Any]], archive: str) -> None:
+        if collection not in _SQLITE_QUERYABLE:
+            raise ValueError(f"cannot archive '{collection}'")
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for doc in docs:
+                data = self._resolve({k: v for k, v in doc.items() if k != "id"})
+                conn.execute(
+                    "INSERT OR REPLACE INTO archive (collection, id, data) VALUES (?, ?, ?)",
+                    (archive, doc["id"], self._dump(data)),
+                )
+                conn.execute(f"DELETE FROM {collection} WHERE id = ?", (doc["id"],))
+
+    def get_archived(self, archive: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM archive WHERE collection = ? AND id = ?", (archive, doc_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_archived_for_patient(self, archive: str, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, data FROM archive WHERE collection = ? AND json_extract(data, '$.patientDocId') = ?",
+            (archive, patient_doc_id),
+        ).fetchall()
+        archived = [{**json.loads(raw), "id": doc_id} for doc_id, raw in rows]
+        archived.sort(key=lambda d: _time_key(d.get("timestamp")))
+        return archived[-limit:]
+
+    def iter_archive(self, archive: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        last_id = ""
+        while True:
+            with STORAGE_SECONDS.time(backend=self.name, op="iter_archive"):
+                rows = self._conn().execute(
+                    "SELECT id, data FROM archive WHERE collection = ? AND id > ? ORDER BY id LIMIT ?",
+                    (archive, last_id, page_size),
+                ).fetchall()
+            for doc_id, raw in rows:
+                yield {**json.loads(raw), "id": doc_id}
+
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def delete_documents(self, collection: str, doc_ids: Sequence[str]) -> None:
+        if collection not in _SQLITE_QUERYABLE:
+            raise ValueError(f"cannot delete from '{collection}'")
+        conn = self._conn()
+        with conn:
+            conn.executemany(f"DELETE FROM {collection} WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def _where(self, collection: str, filters: Sequence[Filter]) -> Tuple[List[str], List[Any]]:
+        if collection not in _SQLITE_QUERYABLE:
+            raise ValueError(f"cannot query '{collection}'")
+        clauses, params = [], []
+        for field, op, value in filters:
+            if op not in FILTER_OPS or not _FIELD_NAME.match(field):
+                raise ValueError(f"unsupported filter {field!r} {op!r}")
+            clauses.append(f"json_extract(data, '$.{field}') {'=' if op == '==' else op} ?")
+            params.append(self._ts(value) if isinstance(value, (datetime.datetime, datetime.date)) else value)
+        return clauses, params
+
+    def count(self, collection: str, filters: Sequence[Filter] = ()) -> int:
+        clauses, params = self._where(collection, filters)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return int(self._conn().execute(f"SELECT COUNT(*) FROM {collection}{where}", params).fetchone()[0])
+
+    def query(
+        self,
+        collection: str,
+        filters: Sequence[Filter] = (),
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        limit: int = 20,
+        after: Optional[str] = None,
+        select: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        clauses, params = self._where(collection, filters)
+        if order_by and not _FIELD_NAME.match(order_by):
+            raise ValueError(f"unsupported order_by {order_by!r}")
+        key = f"json_extract(data, '$.{order_by}')" if order_by else "id"
+        direction, beyond = ("DESC", "<") if descending else ("ASC", ">")
+        conn = self._conn()
+        if after:
+            # keyset cursor: rows sorting after (sort value, id) of `after`
+            row = conn.execute(f"SELECT {key} FROM {collection} WHERE id = ?", (after,)).fetchone()
+            if row is not None:
+                clauses.append(f"({key} {beyond} ? OR ({key} = ? AND id {beyond} ?))")
+                params += [row[0], row[0], after]
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(
+            f"SELECT id, data FROM {collection}{where} ORDER BY {key} {direction}, id {direction} LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        docs = []
+        for doc_id, raw in rows:
+            data = json.loads(raw)
+            if select:
+                data = {k: data[k] for k in select if k in data}
+            data["id"] = doc_id
+            docs.append(data)
+        return docs
+
+    def get_checkins_for_patient(self, patient_doc_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, data FROM checkin_responses WHERE patient_doc_id = ? "
+            "ORDER BY timestamp DESC LIMIT ?",
+            (patient_doc_id, limit),
+        ).fetchall()
+        return [{**json.loads(raw), "id": doc_id} for doc_id, raw in reversed(rows)]
+
+    # ── aggregates ───────────────────────────────────────
+    def get_aggregate(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM aggregates WHERE collection = ? AND id = ?", (collection, doc_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_aggregates(self, collection: str, doc_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        if not doc_ids:
+            return {}
+        rows = self._conn().execute(
+            f"SELECT id, data FROM aggregates WHERE collection = ? AND id IN ({', '.join('?' * len(doc_ids))})",
+            (collection, *doc_ids),
+        ).fetchall()
+        return {doc_id: json.loads(raw) for doc_id, raw in rows}
+
+    def set_aggregate(self, collection: str, doc_id: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO aggregates (collection, id, data) VALUES (?, ?, ?)",
+                (collection, doc_id, self._dump(self._resolve(data))),
+            )
+
+    def list_aggregates(self, collection: str) -> List[str]:
+        rows = self._conn().execute("SELECT id FROM aggregates WHERE collection = ? ORDER BY id", (collection,))
+        return [row[0] for row in rows]
+
+    def delete_aggregates(self, collection: str, doc_ids: Sequence[str]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "DELETE FROM aggregates WHERE collection = ? AND id = ?", [(collection, doc_id) for doc_id in doc_ids],
+            )
+
+    def increment_aggregates(
+        self,
+        collection: str,
+        updates: Dict[str, Tuple[Increments, Dict[str, Any]]],
+    ) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for doc_id, (increments, fields) in updates.items():
+                row = conn.execute(
+                    "SELECT data FROM aggregates WHERE collection = ? AND id = ?", (collection, doc_id),
+                ).fetchone()
+                doc = _merge(json.loads(row[0]) if row else {}, self._resolve(fields))
+                add_increments(doc, increments)
+                conn.execute(
+                    "INSERT OR REPLACE INTO aggregates (collection, id, data) VALUES (?, ?, ?)",
+                    (collection, doc_id, self._dump(doc)),
+                )
+
+    # ── dashboard_stats ──────────────────────────────────
+    def _apply_stats(self, conn: sqlite3.Connection, deltas: Dict[str, Dict[Any, int]]) -> None:
+        """Applies dashboard counter deltas inside the caller's transaction."""
+        now = _json_default(datetime.datetime.now(datetime.timezone.utc))
+        for scope, changes in deltas.items():
+            row = conn.execute("SELECT data FROM dashboard_stats WHERE scope = ?", (scope,)).fetchone()
+            doc = dashboard.apply_deltas(json.loads(row[0]) if row else {}, changes)
+            doc["updatedAt"] = now
+            conn.execute(
+                "INSERT OR REPLACE INTO dashboard_stats (scope, data) VALUES (?, ?)",
+                (scope, self._dump(doc)),
+            )
+
+    def get_dashboard_stats(self, scope: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM dashboard_stats WHERE scope = ?", (scope,),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_dashboard_stats(self, scope: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO dashboard_stats (scope, data) VALUES (?, ?)",
+                (scope, self._dump(self._resolve({**data, "updatedAt": SERVER_TIMESTAMP}))),
+            )
+
+    def list_dashboard_stats(self) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT scope FROM dashboard_stats").fetchall()]
+
+
+def get_storage() -> StorageBackend:
+    """
+    Returns the process-wide storage backend.
+
+    CAREFLOW_STORAGE selects it: "firestore" (default) or "sqlite".
+    The SQLite file defaults to CAREFLOW_SQLITE_PATH=careflow.db.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = os.getenv("CAREFLOW_STORAGE", "firestore").strip().lower()
+                if backend == "sqlite":
+                    _storage = SQLiteStorage(os.getenv("CAREFLOW_SQLITE_PATH", "careflow.db"))
+                elif backend == "firestore":
+                    from .firebase_client import get_firestore
+                    _storage = FirestoreStorage(get_firestore())
+                else:
+                    raise RuntimeError(
+                        f"Unknown CAREFLOW_STORAGE '{backend}'. Use 'firestore' or 'sqlite'.",
+                    )
+    return _storage
+
+
+def set_storage(storage: Optional[StorageBackend]) -> None:
+    """Overrides the configured backend (load tests, benchmarks)."""
+    global _storage
+    _storage = storage
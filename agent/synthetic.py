@@ -0,0 +1,178 @@
+# agent/synthetic.py
+# Synthetic follow-up patients and WhatsApp replies for load tests and
+# benchmarks. Deterministic for a given seed; no real patient data.
+
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+FIRST_NAMES = ["Aarav", "Diya", "Kabir", "Meera", "Rohan", "Ananya", "Vikram", "Isha", "Arjun", "Sana"]
+LAST_NAMES = ["Sharma", "Iyer", "Khan", "Patel", "Reddy", "Nair", "Gupta", "Das", "Singh", "Mehta"]
+SURGERIES = ["Knee replacement", "Appendectomy", "Hernia repair", "CABG", "Cholecystectomy"]
+
+# Mirrors the parameter shapes doctors configure in the dashboard
+PARAMETER_TEMPLATES: List[Dict[str, Any]] = [
+    {"name": "Pain", "questionType": "rate", "alarmingRate": 4,
+     "description": "Pain at the surgical site", "scaleZero": "no pain", "scaleFive": "severe"},
+    {"name": "Fever", "questionType": "yesno", "alarmingAnswer": "yes",
+     "description": "Any fever since yesterday"},
+    {"name": "Swelling", "questionType": "rate", "alarmingRate": 4,
+     "description": "Swelling around the wound", "scaleZero": "none", "scaleFive": "very swollen"},
+    {"name": "Temperature", "questionType": "value", "unit": "°F",
+     "alarmingValueMin": 96.0, "alarmingValueMax": 100.4, "description": "Body temperature"},
+    {"name": "Blood Pressure", "questionType": "value", "unit": "mmHg",
+     "alarmingValueMin": 90, "alarmingValueMax": 150, "description": "Systolic/diastolic"},
+    {"name": "Wound discharge", "questionType": "yesno", "alarmingAnswer": "yes",
+     "description": "Any discharge from the wound"},
+    {"name": "Breathing difficulty", "questionType": "rate", "alarmingRate": 3,
+     "description": "Shortness of breath", "scaleZero": "none", "scaleFive": "severe"},
+    {"name": "Mobility", "questionType": "rate", "alarmingRate": 5,
+     "description": "Difficulty walking", "scaleZero": "walking normally", "scaleFive": "bedridden"},
+]
+
+Q1_REPLIES = {
+    "normal": ["A", "a", "A) Normal", "normal, feeling better", "A - theek hu"],
+    "moderate": ["B", "b", "B) Moderate", "moderate pain today", "B thoda dard hai"],
+    "critical": ["C", "c", "C) Critical", "critical - need help", "C emergency"],
+}
+
+
+def make_parameters(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """`count` parameter definitions, cycling the templates with unique names."""
+    params = []
+    for i in range(count):
+        base = dict(PARAMETER_TEMPLATES[i % len(PARAMETER_TEMPLATES)])
+        if i >= len(PARAMETER_TEMPLATES):
+            base["name"] = f"{base['name']} {i // len(PARAMETER_TEMPLATES) + 1}"
+        params.append(base)
+    rng.shuffle(params)
+    return params
+
+
+def random_value(param: Dict[str, Any], rng: random.Random) -> Any:
+    qtype = param["questionType"]
+    if qtype == "rate":
+        return rng.randint(0, 5)
+    if qtype == "yesno":
+        return rng.choice(["yes", "no", "no", "no"])
+    if param.get("unit") == "mmHg":
+        return f"{rng.randint(85, 165)}/{rng.randint(55, 100)}"
+    return round(rng.uniform(96.5, 101.5), 1)
+
+
+def random_ratings(parameters: List[Dict[str, Any]], rng: random.Random) -> Dict[str, Any]:
+    return {p["name"]: random_value(p, rng) for p in parameters}
+
+
+def make_patient(
+    index: int,
+    rng: random.Random,
+    n_params: int = 4,
+    state: str = "awaiting_q1",
+    phone_prefix: str = "9170000",
+) -> Tuple[str, Dict[str, Any]]:
+    """Returns (doc_id, followup_patients document)."""
+    params = make_parameters(n_params, rng)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    doc_id = f"synth-{index:06d}"
+    return doc_id, {
+        "patientName": f"{first} {last}",
+        "firstName": first,
+        "lastName": last,
+        "patientPhone": f"{phone_prefix}{index:05d}",
+        "phoneNumber": f"{phone_prefix}{index:05d}",
+        "email": f"patient{index}@example.invalid",
+        "doctorId": f"doc-{index % 10}",
+        "doctorName": "Mehta",
+        "surgeryType": rng.choice(SURGERIES),
+        "status": "active",
+        "conversationState": state,
+        "currentDay": rng.randint(1, 6),
+        "followupDays": 7,
+        "checkinsCompleted": rng.randint(0, 5),
+        "lastQ1Answer": "normal",
+        "lastRatings": random_ratings(params, rng),
+        "parameters": params,
+        "emergencyContact": {"name": "Contact", "phone": "", "relation": "Sibling"},
+    }
+
+
+def make_cohort(
+    size: int,
+    seed: int = 7,
+    n_params: int = 4,
+    parameters_share: float = 0.5,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    `size` patients; `parameters_share` of them wait for parameter answers,
+    the rest for their Q1 answer.
+    """
+    rng = random.Random(seed)
+    cohort = []
+    for i in range(size):
+        state = "awaiting_parameters" if rng.random() < parameters_share else "awaiting_q1"
+        cohort.append(make_patient(i, rng, n_params=n_params, state=state))
+    return cohort
+
+
+def q1_reply(rng: random.Random, weights: Tuple[float, float, float] = (0.8, 0.15, 0.05)) -> str:
+    category = rng.choices(["normal", "moderate", "critical"], weights=weights)[0]
+    return rng.choice(Q1_REPLIES[category])
+
+
+def parameter_reply(
+    parameters: List[Dict[str, Any]],
+    rng: random.Random,
+    filler_words: int = 8,
+) -> str:
+    """A mixed free-text answer to the numbered parameter questions."""
+    parts = []
+    for i, p in enumerate(parameters, start=2):
+        value = random_value(p, rng)
+        style = rng.random()
+        if style < 0.4:
+            parts.append(f"{i}. {value}")
+        elif style < 0.8:
+            parts.append(f"{p['name'].lower()} {value}")
+        else:
+            parts.append(str(value))
+    filler = " ".join(rng.choice(["feeling", "ok", "thoda", "better", "today", "tired", "sleep", "good"])
+                      for _ in range(filler_words))
+    return ", ".join(parts) + (f". {filler}" if filler else "")
+
+
+def ultramsg_payload(
+    phone: str,
+    body: str,
+    msg_id: Optional[str] = None,
+    instance: str = "instance00000",
+) -> Dict[str, Any]:
+    """A message_received webhook body in UltraMsg's format."""
+    msg_id = msg_id or f"false_{phone}@c.us_{random.getrandbits(64):016X}"
+    return {
+        "event_type": "message_received",
+        "instanceId": instance,
+        "id": "",
+        "referenceId": "",
+        "hash": "",
+        "data": {
+            "id": msg_id,
+            "from": f"{phone}@c.us",
+            "to": "919100000000@c.us",
+            "author": "",
+            "pushname": "",
+            "ack": "",
+            "type": "chat",
+            "body": body,
+            "media": "",
+            "fromMe": False,
+            "self": False,
+            "isForwarded": False,
+            "isMentioned": False,
+            "quotedMsg": {},
+            "mentionedIds": [],
+            "time": int(time.time()),
+        },
+    }
@@ -0,0 +1,12 @@
+import pytest
+
+from agent.storage import SQLiteStorage, set_storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """A fresh SQLite backend installed as the process-wide storage."""
+    backend = SQLiteStorage(str(tmp_path / "careflow.db"))
+    set_storage(backend)
+    yield backend
+    set_storage(None)
@@ -0,0 +1,177 @@
+"""
+Compiled alarm rules against the per-call implementations they replaced.
+
+The reference functions below are the response_analyzer versions from
+before alarm_rules existed, kept verbatim in behaviour (bare excepts
+included): any reply or protocol, however malformed, must produce the
+same crossed parameters, condition category and statuses.
+"""
+
+import random
+
+import pytest
+
+from agent import synthetic
+from agent.alarm_rules import compile_rules
+from agent.response_analyzer import check_alarms, compute_condition_category, compute_status_per_parameter
+
+CRITICAL_KEYWORDS = ["chest", "heart", "cardiac", "pulse", "bp", "blood pressure", "breathing", "oxygen"]
+
+
+def reference_check_alarms(ratings, parameters):
+    crossed = []
+    for param in parameters:
+        name = param["name"]
+        val = ratings.get(name)
+        if val is None:
+            continue
+        qtype = param["questionType"]
+        if qtype == "rate":
+            try:
+                if float(val) >= float(param.get("alarmingRate", 5)):
+                    crossed.append(param)
+            except Exception:
+                pass
+        elif qtype == "yesno":
+            if str(val).lower() == str(param.get("alarmingAnswer", "yes")).lower():
+                crossed.append(param)
+        elif qtype == "value":
+            try:
+                val_num = float(str(val).split("/")[0])
+                lo = param.get("alarmingValueMin")
+                hi = param.get("alarmingValueMax")
+                if (lo is not None and val_num < lo) or (hi is not None and val_num > hi):
+                    crossed.append(param)
+            except Exception:
+                pass
+    return crossed
+
+
+def reference_condition_category(q1_answer, crossed_params, parameters):
+    crossed_count = len(crossed_params)
+    has_critical_param = any(
+        any(kw in c["name"].lower() for kw in CRITICAL_KEYWORDS) for c in crossed_params
+    )
+    if q1_answer == "critical" or crossed_count >= 2 or has_critical_param:
+        return "critical"
+    if q1_answer == "moderate" or crossed_count == 1:
+        return "note"
+    return "normal"
+
+
+def reference_status_per_parameter(parameters, today_ratings, yesterday_ratings):
+    status = {}
+    for param in parameters:
+        name = param["name"]
+        qtype = param["questionType"]
+        today = today_ratings.get(name)
+        yesterday = yesterday_ratings.get(name)
+        if today is None or yesterday is None:
+            status[name] = "stable"
+            continue
+        if qtype == "rate":
+            try:
+                if float(today) < float(yesterday):
+                    status[name] = "improving"
+                elif float(today) > float(yesterday):
+                    status[name] = "deteriorating"
+                else:
+                    status[name] = "stable"
+            except Exception:
+                status[name] = "stable"
+        elif qtype == "yesno":
+            alarming = str(param.get("alarmingAnswer", "yes")).lower()
+            today_str, yesterday_str = str(today).lower(), str(yesterday).lower()
+            if today_str == alarming and yesterday_str != alarming:
+                status[name] = "deteriorating"
+            elif today_str != alarming and yesterday_str == alarming:
+                status[name] = "improving"
+            else:
+                status[name] = "stable"
+        elif qtype == "value":
+            try:
+                today_val = float(str(today).split("/")[0])
+                yesterday_val = float(str(yesterday).split("/")[0])
+                lo = param.get("alarmingValueMin")
+                hi = param.get("alarmingValueMax")
+                if lo is not None and hi is not None:
+                    target = (lo + hi) / 2
+                    if abs(today_val - target) < abs(yesterday_val - target):
+                        status[name] = "improving"
+                    elif abs(today_val - target) > abs(yesterday_val - target):
+                        status[name] = "deteriorating"
+                    else:
+                        status[name] = "stable"
+                else:
+                    if today_val < yesterday_val:
+                        status[name] = "improving"
+                    elif today_val > yesterday_val:
+                        status[name] = "deteriorating"
+                    else:
+                        status[name] = "stable"
+            except Exception:
+                status[name] = "stable"
+    return status
+
+
+WEIRD_ANSWERS = [None, "abc", "120/80", "4", "yes", "YES", 3, 5.5, True, False, [1], {}, "97.5", "",
+                 " 4 ", float("nan"), "nan", "inf"]
+WEIRD_THRESHOLDS = [None, "x", "4", 4, 100, "100.4", [1], True]
+
+
+def _outcome(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return type(e)
+
+
+def _random_case(rng):
+    params = synthetic.make_parameters(rng.randint(0, 10), rng)
+    for p in params:
+        if rng.random() < 0.2:
+            key = rng.choice(["alarmingRate", "alarmingAnswer", "alarmingValueMin", "alarmingValueMax"])
+            p[key] = rng.choice(WEIRD_THRESHOLDS)
+        if rng.random() < 0.05:
+            p["questionType"] = rng.choice(["text", "rate", "value"])
+        if rng.random() < 0.1:
+            p["name"] = rng.choice(["Chest pain", "BP", "Pulse rate", "Pain"])
+
+    def answers():
+        return {
+            p["name"]: rng.choice(WEIRD_ANSWERS) if rng.random() < 0.3 else synthetic.random_value(p, rng)
+            for p in params if rng.random() < 0.9
+        }
+
+    return params, answers(), answers(), rng.choice(["normal", "moderate", "critical"])
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_compiled_rules_match_reference(seed):
+    rng = random.Random(seed)
+    for _ in range(2500):
+        params, today, yesterday, q1 = _random_case(rng)
+
+        expected = _outcome(reference_check_alarms, today, params)
+        crossed = _outcome(check_alarms, today, params)
+        assert crossed == expected, (params, today)
+        if isinstance(expected, list):
+            # the same parameter dicts, in protocol order
+            assert [id(p) for p in crossed] == [id(p) for p in expected]
+            assert compute_condition_category(q1, crossed, params) == \
+                reference_condition_category(q1, expected, params)
+
+        assert _outcome(compute_status_per_parameter, params, today, yesterday) == \
+            _outcome(reference_status_per_parameter, params, today, yesterday), (params, today, yesterday)
+
+
+def test_evaluate_combines_the_three_checks():
+    rng = random.Random(41)
+    for _ in range(500):
+        params, today, yesterday, q1 = _random_case(rng)
+        if isinstance(_outcome(reference_check_alarms, today, params), type):
+            continue
+        crossed, category, status = compile_rules(params).evaluate(params, q1, today, yesterday)
+        assert crossed == reference_check_alarms(today, params)
+        assert category == reference_condition_category(q1, crossed, params)
+        assert status == reference_status_per_parameter(params, today, yesterday)
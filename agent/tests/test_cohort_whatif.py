@@ -0,0 +1,63 @@
+"""The NumPy what-if path against the pure-Python one on randomized cohorts."""
+
+import random
+
+import pytest
+
+from agent import cohort_whatif, synthetic
+
+pytest.importorskip("numpy")
+
+WEIRD_ANSWERS = [None, "abc", "120/80", "4", "yes", "YES", 3, 5.5, True, "97.5", "", " 4 "]
+WEIRD_THRESHOLDS = [None, "x", "4", 4, 100, "100.4", True, 2.5, 0]
+NAMES = [t["name"] for t in synthetic.PARAMETER_TEMPLATES]
+
+
+def _cohort(rng):
+    patients = []
+    cohort = synthetic.make_cohort(rng.randint(1, 60), seed=rng.randint(0, 999), n_params=rng.randint(1, 9))
+    for doc_id, p in cohort:
+        for param in p["parameters"]:
+            if rng.random() < 0.1:
+                param[rng.choice(cohort_whatif.THRESHOLD_FIELDS)] = rng.choice(WEIRD_THRESHOLDS)
+        p["lastRatings"] = {
+            name: rng.choice(WEIRD_ANSWERS) if rng.random() < 0.2 else value
+            for name, value in p["lastRatings"].items() if rng.random() < 0.9
+        }
+        p["previousRatings"] = {
+            param["name"]: synthetic.random_value(param, rng)
+            for param in p["parameters"] if rng.random() < 0.9
+        }
+        p["lastQ1Answer"] = rng.choice(["normal", "moderate", "critical", None, "x"])
+        p["doc_id"] = doc_id
+        patients.append(p)
+    return patients
+
+
+def _changes(result):
+    categories = sorted(
+        (c["doc_id"], c["before"], c["after"], tuple(sorted(c["crossed_before"])), tuple(sorted(c["crossed_after"])))
+        for c in result["category_changes"]
+    )
+    trends = sorted((c["doc_id"], c["parameter"], c["before"], c["after"]) for c in result["trend_changes"])
+    return categories, trends, result["summary"]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_numpy_matches_python(seed, monkeypatch):
+    rng = random.Random(seed)
+    for _ in range(100):
+        patients = _cohort(rng)
+        overrides = {}
+        for _ in range(rng.randint(1, 3)):
+            fields = overrides.setdefault(rng.choice(NAMES), {})
+            fields[rng.choice(cohort_whatif.THRESHOLD_FIELDS)] = rng.choice(WEIRD_THRESHOLDS + ["no"])
+        doctor = rng.choice([None, "doc-1", "doc-3", "zzz"])
+
+        vectorized = cohort_whatif.CohortSnapshot(patients).whatif(overrides, doctor)
+        with monkeypatch.context() as m:
+            m.setattr(cohort_whatif, "np", None)
+            python = cohort_whatif.CohortSnapshot(patients).whatif(overrides, doctor)
+
+        assert vectorized["vectorized"] and not python["vectorized"]
+        assert _changes(vectorized) == _changes(python), (overrides, doctor)
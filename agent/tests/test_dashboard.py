@@ -0,0 +1,89 @@
+import random
+
+from agent import dashboard
+
+DOCTORS = ["D1", "D2", "D3", None]
+STATES = ["awaiting_q1", "q1_answered", "awaiting_parameters", "completed_today", "no_response_emergency_sent"]
+STATUSES = ["normal", "note", "critical"]
+
+
+def _counts(doc):
+    view = dashboard.summary(doc)
+    view.pop("today")
+    view.pop("updatedAt")
+    return view
+
+
+def _random_followup(rng):
+    return {
+        "patientName": "P",
+        "status": rng.choice(["active", "active", "active", "completed"]),
+        "doctorId": rng.choice(DOCTORS),
+        "conversationState": rng.choice(STATES),
+        "lastStatus": rng.choice(STATUSES),
+    }
+
+
+def _random_update(rng):
+    fields = {
+        "status": lambda: rng.choice(["active", "completed"]),
+        "doctorId": lambda: rng.choice(DOCTORS),
+        "conversationState": lambda: rng.choice(STATES),
+        "lastStatus": lambda: rng.choice(STATUSES),
+        "currentDay": lambda: rng.randint(1, 7),
+    }
+    return {name: make() for name, make in rng.sample(sorted(fields.items()), rng.randint(1, 3))}
+
+
+def test_incremental_counters_match_rebuild(storage):
+    rng = random.Random(45)
+    patients, alerts = [], []
+    for step in range(600):
+        op = rng.random()
+        if op < 0.15 or not patients:
+            doc_id = f"p{step}"
+            storage.set_followup(doc_id, _random_followup(rng))
+            patients.append(doc_id)
+        elif op < 0.25:
+            storage.set_followup(rng.choice(patients), _random_followup(rng))
+        elif op < 0.8:
+            storage.update_followup(rng.choice(patients), _random_update(rng))
+        elif op < 0.92 or not alerts:
+            alerts.append(storage.add_alert({
+                "patientDocId": rng.choice(patients),
+                "doctorId": rng.choice(DOCTORS),
+                "resolved": rng.random() < 0.1,
+            }))
+        else:
+            storage.resolve_alert(rng.choice(alerts))
+
+    scopes = set(storage.list_dashboard_stats())
+    incremental = {scope: _counts(storage.get_dashboard_stats(scope)) for scope in scopes}
+    rebuilt = dashboard.rebuild()
+
+    assert set(rebuilt) == scopes
+    for scope, doc in rebuilt.items():
+        assert incremental[scope] == _counts(doc), scope
+    assert incremental[dashboard.GLOBAL_SCOPE]["active"] > 0
+
+
+def test_merge_shards_sums_counters():
+    shards = [
+        {"active": 2, "lastStatus": {"normal": 2}, "daily": {"2026-10-19": {"sent": 3}}, "updatedAt": 1},
+        None,
+        {"active": -1, "lastStatus": {"normal": -1, "critical": 1}, "daily": {"2026-10-19": {"sent": 1}},
+         "updatedAt": 5},
+    ]
+    assert dashboard.merge_shards(shards) == {
+        "active": 1,
+        "lastStatus": {"normal": 1, "critical": 1},
+        "daily": {"2026-10-19": {"sent": 4}},
+        "updatedAt": 5,
+    }
+    assert dashboard.merge_shards([None]) is None
+
+
+def test_shard_ids_map_back_to_their_scope():
+    scope = dashboard.scope_id("doctor_7")
+    assert {dashboard.scope_of(doc_id) for doc_id in dashboard.shard_ids(scope)} == {scope}
+    assert dashboard.scope_of(scope) == scope
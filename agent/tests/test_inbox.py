@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from agent.inbox import Inbox, InboxWorkerPool
+
+
+def _pool(inbox, handler, **kwargs):
+    kwargs.setdefault("key_fn", lambda payload: payload["from"])
+    return InboxWorkerPool(inbox, handler, retry_delay=0, poll_interval=0.02, **kwargs)
+
+
+def _drive(pool, payloads):
+    async def run():
+        await pool.start()
+        for payload in payloads:
+            await pool.submit(payload)
+        await pool.join()
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def _rows(inbox):
+    return inbox._conn().execute("SELECT id, status FROM inbox_events ORDER BY id").fetchall()
+
+
+def test_unfinished_events_survive_a_crash(tmp_path):
+    path = str(tmp_path / "inbox.db")
+    crashed = Inbox(path, lease_seconds=0.5)
+    for n in range(3):
+        crashed.put({"from": "p1", "n": n}, key="p1")
+    crashed.put({"from": "p2", "n": 0}, key="p2")
+    first = _rows(crashed)[0][0]
+    assert crashed.mark_processing(first)
+
+    survivor = Inbox(path)
+    assert survivor.recover() == []  # the crashed instance's lease is still current
+    time.sleep(0.6)
+
+    handled = []
+
+    async def handler(payload):
+        handled.append((payload["from"], payload["n"]))
+
+    _drive(_pool(survivor, handler), [])
+    assert [n for who, n in handled if who == "p1"] == [0, 1, 2]
+    assert ("p2", 0) in handled
+    assert _rows(survivor) == []
+    assert crashed.mark_processing(first) is False
+
+
+def test_redelivered_messages_are_dropped(tmp_path):
+    pytest.importorskip("fastapi")
+    from agent.main import message_dedup_key
+
+    path = str(tmp_path / "inbox.db")
+    with_id = {"id": "wamid.1", "from": "p1@c.us", "body": "C", "time": 1}
+    without_id = {"from": "p1@c.us", "body": "2", "time": 2}
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload["body"])
+
+    async def run(pool):
+        await pool.start()
+        ids = [await pool.submit(payload, message_dedup_key(payload))
+               for payload in (with_id, without_id, dict(with_id), dict(without_id))]
+        await pool.join()
+        await pool.stop()
+        return ids
+
+    first = asyncio.run(run(_pool(Inbox(path), handler)))
+    assert first[2:] == [None, None] and None not in first[:2]
+    # A restarted process has an empty in-memory cache; the inbox file still knows
+    restarted = _pool(Inbox(path), handler)
+    assert asyncio.run(run(restarted)) == [None] * 4
+    assert handled == ["C", "2"]
+    assert restarted.inbox.duplicates == 4
+
+
+def test_each_patient_runs_in_order(tmp_path):
+    rng = random.Random(31)
+    payloads = [{"from": f"p{rng.randint(0, 9)}", "n": n} for n in range(200)]
+    handled, running, peak = [], [0], [0]
+
+    async def handler(payload):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(rng.uniform(0, 0.003))
+        running[0] -= 1
+        handled.append((payload["from"], payload["n"]))
+
+    pool = _pool(Inbox(str(tmp_path / "inbox.db")), handler, concurrency=4)
+    _drive(pool, payloads)
+    for patient in {p["from"] for p in payloads}:
+        assert [n for who, n in handled if who == patient] == [p["n"] for p in payloads if p["from"] == patient]
+    assert 1 < peak[0] <= 4
+    assert pool.stats()["processed"] == 200
+
+
+def test_failed_event_retries_before_the_next_one(tmp_path):
+    attempts = []
+
+    async def handler(payload):
+        attempts.append(payload["n"])
+        if payload["n"] == 0 and attempts.count(0) == 1:
+            raise RuntimeError("smtp down")
+        if payload["n"] == 2:
+            raise RuntimeError("always")
+
+    inbox = Inbox(str(tmp_path / "inbox.db"), max_attempts=3)
+    pool = _pool(inbox, handler)
+    _drive(pool, [{"from": "p1", "n": n} for n in range(4)])
+    assert attempts == [0, 0, 1, 2, 2, 2, 3]
+    assert (pool.retried, pool.failed, pool.processed) == (3, 1, 3)
+    assert [status for _, status in _rows(inbox)] == ["failed"]
+
+
+def test_processes_sharing_an_inbox_keep_each_patient_in_order(tmp_path):
+    path = str(tmp_path / "inbox.db")
+    handled = []
+
+    def handler_for(name):
+        async def handler(payload):
+            handled.append((name, payload["from"], payload["n"]))
+            await asyncio.sleep(0.01)
+        return handler
+
+    async def run():
+        a = _pool(Inbox(path, lease_seconds=0.3), handler_for("a"))
+        b = _pool(Inbox(path, lease_seconds=0.3), handler_for("b"))
+        await a.start()
+        await b.start()
+        for n in range(10):
+            await (a if n % 2 else b).submit({"from": "p1", "n": n})
+        await asyncio.sleep(0.5)
+        # a stops with p2's events unfinished; b takes them over in order
+        for n in range(5):
+            await a.submit({"from": "p2", "n": n})
+        await a.stop()
+        await b.submit({"from": "p2", "n": 5})
+        await asyncio.sleep(0.5)
+        await b.join()
+        await b.stop()
+
+    asyncio.run(run())
+    p1 = [(who, n) for who, patient, n in handled if patient == "p1"]
+    assert [n for _, n in p1] == list(range(10))
+    assert len({who for who, _ in p1}) == 1
+    assert {n for _, patient, n in handled if patient == "p2"} == set(range(6))
+    taken_over = [n for who, patient, n in handled if patient == "p2" and who == "b"]
+    assert taken_over == list(range(taken_over[0], 6))
@@ -0,0 +1,221 @@
+# agent/timeseries.py
+# Per-patient, per-parameter time series kept on the follow-up document.
+#
+# `lastRatings` only holds the latest check-in, so trends beyond "versus
+# yesterday" used to need the patient's checkin_responses. Instead each
+# follow-up document carries a `trendSeries` map: for every parameter a
+# fixed-size ring of severity scores (alarm_rules.RuleSet.scores: higher is
+# worse) with the day numbers they were recorded on, plus running sums.
+#
+# Appending a check-in is O(1) per parameter: the ring slot of the oldest
+# point is overwritten and the window sums are adjusted, so the moving
+# average and least-squares slope over the window never re-scan it. The
+# streak counts consecutive check-ins whose score rose (positive) or fell
+# (negative), the same comparison compute_status_per_parameter makes.
+#
+# The series is updated inside run_full_analysis_pipeline from the patient
+# document the webhook already read and written back with the same
+# update_followup call as lastRatings, so trend signals cost no extra reads.
+#
+#   TREND_WINDOW=7           points kept per parameter (moving average / slope window)
+#   TREND_STREAK_DAYS=3      streak length reported as sustained deterioration
+
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .alarm_rules import compile_rules
+
+WINDOW = int(os.getenv("TREND_WINDOW", "7"))
+STREAK_DAYS = int(os.getenv("TREND_STREAK_DAYS", "3"))
+
+# Scores and sums are rounded when stored so repeated add/subtract of the
+# window sums does not accumulate float noise in the document.
+_PLACES = 6
+
+
+class ParamSeries:
+    """
+    A ring of the last `window` scores of one parameter.
+
+    Stored as {"v": scores, "d": day numbers, "h": ring head, "sy": sum of
+    scores, "sxy": sum of position * score (oldest point at position 0),
+    "s": streak, "t": points ever recorded}.
+    """
+
+    __slots__ = ("window", "values", "days", "head", "sum_y", "sum_xy", "streak", "total")
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self.window = window
+        self.values: List[float] = []
+        self.days: List[int] = []
+        self.head = 0
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+        self.streak = 0
+        self.total = 0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], window: int = WINDOW) -> "ParamSeries":
+        series = cls(window)
+        values = [float(v) for v in data.get("v") or []]
+        days = [int(d) for d in data.get("d") or []]
+        head = int(data.get("h", 0))
+        n = min(len(values), len(days))
+        series.streak = int(data.get("s", 0))
+        series.total = int(data.get("t", n))
+        if len(values) == len(days) and (head == 0 if n < window else n == window and 0 <= head < n):
+            series.values, series.days, series.head = values, days, head
+            series.sum_y = float(data.get("sy", 0.0))
+            series.sum_xy = float(data.get("sxy", 0.0))
+            return series
+        # Written with another TREND_WINDOW (or damaged): rebuild the sums
+        # from the newest points in chronological order.
+        head = head if 0 <= head < n else 0
+        values, days = values[:n], days[:n]
+        for value, day in list(zip(values[head:] + values[:head], days[head:] + days[:head]))[-window:]:
+            series._append(value, day)
+        return series
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "v": list(self.values), "d": list(self.days), "h": self.head,
+            "sy": round(self.sum_y, _PLACES), "sxy": round(self.sum_xy, _PLACES),
+            "s": self.streak, "t": self.total,
+        }
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def last(self) -> Optional[float]:
+        if not self.values:
+            return None
+        return self.values[self.head - 1] if len(self.values) == self.window else self.values[-1]
+
+    @property
+    def last_day(self) -> Optional[int]:
+        if not self.days:
+            return None
+        return self.days[self.head - 1] if len(self.days) == self.window else self.days[-1]
+
+    def _append(self, value: float, day: int) -> None:
+        n = len(self.values)
+        if n < self.window:
+            self.values.append(value)
+            self.days.append(day)
+            self.sum_xy += n * value
+            self.sum_y += value
+            return
+        # Full: every point moves one position towards the oldest, the
+        # oldest drops out and the new point takes position window - 1.
+        oldest = self.values[self.head]
+        self.sum_xy += (n - 1) * value - (self.sum_y - oldest)
+        self.sum_y += value - oldest
+        self.values[self.head] = value
+        self.days[self.head] = day
+        self.head = (self.head + 1) % self.window
+
+    def add(self, value: float, day: int) -> bool:
+        """Records `value` for `day`; False (unchanged) if that day is already recorded."""
+        last_day = self.last_day
+        if last_day is not None and day <= last_day:
+            return False
+        value = round(value, _PLACES)
+        previous = self.last
+        if previous is None or value == previous:
+            self.streak = 0
+        elif value > previous:
+            self.streak = self.streak + 1 if self.streak > 0 else 1
+        else:
+            self.streak = self.streak - 1 if self.streak < 0 else -1
+        self._append(value, day)
+        self.total += 1
+        return True
+
+    @property
+    def mean(self) -> Optional[float]:
+        n = len(self.values)
+        return self.sum_y / n if n else None
+
+    @property
+    def slope(self) -> Optional[float]:
+        """Least-squares change in score per check-in over the window (positive: worsening)."""
+        n = len(self.values)
+        if n < 2:
+            return None
+        sum_x = n * (n - 1) / 2
+        sum_xx = (n - 1) * n * (2 * n - 1) / 6
+        return (n * self.sum_xy - sum_x * self.sum_y) / (n * sum_xx - sum_x * sum_x)
+
+    def chronological(self) -> List[Tuple[int, float]]:
+        """(day, score) pairs, oldest first."""
+        h = self.head
+        return list(zip(self.days[h:] + self.days[:h], self.values[h:] + self.values[:h]))
+
+    def summary(self) -> Dict[str, Any]:
+        slope, mean = self.slope, self.mean
+        return {
+            "points": len(self.values),
+            "mean": round(mean, 3) if mean is not None else None,
+            "slope": round(slope, 3) if slope is not None else None,
+            "streak": self.streak,
+            "last_day": self.last_day,
+        }
+
+
+def update_series(
+    stored: Optional[Dict[str, Any]],
+    parameters: List[Dict[str, Any]],
+    ratings: Dict[str, Any],
+    day: int,
+    window: int = WINDOW,
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, ParamSeries]]:
+    """
+    Appends one check-in to a stored `trendSeries` map.
+
+    Returns the map to write back and the ParamSeries of every parameter in
+    the protocol that has a series. Parameters dropped from the protocol keep
+    their stored series; ones missing from today's ratings are not advanced.
+    """
+    stored = stored or {}
+    result = dict(stored)
+    series: Dict[str, ParamSeries] = {}
+    scores = compile_rules(parameters).scores(ratings)
+    for param in parameters:
+        name = param["name"]
+        data = stored.get(name)
+        current = ParamSeries.from_dict(data, window) if data else None
+        score = scores.get(name)
+        if score is not None:
+            if current is None:
+                current = ParamSeries(window)
+            if current.add(score, day):
+                result[name] = current.to_dict()
+        if current is not None:
+            series[name] = current
+    return result, series
+
+
+def trend_signals(series: Dict[str, ParamSeries], streak_days: int = STREAK_DAYS) -> Dict[str, Any]:
+    """Per-parameter summaries and the parameters deteriorating for `streak_days` check-ins or more."""
+    return {
+        "parameters": {name: s.summary() for name, s in series.items()},
+        "deteriorating": sorted(name for name, s in series.items() if s.streak >= streak_days),
+    }
+
+
+def replay(
+    parameters: List[Dict[str, Any]],
+    checkins: Iterable[Tuple[int, Dict[str, Any]]],
+    window: int = WINDOW,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Builds a `trendSeries` map from (day number, ratings) pairs in day order,
+    e.g. from a patient's checkin_responses when backfilling.
+    """
+    stored: Dict[str, Dict[str, Any]] = {}
+    for day, ratings in checkins:
+        stored, _ = update_series(stored, parameters, ratings or {}, int(day), window)
+    return stored
@@ -0,0 +1,255 @@
+# agent/tracing.py
+# Lightweight span tracing for the check-in path.
+#
+# A trace is started per inbox event; span() blocks anywhere below it
+# (including code run via asyncio.to_thread) are recorded as children.
+# Outside a trace span() is a no-op, so instrumented helpers cost nothing
+# when called from the scheduler or scripts.
+#
+# Finished traces are handed to a background exporter:
+#   TRACE_EXPORT=none (default) | file | otlp
+#   TRACE_FILE=traces.jsonl                       (file: one OTLP/JSON payload per line)
+#   TRACE_OTLP_ENDPOINT=http://localhost:4318/v1/traces   (otlp: OTLP/HTTP JSON)
+# breakdown() gives the compact per-check-in timing map stored on the
+# checkin_responses record.
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .log import get_logger
+
+log = get_logger(__name__)
+
+SERVICE_NAME = "careflow-agent"
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attrs: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class Trace:
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+_root: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_root", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def start_trace(name: str, **attrs: Any) -> Iterator[Span]:
+    """Opens a new trace with a root span; exported when the block exits."""
+    trace = Trace()
+    root = Span(trace, name, None, attrs)
+    token = _current.set(root)
+    root_token = _root.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.end_ns = time.time_ns()
+        _root.reset(root_token)
+        _current.reset(token)
+        trace.add(root)
+        exporter.export(trace)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Times the block as a child of the current span (no-op outside a trace)."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attrs)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+        parent.trace.add(child)
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of span() for synchronous functions."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def breakdown() -> Dict[str, int]:
+    """
+    Milliseconds per finished span name in the current trace (repeated
+    spans are summed), plus `total` since the trace started and `queued`
+    if the root span recorded the inbox wait. Empty outside a trace.
+    """
+    root = _root.get()
+    if root is None:
+        return {}
+    with root.trace._lock:
+        finished = [s for s in root.trace.spans if s.end_ns is not None]
+
+    timings: Dict[str, float] = {}
+    for s in finished:
+        timings[s.name] = timings.get(s.name, 0.0) + s.duration_ms
+    result = {name: int(round(ms)) for name, ms in timings.items()}
+    result["total"] = int(round(root.duration_ms))
+    if root.attrs.get("queued_ms") is not None:
+        result["queued"] = int(round(root.attrs["queued_ms"]))
+    return result
+
+
+# ── Export ───────────────────────────────────────────────
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest for one trace."""
+    spans = []
+    for s in trace.spans:
+        entry: Dict[str, Any] = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            entry["parentSpanId"] = s.parent_id
+        spans.append(entry)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "careflow"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceExporter:
+    """
+    Ships finished traces from a background thread so exporting never adds
+    to check-in latency. The queue is bounded; traces are dropped (and
+    counted) rather than blocking when the sink falls behind.
+    """
+
+    def __init__(self, mode: str = "none", path: str = "traces.jsonl",
+                 endpoint: str = "", maxsize: int = 1000) -> None:
+        self.mode = mode
+        self.path = path
+        self.endpoint = endpoint
+        self.dropped = 0
+        self.exported = 0
+        self._queue: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TraceExporter":
+        return cls(
+            mode=os.getenv("TRACE_EXPORT", "none").lower(),
+            path=os.getenv("TRACE_FILE", "traces.jsonl"),
+            endpoint=os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+        )
+
+    def export(self, trace: Trace) -> None:
+        if self.mode == "none":
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Waits (bounded) for queued traces to be written."""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="trace_exporter", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                if trace is not None:
+                    self._write(to_otlp(trace))
+                    self.exported += 1
+            except Exception as e:
+                log.warning("Trace export failed: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, payload: Dict[str, Any]) -> None:
+        if self.mode == "file":
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        elif self.mode == "otlp":
+            import requests
+            requests.post(self.endpoint, json=payload, timeout=5)
+
+
+exporter = TraceExporter.from_env()
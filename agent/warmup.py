@@ -0,0 +1,206 @@
+# agent/warmup.py
+# Startup warm-up and readiness.
+#
+# Right after the inbox workers start, each dependency is touched once so
+# the first real webhook does not pay for it inline: the storage client is
+# created and does a point read, the Groq client and UltraMsg session open
+# their pooled connections, SMTP connects and logs in, and the phone index
+# is filled from the active follow-ups' phone numbers.
+#
+# GET /ready answers 503 until the warm-up has finished and every required
+# check passed, so a rolling deploy only routes traffic to a warm worker.
+# Failed required checks are retried; optional ones are reported only.
+#
+#   WARMUP_REQUIRED=storage          comma-separated checks that gate readiness
+#   WARMUP_TIMEOUT_SECONDS=10        per check
+#   WARMUP_RETRY_SECONDS=5           delay before retrying failed required checks
+#   WARMUP_ENABLED=true              false: ready immediately, nothing touched
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .log import get_logger
+
+log = get_logger(__name__)
+
+WARMUP_SECONDS = metrics.gauge(
+    "careflow_warmup_check_seconds", "Latency of the last warm-up check per dependency.",
+    ("check",),
+)
+
+# A check returns a short detail (or None) and raises on failure
+CheckFn = Callable[[], Any]
+
+
+class SkipCheck(Exception):
+    """Raised by a check whose dependency is not configured."""
+
+
+def _check_storage() -> str:
+    from .storage import get_storage
+
+    storage = get_storage()
+    storage.get_followup("__warmup__")
+    return storage.name
+
+
+def _check_firestore_async() -> str:
+    # The async client is only used on the webhook path with Firestore
+    from .storage import get_storage
+
+    if get_storage().name != "firestore":
+        raise SkipCheck("local storage backend")
+    from .firebase_async import get_async_firestore
+
+    get_async_firestore()
+    return "client created"
+
+
+def _check_caches() -> str:
+    from .firebase_client import prime_caches
+
+    return f"{prime_caches()} phones indexed"
+
+
+def _check_llm() -> str:
+    from . import ai_client
+
+    if not ai_client.API_KEY:
+        raise SkipCheck("GROQ_API_KEY not set")
+    return f"{ai_client.check_connection()} models"
+
+
+def _check_whatsapp() -> str:
+    from . import whatsapp
+
+    if not whatsapp.INSTANCE or not whatsapp.TOKEN:
+        raise SkipCheck("ULTRAMSG_INSTANCE/TOKEN not set")
+    status = whatsapp.check_connection(timeout=_timeout())
+    if status >= 500:
+        raise RuntimeError(f"HTTP {status}")
+    return f"HTTP {status}"
+
+
+def _check_smtp() -> str:
+    from . import alerts
+
+    if not alerts.GMAIL_ADDRESS or not alerts.GMAIL_APP_PASSWORD:
+        raise SkipCheck("GMAIL_ADDRESS/GMAIL_APP_PASSWORD not set")
+    alerts.check_connection(timeout=_timeout())
+    return "login ok"
+
+
+DEFAULT_CHECKS: List[Tuple[str, CheckFn]] = [
+    ("storage", _check_storage),
+    ("firestore_async", _check_firestore_async),
+    ("caches", _check_caches),
+    ("llm", _check_llm),
+    ("whatsapp", _check_whatsapp),
+    ("smtp", _check_smtp),
+]
+
+
+def _timeout() -> float:
+    return float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+
+
+class Readiness:
+    """Runs the warm-up checks and tracks whether the worker may take traffic."""
+
+    def __init__(
+        self,
+        checks: Sequence[Tuple[str, CheckFn]] = DEFAULT_CHECKS,
+        required: Sequence[str] = ("storage",),
+        timeout: float = 10.0,
+        retry_delay: float = 5.0,
+    ) -> None:
+        self.checks = list(checks)
+        self.required = set(required)
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._ready = asyncio.Event()
+
+    @classmethod
+    def from_env(cls) -> "Readiness":
+        required = [c.strip() for c in os.getenv("WARMUP_REQUIRED", "storage").split(",") if c.strip()]
+        checks = DEFAULT_CHECKS if os.getenv("WARMUP_ENABLED", "true").lower() != "false" else []
+        return cls(
+            checks=checks,
+            required=[c for c in required if c in dict(checks)],
+            timeout=_timeout(),
+            retry_delay=float(os.getenv("WARMUP_RETRY_SECONDS", "5")),
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until ready; False if `timeout` passes first."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run_check(self, name: str, fn: CheckFn) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(asyncio.to_thread(fn), self.timeout)
+            result = {"status": "ok", "detail": detail}
+        except SkipCheck as e:
+            result = {"status": "skipped", "detail": str(e)}
+        except asyncio.TimeoutError:
+            result = {"status": "error", "detail": f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": "error", "detail": f"{type(e).__name__}: {e}"}
+        result["ms"] = int(round((time.perf_counter() - started) * 1000))
+        result["required"] = name in self.required
+        if result["status"] != "skipped":
+            WARMUP_SECONDS.set(result["ms"] / 1000, check=name)
+        return result
+
+    def _pending(self) -> List[Tuple[str, CheckFn]]:
+        return [
+            (name, fn) for name, fn in self.checks
+            if name in self.required and self.results[name]["status"] == "error"
+        ]
+
+    async def run(self) -> None:
+        """Runs all checks concurrently, then retries failed required ones until they pass."""
+        self.started_at = time.time()
+        results = await asyncio.gather(*(self._run_check(name, fn) for name, fn in self.checks))
+        self.results = dict(zip((name for name, _ in self.checks), results))
+        for name, result in self.results.items():
+            level = log.warning if result["status"] == "error" else log.info
+            level("Warm-up %s: %s (%s ms) %s", name, result["status"], result["ms"], result["detail"] or "")
+
+        pending = self._pending()
+        while pending:
+            log.warning("Not ready; retrying %s in %ss", [name for name, _ in pending], self.retry_delay)
+            await asyncio.sleep(self.retry_delay)
+            for name, fn in pending:
+                self.results[name] = await self._run_check(name, fn)
+            pending = self._pending()
+
+        self.finished_at = time.time()
+        self._ready.set()
+        log.info("Ready after %.2fs warm-up", self.finished_at - self.started_at)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warmup_seconds": (
+                round(self.finished_at - self.started_at, 3)
+                if self.finished_at and self.started_at else None
+            ),
+            "checks": self.results,
+        }
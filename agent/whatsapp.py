@@ -1,20 +1,81 @@
 import os
-import requests
-from dotenv import load_dotenv
-load_dotenv()
+import threading
+from .log import get_logger
+from .metrics import timed_send
+from .tracing import span
+
+log = get_logger(__name__)
 
 INSTANCE = os.getenv("ULTRAMSG_INSTANCE")
 TOKEN = os.getenv("ULTRAMSG_TOKEN")
+API_URL = os.getenv("ULTRAMSG_API_URL", "https://api.ultramsg.com").rstrip("/")
+POOL_SIZE = int(os.getenv("ULTRAMSG_POOL_SIZE", "10"))
+# Connect / read timeout per send; without one a stalled UltraMsg call
+# holds an inbox slot (and the patient's queue) indefinitely
+TIMEOUT = float(os.getenv("ULTRAMSG_TIMEOUT_SECONDS", "10"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """
+    Shared keep-alive session for UltraMsg: the TLS handshake is paid once
+    (at warm-up) instead of on every message.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def check_connection(timeout: float = 10) -> int:
+    """Opens the pooled connection to UltraMsg; returns the HTTP status."""
+    response = http_session().get(
+        f"{API_URL}/{INSTANCE}/instance/status", params={"token": TOKEN}, timeout=timeout,
+    )
+    return response.status_code
+
+
+def accepted(response) -> bool:
+    """
+    Whether UltraMsg took the message: a 2xx status alone is not enough,
+    rejections come back as 200 with {"error": ...} or "sent": "false".
+    """
+    if not 200 <= response.status_code < 300:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict) or body.get("error"):
+        return False
+    return str(body.get("sent", "true")).lower() == "true"
+
 
 def send_message(to_number: str, message: str):
-    url = f"https://api.ultramsg.com/{INSTANCE}/messages/chat"
+    url = f"{API_URL}/{INSTANCE}/messages/chat"
     payload = {
         "token": TOKEN,
         "to": to_number,       # format: 919876543210 (no + sign)
         "body": message
     }
-    response = requests.post(url, json=payload)
-    return response.json()
+    with timed_send("whatsapp", "ultramsg") as sent, span("whatsapp.send"):
+        response = http_session().post(url, json=payload, timeout=TIMEOUT)
+        if not accepted(response):
+            sent.failed()
+            log.warning("UltraMsg did not accept message to %s: HTTP %s %s",
+                        to_number, response.status_code, response.text[:200])
+        return response.json()
 
 def send_checkin(to_number: str, patient_name: str, day: int):
     message = f"""Hi {patient_name} 👋 This is your Day {day} recovery check-in from CareFlow.
@@ -3,7 +3,7 @@ import { useEffect, useState } from "react";
 import { useParams, useRouter } from "next/navigation";
 import { 
   collection, query, where, 
-  onSnapshot, doc, getDoc, orderBy 
+  onSnapshot, doc, getDoc, getDocs, orderBy 
 } from "firebase/firestore";
 import { db } from "@/lib/db";
 import Link from "next/link";
@@ -35,19 +35,35 @@ export default function PatientDetailPage() {
   const router = useRouter();
   const [patient, setPatient] = useState<FollowupPatient | null>(null);
   const [checkins, setCheckins] = useState<CheckinResponse[]>([]);
+  const [archivedCheckins, setArchivedCheckins] = useState<CheckinResponse[]>([]);
 
   useEffect(() => {
     if (!patientId) return;
 
-    // 1. Fetch Patient Info
+    // 1. Fetch Patient Info (follow-ups completed past the retention
+    //    window are moved to followup_archive by agent/archive.py)
     const fetchPatient = async () => {
-      const d = await getDoc(doc(db, "followup_patients", patientId as string));
+      let d = await getDoc(doc(db, "followup_patients", patientId as string));
+      if (!d.exists()) {
+        d = await getDoc(doc(db, "followup_archive", patientId as string));
+      }
       if (d.exists()) {
         setPatient({ id: d.id, ...d.data() } as FollowupPatient);
       }
     };
     fetchPatient();
 
+    // Older check-ins live in checkin_responses_archive; they no longer change
+    getDocs(query(
+      collection(db, "checkin_responses_archive"),
+      where("patientDocId", "==", patientId)
+    )).then(snap => {
+      setArchivedCheckins(snap.docs.map(d => ({
+        id: d.id,
+        ...d.data()
+      } as unknown as CheckinResponse)));
+    });
+
     // 2. Stream Check-ins (Now from checkin_responses as per spec)
     const q = query(
       collection(db, "checkin_responses"),
@@ -67,6 +83,10 @@ export default function PatientDetailPage() {
 
   if (!patient) return <div className="p-8 text-center text-gray-500">Loading patient details...</div>;
 
+  const hotIds = new Set(checkins.map(c => c.id));
+  const history = [...checkins, ...archivedCheckins.filter(c => !hotIds.has(c.id))]
+    .sort((a, b) => (b.timestamp?.toMillis?.() ?? 0) - (a.timestamp?.toMillis?.() ?? 0));
+
   return (
     <div className="p-8 max-w-4xl mx-auto min-h-screen bg-gray-50">
       <Link href="/doctor/followup" className="text-blue-600 hover:underline mb-6 inline-block font-medium">
@@ -83,18 +103,18 @@ export default function PatientDetailPage() {
         <div className="grid grid-cols-3 gap-4 mt-6">
           <div className="bg-blue-50 border border-blue-100 p-4 rounded-xl text-center">
             <p className="text-sm text-blue-500 font-bold uppercase tracking-wider">Total Check-ins</p>
-            <p className="text-3xl font-black text-blue-800">{checkins.length}</p>
+            <p className="text-3xl font-black text-blue-800">{history.length}</p>
           </div>
           <div className="bg-red-50 border border-red-100 p-4 rounded-xl text-center">
             <p className="text-sm text-red-500 font-bold uppercase tracking-wider">Critical Days</p>
             <p className="text-3xl font-black text-red-800">
-                {checkins.filter(c => c.conditionCategory === "critical").length}
+                {history.filter(c => c.conditionCategory === "critical").length}
             </p>
           </div>
           <div className="bg-green-50 border border-green-100 p-4 rounded-xl text-center">
             <p className="text-sm text-green-500 font-bold uppercase tracking-wider">Normal Days</p>
             <p className="text-3xl font-black text-green-800">
-                {checkins.filter(c => c.conditionCategory === "normal").length}
+                {history.filter(c => c.conditionCategory === "normal").length}
             </p>
           </div>
         </div>
@@ -102,7 +122,7 @@ export default function PatientDetailPage() {
 
       {/* History List */}
       <div className="space-y-6">
-        {checkins.map((checkin) => (
+        {history.map((checkin) => (
           <div 
             key={checkin.id} 
             className={`bg-white rounded-2xl border-2 overflow-hidden shadow-sm transition-all
@@ -2,7 +2,7 @@
 import { useEffect, useState } from "react";
 import {
   collection, onSnapshot, query,
-  where, orderBy, doc, getDoc
+  where, orderBy, doc, getDoc, getDocs, limit
 } from "firebase/firestore";
 import { db } from "@/lib/db"; // Assuming lib/db.ts exports Firestore instance
 
@@ -366,9 +366,12 @@ function PatientFollowupView({
 import CriticalAlertBanner from "@/components/followup/CriticalAlertBanner";
 
 // ─── Main Page ──────────────────────────────────────────────────
+const ARCHIVED_SHOWN = 100;
+
 export default function FollowupDashboard() {
   const [patients, setPatients] = useState<FollowupPatient[]>([]);
   const [filter, setFilter] = useState<"all" | "active" | "completed">("active");
+  const [archived, setArchived] = useState<FollowupPatient[]>([]);
 
   useEffect(() => {
     const q = filter === "all"
@@ -401,6 +404,30 @@ export default function FollowupDashboard() {
     return () => unsub();
   }, [filter]);
 
+  // Follow-ups completed past the retention window are moved to
+  // followup_archive (agent/archive.py); show the most recent ones
+  useEffect(() => {
+    if (filter === "active") {
+      setArchived([]);
+      return;
+    }
+    let cancelled = false;
+    getDocs(query(
+      collection(db, "followup_archive"),
+      orderBy("completedAt", "desc"),
+      limit(ARCHIVED_SHOWN)
+    )).then(snap => {
+      if (cancelled) return;
+      setArchived(snap.docs.map(d => ({
+        id: d.id,
+        ...d.data()
+      } as FollowupPatient)));
+    });
+    return () => { cancelled = true; };
+  }, [filter]);
+
+  const shown = [...patients, ...archived];
+
   return (
     <div className="p-8 max-w-6xl mx-auto min-h-screen bg-gray-50">
       <CriticalAlertBanner />
@@ -428,14 +455,14 @@ export default function FollowupDashboard() {
       </div>
 
       <div className="grid grid-cols-1 gap-6">
-        {patients.map(patient => (
+        {shown.map(patient => (
           <Link key={patient.id} href={`/doctor/followup/${patient.id}`}>
             <PatientRow
               patient={patient}
             />
           </Link>
         ))}
-        {patients.length === 0 && (
+        {shown.length === 0 && (
           <div className="text-center py-24 bg-white rounded-3xl border-4 border-dashed border-gray-100 text-gray-300 font-black text-xl italic uppercase">
             No {filter} patients recorded.
           </div>
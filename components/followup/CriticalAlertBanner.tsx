@@ -2,7 +2,7 @@
 import { useEffect, useState } from "react";
 import { 
   collection, query, where, 
-  onSnapshot, doc, updateDoc 
+  onSnapshot
 } from "firebase/firestore";
 import { db } from "@/lib/db";
 import { motion, AnimatePresence } from "framer-motion";
@@ -43,11 +43,16 @@ export default function CriticalAlertBanner() {
     return () => unsub();
   }, []);
 
+  // Resolved through the agent so the dashboard's unresolved-alert
+  // counters move with it; a direct updateDoc would leave them stale
   const resolveAlert = async (id: string) => {
     try {
-      await updateDoc(doc(db, "critical_alerts", id), {
-        resolved: true,
+      const res = await fetch(`http://localhost:8000/alerts/${encodeURIComponent(id)}/resolve`, {
+        method: "POST",
       });
+      if (!res.ok && res.status !== 404) {
+        throw new Error(`HTTP ${res.status}`);
+      }
     } catch (err) {
       console.error("Failed to resolve alert:", err);
     }